@@ -0,0 +1 @@
+"""Microbenchmarks for the app."""
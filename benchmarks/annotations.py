@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Benchmark creating annotations one request at a time vs. in bulk.
+
+Both variants post the same batch of annotations through the test client:
+once as one POST /api/v1/annotations per annotation, once as a single POST
+/api/v1/annotations/bulk. It needs the test database from TestConfig, and
+creates and drops its tables. Run it from the project root with ::
+
+    python -m benchmarks.annotations --count 500
+"""
+import json
+import time
+from io import BytesIO
+
+import click
+
+from poet.app import create_app
+from poet.database import db
+from poet.models import Annotation, Upload
+from poet.settings import TestConfig
+
+
+def post_json(client, url, data):
+    """Post a JSON body and check that it succeeded."""
+    response = client.post(url, data=json.dumps(data),
+                           content_type='application/json')
+    assert response.status_code == 200, response.data
+
+
+def post_singly(client, items):
+    """Post each annotation in its own request."""
+    for item in items:
+        post_json(client, '/api/v1/annotations', item)
+
+
+def post_bulk(client, items):
+    """Post every annotation in one request."""
+    post_json(client, '/api/v1/annotations/bulk', items)
+
+
+@click.command()
+@click.option('--count', default=500, help='Annotations per run')
+def main(count):
+    """Time both ways of creating COUNT annotations."""
+    app = create_app(TestConfig)
+    # keep the upload annotations need out of poet/local_uploads
+    app.config['STORAGE_BACKEND'] = 'memory'
+    with app.test_request_context():
+        db.create_all()
+        try:
+            upload = Upload.create('benchmark.png', BytesIO(b'benchmark'))
+            items = [{'description': 'annotation {}'.format(i),
+                      'upload_id': str(upload.id),
+                      'category': 'Line Chart'} for i in range(count)]
+            for name, func in (('single', post_singly), ('bulk', post_bulk)):
+                began = time.perf_counter()
+                func(app.test_client(), items)
+                seconds = time.perf_counter() - began
+                assert Annotation.query.count() == count
+                Annotation.query.delete()
+                db.session.commit()
+                click.echo('{:>6}: {:8.3f} s total, {:8.3f} ms/annotation'
+                           .format(name, seconds, seconds / count * 1000))
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""Benchmark per-request boto3 client overhead, fresh vs. pooled.
+
+Each "request" gets an S3 client and presigns a URL, which exercises
+credential resolution, service model loading and request signing without
+touching the network. Run it from the project root with ::
+
+    python -m benchmarks.aws_clients
+"""
+import os
+import timeit
+
+import boto3
+
+from poet.app import create_app
+from poet.extensions import aws
+from poet.settings import TestConfig
+
+REQUESTS = 200
+
+
+def fresh_client_request():
+    """Do one request's S3 work with a brand new client."""
+    s3 = boto3.client('s3')
+    s3.generate_presigned_url(
+        'get_object', Params={'Bucket': 'poet-uploads', 'Key': 'key'})
+
+
+def pooled_client_request():
+    """Do one request's S3 work with the shared client."""
+    s3 = aws.client('s3')
+    s3.generate_presigned_url(
+        'get_object', Params={'Bucket': 'poet-uploads', 'Key': 'key'})
+
+
+def main():
+    """Run both variants and print the per-request cost."""
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    app = create_app(TestConfig)
+    with app.app_context():
+        for name, func in (('fresh', fresh_client_request),
+                           ('pooled', pooled_client_request)):
+            func()  # warm up imports and the registry
+            seconds = timeit.timeit(func, number=REQUESTS)
+            print('{:>6}: {:8.3f} ms/request'.format(
+                name, seconds / REQUESTS * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Benchmark inserting records one by one vs. with CRUDMixin's bulk methods.
+
+Each variant inserts the same annotations: calling `create()` for each (one
+commit per record), calling `create()` for each inside `atomic()` (one
+commit in all), and a single `bulk_create()`. It needs the test database
+from TestConfig, and creates and drops its tables. Run it from the project
+root with ::
+
+    python -m benchmarks.bulk --count 10000
+"""
+import time
+from io import BytesIO
+
+import click
+
+from poet.app import create_app
+from poet.database import atomic, db
+from poet.models import Annotation, Upload
+from poet.settings import TestConfig
+
+
+def create_each(rows):
+    """Create and commit each record in turn."""
+    for row in rows:
+        Annotation.create(**row)
+
+
+def create_atomic(rows):
+    """Create each record in turn, committing once."""
+    with atomic():
+        for row in rows:
+            Annotation.create(**row)
+
+
+def create_bulk(rows):
+    """Insert every record with multi-row INSERTs."""
+    Annotation.bulk_create(rows)
+
+
+@click.command()
+@click.option('--count', default=10000, help='Annotations per run')
+def main(count):
+    """Time each way of creating COUNT annotations."""
+    app = create_app(TestConfig)
+    # keep the upload annotations need out of poet/local_uploads
+    app.config['STORAGE_BACKEND'] = 'memory'
+    with app.test_request_context():
+        db.create_all()
+        try:
+            upload = Upload.create('benchmark.png', BytesIO(b'benchmark'))
+            rows = [{'description': 'annotation {}'.format(i),
+                     'upload_id': upload.id,
+                     'category': 'Line Chart'} for i in range(count)]
+            for name, func in (('create', create_each),
+                               ('atomic', create_atomic),
+                               ('bulk', create_bulk)):
+                began = time.perf_counter()
+                func(rows)
+                seconds = time.perf_counter() - began
+                assert Annotation.query.count() == count
+                Annotation.query.delete()
+                db.session.commit()
+                db.session.expunge_all()
+                click.echo('{:>6}: {:8.3f} s total, {:8.3f} ms/annotation'
+                           .format(name, seconds, seconds / count * 1000))
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
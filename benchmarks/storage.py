@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Benchmark storage backends head to head.
+
+Every backend runs the same workload: save, read whole, read a range,
+check existence and delete, for a number of files of a given size. Run it
+from the project root with ::
+
+    python -m benchmarks.storage --files 200 --size 262144 local memory
+
+Real S3 can be included by naming ``s3`` and setting S3_UPLOADS_BUCKET and
+AWS credentials in the environment.
+"""
+import os
+import tempfile
+import time
+from io import BytesIO
+
+import click
+
+from poet.app import create_app
+from poet.settings import TestConfig
+from poet.storage import BACKENDS
+from poet.storage.base import CHUNK_SIZE
+
+
+def drain(fp):
+    """Read a file to the end in chunks, like a streaming response does."""
+    try:
+        while fp.read(CHUNK_SIZE):
+            pass
+    finally:
+        fp.close()
+
+
+def run_workload(backend, files, size):
+    """Run the workload against a backend.
+
+    :return dict: seconds spent per operation
+    """
+    data = os.urandom(size)
+    timings = {}
+
+    def timed(operation, func):
+        began = time.perf_counter()
+        result = [func(i) for i in range(files)]
+        timings[operation] = time.perf_counter() - began
+        return result
+
+    locations = timed('save', lambda i: backend.save(
+        'benchmark/{}.bin'.format(i), BytesIO(data)))
+    timed('read', lambda i: drain(backend.open(locations[i])[0]))
+    timed('range', lambda i: drain(
+        backend.open(locations[i], start=size // 2, end=size // 2 + 1023)[0]))
+    timed('exists', lambda i: backend.exists(locations[i]))
+    timed('delete', lambda i: backend.delete(locations[i]))
+    return timings
+
+
+@click.command()
+@click.option('--files', default=100, help='Files per operation')
+@click.option('--size', default=256 * 1024, help='Bytes per file')
+@click.argument('backends', nargs=-1)
+def main(files, size, backends):
+    """Benchmark the named backends (default: local, memory, fake-s3)."""
+    backends = backends or ('local', 'memory', 'fake-s3')
+    operations = ('save', 'read', 'range', 'exists', 'delete')
+    click.echo('{:>8}'.format('backend') + ''.join(
+        '{:>10}'.format(operation) for operation in operations) +
+        '   (ms/file)')
+    with tempfile.TemporaryDirectory() as uploads_dir:
+        app = create_app(TestConfig)
+        app.config['UPLOADS_DIR'] = uploads_dir
+        with app.app_context():
+            for name in backends:
+                backend = BACKENDS[name].from_config(app.config)
+                timings = run_workload(backend, files, size)
+                click.echo('{:>8}'.format(name) + ''.join(
+                    '{:10.3f}'.format(timings[operation] / files * 1000)
+                    for operation in operations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""Gunicorn settings shared by the Procfile and the Dockerfile."""
+import os
+import shutil
+
+# every worker writes its Prometheus metrics here, for /metrics to merge
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                                    '/tmp/poet-metrics')
+
+
+def on_starting(server):
+    """Start with no metrics left over from a previous run."""
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def child_exit(server, worker):
+    """Drop a dead worker's live gauges, like requests in flight."""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_worker_init(worker):
+    """Start the password hashing pool before the worker starts threads."""
+    from poet.extensions import hasher
+    with worker.wsgi.app_context():
+        hasher.start()
@@ -1,19 +1,53 @@
 # -*- coding: utf-8 -*-
 """The API module for annotations."""
-from flask import jsonify, request
+import datetime as dt
+import uuid
+
+from flask import Response, current_app, jsonify, request, stream_with_context
 from flask_login import current_user
+from sqlalchemy import tuple_
+from webargs import fields, validate
+from webargs.flaskparser import use_args
 
-from poet.errors import NotFound
+from poet.caching import cached_resource
+from poet.database import db
+from poet.errors import (BadRequest, NotFound, RequestEntityTooLarge,
+                         UnprocessableEntity)
 from poet.locales import Errors, Success
 from poet.models import Annotation, Upload
-from poet.utils import RESTBlueprint
+from poet.utils import (RESTBlueprint, decode_cursor, encode_cursor,
+                        get_ids_arg)
 
+from .export import EXPORT_FORMATS, Export, export_query
 from .schema import AnnotationSchema
 
 
 blueprint = RESTBlueprint('annotations', __name__, version='v1')
 
 
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+list_annotations_args = {
+    'upload_id': fields.UUID(),
+    'user_id': fields.UUID(),
+    'category': fields.Str(),
+    'created_after': fields.DateTime(),
+    'created_before': fields.DateTime(),
+    'cursor': fields.Str(),
+    'limit': fields.Int(missing=DEFAULT_PAGE_SIZE,
+                        validate=validate.Range(min=1, max=MAX_PAGE_SIZE)),
+}
+
+export_annotations_args = {
+    'format': fields.Str(missing='ndjson',
+                         validate=validate.OneOf(sorted(EXPORT_FORMATS))),
+    'category': fields.Str(),
+    'since': fields.DateTime(),
+    'since_id': fields.UUID(),
+}
+
+
 def get_annotation_by_id(annotation_id):
     """Get an annotation given its ID or bail via some API error."""
     annotation = Annotation.find(annotation_id)
@@ -25,7 +59,55 @@ def get_annotation_by_id(annotation_id):
 @blueprint.find()
 def find_annotation(uid):
     """Find an annotation based on its ID."""
-    return jsonify(data=AnnotationSchema().dump(get_annotation_by_id(uid)).data)
+    return cached_resource(Annotation, uid, lambda: AnnotationSchema().dump(
+        get_annotation_by_id(uid)).data)
+
+
+@blueprint.list()
+@use_args(list_annotations_args)
+def list_annotations(args):
+    """List annotations, newest first, a page at a time.
+
+    Pages are keyed on (created_at, id) rather than an offset: the response's
+    `next_cursor` is passed back as `cursor` to get the following page, which
+    costs the same however deep it is.
+
+    An `ids` argument of comma separated IDs fetches exactly those
+    annotations instead, in that order, listing any that don't exist under
+    `missing`.
+    """
+    query = Annotation.eager(*AnnotationSchema.eager_load)
+    ids = get_ids_arg()
+    if ids is not None:
+        annotations, missing = Annotation.find_many(
+            ids, query=query,
+            dump=lambda annotation: AnnotationSchema().dump(annotation).data)
+        return jsonify(data=annotations, missing=missing)
+    for name in ('upload_id', 'user_id', 'category'):
+        if name in args:
+            query = query.filter(getattr(Annotation, name) == args[name])
+    if 'created_after' in args:
+        query = query.filter(Annotation.created_at >= args['created_after'])
+    if 'created_before' in args:
+        query = query.filter(Annotation.created_at < args['created_before'])
+    if 'cursor' in args:
+        try:
+            position = decode_cursor(args['cursor'])
+        except ValueError:
+            raise BadRequest(Errors.BAD_CURSOR)
+        query = query.filter(
+            tuple_(Annotation.created_at, Annotation.id) < position)
+
+    limit = args['limit']
+    annotations = query.order_by(Annotation.created_at.desc(),
+                                 Annotation.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(annotations) > limit:
+        annotations = annotations[:limit]
+        last = annotations[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return jsonify(data=AnnotationSchema(many=True).dump(annotations).data,
+                   next_cursor=next_cursor)
 
 
 @blueprint.create()
@@ -41,3 +123,81 @@ def create_annotation():
     annotation = Annotation.create(user=annotation_user, **annotation_data)
     return jsonify(data=AnnotationSchema().dump(annotation).data,
                    message=Success.ANNOTATION_CREATED)
+
+
+@blueprint.flexible_route('/bulk', methods=['POST'])
+def create_annotations():
+    """Create many annotations at once.
+
+    The body is a list of annotations. Valid items are inserted together in
+    one statement and one transaction; each item gets a result in the same
+    position in the response, with either the created annotation's ID or the
+    reason it was skipped. If every item was skipped, the response is a 422.
+    """
+    items = request.get_json()
+    if not isinstance(items, list):
+        raise UnprocessableEntity(Errors.LIST_REQUIRED)
+    if len(items) > current_app.config['ANNOTATIONS_BULK_MAX']:
+        raise RequestEntityTooLarge(Errors.TOO_MANY_ITEMS)
+
+    # load item by item so one bad annotation doesn't sink the others
+    schema = AnnotationSchema(strict=False)
+    loaded = [schema.load(item) for item in items]
+    upload_ids = set(result.data['upload_id'] for result in loaded
+                     if not result.errors)
+    existing_upload_ids = set()
+    if upload_ids:
+        existing_upload_ids = set(
+            upload_id for upload_id, in db.session.query(Upload.id)
+            .filter(Upload.id.in_(upload_ids)))
+
+    user_id = current_user.id if current_user.is_authenticated else None
+    now = dt.datetime.utcnow()
+    rows, results = [], []
+    for result in loaded:
+        if result.errors:
+            error = UnprocessableEntity(('data-validation-error',
+                                         result.errors))
+            results.append(dict(error.to_dict(), status=error.status_code))
+        elif result.data['upload_id'] not in existing_upload_ids:
+            error = NotFound(Errors.RESOURCE_NOT_FOUND)
+            results.append(dict(error.to_dict(), status=error.status_code))
+        else:
+            row = {'id': uuid.uuid4(),
+                   'upload_id': result.data['upload_id'],
+                   'user_id': user_id,
+                   'description': result.data['description'],
+                   'category': result.data.get('category'),
+                   'created_at': now}
+            rows.append(row)
+            results.append({'status': 201, 'id': str(row['id'])})
+    if not rows:
+        return jsonify(data=results,
+                       message=Errors.ANNOTATIONS_NOT_CREATED), 422
+    Annotation.bulk_create(rows)
+    return jsonify(data=results, message=Success.ANNOTATIONS_CREATED)
+
+
+@blueprint.read_only_route('/export', methods=['GET'])
+@use_args(export_annotations_args)
+def export_annotations(args):
+    """Stream every annotation, oldest first, as NDJSON or CSV.
+
+    The response is gzipped for clients that accept it. To resume an export
+    that was cut off, pass the created_at and id of the last annotation
+    received as `since` and `since_id`.
+    """
+    export = Export(
+        export_query(since=args.get('since'), since_id=args.get('since_id'),
+                     category=args.get('category')),
+        fmt=args['format'],
+        gzip='gzip' in request.accept_encodings,
+        batch_size=current_app.config['ANNOTATIONS_EXPORT_BATCH_SIZE'])
+    response = Response(stream_with_context(iter(export)),
+                        mimetype=export.mimetype)
+    response.headers['Content-Disposition'] = \
+        'attachment; filename=annotations.{}'.format(args['format'])
+    response.vary.add('Accept-Encoding')
+    if export.gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
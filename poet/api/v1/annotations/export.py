@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Streaming exports of annotations, for training models on."""
+import csv
+import datetime as dt
+import io
+import json
+import zlib
+
+from sqlalchemy import tuple_
+
+from poet.database import db
+from poet.models import Annotation, Upload
+
+#: The fields of each exported annotation, in CSV column order
+EXPORT_FIELDS = ('id', 'created_at', 'upload_id', 'filename', 'cdn_link',
+                 'description', 'category')
+
+#: The mimetype of each export format
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+#: Bytes of output gathered before a chunk is emitted
+CHUNK_SIZE = 64 * 1024
+
+
+def to_naive_utc(value):
+    """Convert an aware datetime to the naive UTC the database stores."""
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(dt.timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def export_query(since=None, since_id=None, category=None):
+    """Query the columns of an export, oldest annotation first.
+
+    Annotations are ordered by (created_at, id), so the last one exported is
+    a watermark: passing its created_at and id as ``since`` and ``since_id``
+    exports exactly the annotations that came after it.
+
+    :param since datetime: (default: None) only export annotations created
+        after this
+    :param since_id UUID: (default: None) with ``since``, also export
+        annotations created at ``since`` whose IDs sort after this
+    :param category string: (default: None) only export this category
+    :return Query: a query of rows with the export's columns
+    """
+    query = db.session.query(
+        Annotation.id, Annotation.created_at, Annotation.upload_id,
+        Upload.filename, Upload.retrieval_location, Annotation.description,
+        Annotation.category).join(Annotation.upload)
+    if category is not None:
+        query = query.filter(Annotation.category == category)
+    since = to_naive_utc(since)
+    if since is not None and since_id is not None:
+        query = query.filter(
+            tuple_(Annotation.created_at, Annotation.id) > (since, since_id))
+    elif since is not None:
+        query = query.filter(Annotation.created_at > since)
+    return query.order_by(Annotation.created_at, Annotation.id)
+
+
+class Export(object):
+    """An export of annotations, produced as chunks of bytes.
+
+    Rows are read through a server-side cursor a batch at a time and
+    encoded as they arrive, so memory use stays flat however many
+    annotations there are. The export remembers the last annotation it
+    wrote, for resuming from.
+    """
+
+    def __init__(self, query, fmt='ndjson', gzip=False, batch_size=1000):
+        """Describe an export.
+
+        :param query Query: the rows to export, from `export_query`
+        :param fmt string: (default: 'ndjson') 'ndjson' or 'csv'
+        :param gzip bool: (default: False) whether to gzip the output
+        :param batch_size int: (default: 1000) rows fetched per round trip
+        """
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError('Unknown export format {!r}'.format(fmt))
+        self.query = query
+        self.format = fmt
+        self.gzip = gzip
+        self.batch_size = batch_size
+        self.count = 0
+        self.last = None
+
+    @property
+    def mimetype(self):
+        """The mimetype of the export, before any gzipping."""
+        return EXPORT_FORMATS[self.format]
+
+    def records(self):
+        """Yield each annotation as a dict of EXPORT_FIELDS."""
+        for row in self.query.yield_per(self.batch_size):
+            self.count += 1
+            self.last = (row.created_at, row.id)
+            yield {
+                'id': str(row.id),
+                'created_at': row.created_at.isoformat(),
+                'upload_id': str(row.upload_id),
+                'filename': row.filename,
+                'cdn_link': Upload.make_cdn_link(row.retrieval_location),
+                'description': row.description,
+                'category': row.category,
+            }
+
+    def lines(self):
+        """Yield the export as text, a line at a time."""
+        if self.format == 'ndjson':
+            for record in self.records():
+                yield json.dumps(record) + '\n'
+            return
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, EXPORT_FIELDS)
+        writer.writeheader()
+        for record in self.records():
+            writer.writerow(record)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    def __iter__(self):
+        """Yield the export as chunks of (possibly gzipped) bytes."""
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) \
+            if self.gzip else None
+        pending, size = [], 0
+        for line in self.lines():
+            pending.append(line)
+            size += len(line)
+            if size >= CHUNK_SIZE:
+                yield self._encode(pending, compressor)
+                pending, size = [], 0
+        chunk = self._encode(pending, compressor)
+        if compressor is not None:
+            chunk += compressor.flush()
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def _encode(lines, compressor):
+        """Encode lines, compressing them if need be."""
+        data = ''.join(lines).encode('utf-8')
+        if compressor is None:
+            return data
+        # flush, so each chunk can be decompressed as soon as it arrives
+        return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
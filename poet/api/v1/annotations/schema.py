@@ -15,6 +15,9 @@ class AnnotationSchema(Schema):
     upload = fields.Nested(UploadSchema, dump_only=True)
     upload_id = fields.UUID(load_only=True, required=True)
 
+    #: the relationships dumped above, to load eagerly with Model.eager
+    eager_load = ('upload',)
+
     class Meta:
         type_ = 'annotations'
         strict = True
@@ -1,14 +1,18 @@
 # -*- coding: utf-8 -*-
 """The API module for emails."""
-import boto3
-from flask import current_app, jsonify, render_template
-from webargs import fields
+from flask import current_app, jsonify
+from webargs import fields, validate
 from webargs.flaskparser import use_args
 
 from poet.api.v1.annotations.api import get_annotation_by_id
+from poet.errors import NotFound, RequestEntityTooLarge
 from poet.locales import Errors, Success
+from poet.models import Annotation, EmailJob
 from poet.utils import RESTBlueprint
 
+from .queue import queue
+from .schema import EmailJobSchema
+
 
 blueprint = RESTBlueprint('emails', __name__, version='v1')
 
@@ -19,81 +23,53 @@ send_email_args = {
 }
 
 
-def generate_email_body(annotation):
-    """Generate an email body from an annotation.
-
-    :param annotation Annotation: the annotation from which the email body
-        should be generated
-    :return string: An HTML formatted string for the email body
-    """
-    return render_template('annotation-email.html', annotation=annotation)
-
-
-def send_email(annotation, email):
-    """Send an email with the annotation.
-
-    :param annotation Annotation: the annotation from which the body of the
-        email should be created.
-    :param email string: the email to send to
-    :return bool: whether or not the email could be sent
-    """
-    body = generate_email_body(annotation)
-    if current_app.config['SEND_EMAILS']:
-        return send_ses_email(body, email)
-    else:
-        return simulate_email_server()
+send_batch_email_args = {
+    'to_emails': fields.List(fields.Email(), required=True,
+                             validate=validate.Length(min=1)),
+    'annotation_ids': fields.List(fields.UUID(), required=True,
+                                  validate=validate.Length(min=1)),
+}
 
 
-def simulate_email_server():
-    """Simulate sending an email.
+@blueprint.create()
+@use_args(send_email_args)
+def create_email(args):
+    """Queue an email with an annotation.
 
-    There could be many things that go wrong with sending an email. Let's
-    pretend that sending an email have a 5% failure rate.
+    The email is sent in the background; its job can be polled to find out
+    whether it was delivered.
     """
-    import random
-    # 5% chance of failure
-    if random.random() < 0.05:
-        return False
-    else:
-        return True
+    annotation = get_annotation_by_id(args['annotation_id'])
+    job = queue.enqueue(annotation, args['to_email'])
+    return jsonify(data=EmailJobSchema().dump(job).data,
+                   message=Success.EMAIL_QUEUED), 202
 
 
-def send_ses_email(body, dest_email):
-    """Send an email via AWS SES.
+@blueprint.flexible_route('/batch', methods=['POST'])
+@use_args(send_batch_email_args)
+def create_batch_email(args):
+    """Queue every annotation for every address in one request.
 
-    :param body string: the formatted HTML body of the email
-    :param dest_email string: the destination email address
-    :return bool: whether or not the email could be sent
+    Workers send the emails for each annotation together, rendering it once.
     """
-    try:
-        ses_client = boto3.client('ses', region_name='us-east-1')
-        ses_client.send_email(
-            Source=current_app.config['FROM_EMAIL'],
-            Destination={
-                'ToAddresses': [dest_email],
-            },
-            Message={
-                'Subject': {
-                    'Data': current_app.config['EMAIL_SUBJECT']
-                },
-                'Body': {
-                    'Html': {
-                        'Data': body
-                    }
-                }
-            }
-        )
-        return True
-    except:
-        raise
-
-
-@blueprint.create()
-@use_args(send_email_args)
-def create_email(args):
-    """Send an email with an annotation based."""
-    annotation = get_annotation_by_id(args['annotation_id'])
-    if send_email(annotation=annotation, email=args['to_email']):
-        return jsonify(message=Success.EMAIL_SENT), 200
-    else:
-        return jsonify(message=Errors.UNKNOWN_ERROR), 500
+    to_emails = list(dict.fromkeys(args['to_emails']))
+    annotation_ids = list(dict.fromkeys(args['annotation_ids']))
+    if len(to_emails) * len(annotation_ids) > \
+            current_app.config['EMAIL_BATCH_MAX']:
+        raise RequestEntityTooLarge(Errors.TOO_MANY_ITEMS)
+    annotations, missing = Annotation.find_many(annotation_ids)
+    if missing:
+        raise NotFound(Errors.RESOURCE_NOT_FOUND)
+    job_ids = queue.enqueue_many(annotations, to_emails)
+    return jsonify(data=[{'id': str(job_id), 'status': EmailJob.QUEUED}
+                         for job_id in job_ids],
+                   message=Success.EMAIL_QUEUED), 202
+
+
+@blueprint.find()
+def find_email(uid):
+    """Find an email job to see whether it has been sent."""
+    job = EmailJob.find(uid)
+    if job is None:
+        raise NotFound(Errors.RESOURCE_NOT_FOUND)
+    return jsonify(data=EmailJobSchema().dump(job).data)
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""A database-backed queue for delivering annotation emails."""
+import datetime as dt
+import os
+import threading
+import uuid
+
+from flask import current_app
+
+from poet.database import db
+from poet.models import EmailJob
+from poet.utils import FlaskThread
+
+from .sending import send_emails
+
+
+def deliver_next():
+    """Claim the next due email jobs and try to send them.
+
+    Up to EMAIL_GROUP_SIZE jobs for the same annotation are claimed at once,
+    so the annotation is rendered once for all of them.
+
+    :return list: the jobs that were worked on; empty if none were due
+    """
+    config = current_app.config
+    jobs = EmailJob.claim_next(config['EMAIL_JOB_LEASE'],
+                               limit=config['EMAIL_GROUP_SIZE'])
+    # jobs claimed by workers that died before finishing too many times
+    for job in jobs:
+        if job.attempts > config['EMAIL_MAX_ATTEMPTS']:
+            job.update(status=EmailJob.FAILED)
+    sendable = [job for job in jobs if job.status == EmailJob.SENDING]
+    if sendable:
+        try:
+            errors = send_emails(sendable[0].annotation_id,
+                                 [job.to_email for job in sendable])
+        except Exception as exc:  # noqa: B902
+            current_app.logger.exception('Could not send %r', sendable)
+            db.session.rollback()
+            errors = [repr(exc)] * len(sendable)
+        for job, error in zip(sendable, errors):
+            if error is None:
+                job.mark_sent(commit=False)
+            else:
+                job.mark_failed(error, config['EMAIL_MAX_ATTEMPTS'],
+                                config['EMAIL_RETRY_BACKOFF'], commit=False)
+    db.session.commit()
+    return jobs
+
+
+def work(stop, wake, burst=False):
+    """Deliver email jobs until told to stop.
+
+    :param stop Event: set to make the worker exit
+    :param wake Event: set to make an idle worker look for jobs right away
+    :param burst bool: (default: False) exit once no jobs are due instead of
+        waiting for more
+    """
+    poll_interval = current_app.config['EMAIL_POLL_INTERVAL']
+    while not stop.is_set():
+        try:
+            jobs = deliver_next()
+        except Exception:  # noqa: B902
+            current_app.logger.exception('Email worker failed')
+            jobs = []
+        finally:
+            db.session.remove()
+        if not jobs:
+            if burst:
+                return
+            wake.wait(poll_interval)
+            wake.clear()
+
+
+class EmailQueue(object):
+    """Enqueues email jobs and runs per-process worker threads for them.
+
+    EMAIL_WORKERS threads are started in each process on the first enqueue,
+    and started again after a fork. With EMAIL_WORKERS at 0 nothing is sent
+    in the web process, and `flask email-worker` does the sending instead.
+    """
+
+    def __init__(self):
+        """Create the queue; worker threads are started on first use."""
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._workers = []
+
+    def enqueue(self, annotation, to_email):
+        """Queue an annotation email and return its job."""
+        job = EmailJob.create(annotation=annotation, to_email=to_email)
+        self._start_workers()
+        self._wake.set()
+        return job
+
+    def enqueue_many(self, annotations, to_emails):
+        """Queue every annotation for every address in one insert.
+
+        :param annotations list: the annotations to send
+        :param to_emails list: the addresses to send each annotation to
+        :return list: the IDs of the queued jobs
+        """
+        now = dt.datetime.utcnow()
+        rows = [{'id': uuid.uuid4(), 'annotation_id': annotation.id,
+                 'to_email': to_email, 'status': EmailJob.QUEUED,
+                 'attempts': 0, 'created_at': now, 'next_attempt_at': now}
+                for annotation in annotations for to_email in to_emails]
+        EmailJob.bulk_create(rows, commit=False)
+        # the workers can only claim jobs once they are committed
+        db.session.commit()
+        self._start_workers()
+        self._wake.set()
+        return [row['id'] for row in rows]
+
+    def stop(self):
+        """Stop this process's workers once they finish their current job."""
+        with self._lock:
+            self._stop.set()
+            self._wake.set()
+            for worker in self._workers:
+                worker.join()
+            self._workers = []
+            self._stop.clear()
+
+    def _start_workers(self):
+        """Start this process's workers if they aren't running yet."""
+        with self._lock:
+            if self._pid == os.getpid() and self._workers:
+                return
+            self._pid = os.getpid()
+            self._workers = [
+                FlaskThread(target=work, args=(self._stop, self._wake),
+                            name='email-worker-{}'.format(i), daemon=True)
+                for i in range(current_app.config['EMAIL_WORKERS'])]
+            for worker in self._workers:
+                worker.start()
+
+
+queue = EmailQueue()
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""Email job schema."""
+from marshmallow import Schema, fields
+
+
+class EmailJobSchema(Schema):
+    """The base schema for an email job."""
+
+    id = fields.UUID(dump_only=True)
+    created_at = fields.DateTime(dump_only=True)
+    status = fields.Str(dump_only=True)
+    attempts = fields.Int(dump_only=True)
+    next_attempt_at = fields.DateTime(dump_only=True)
+    sent_at = fields.DateTime(dump_only=True)
+
+    class Meta:
+        type_ = 'emails'
+        strict = True
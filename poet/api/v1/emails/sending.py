@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""Rendering and sending annotation emails."""
+import hashlib
+import json
+
+from botocore.exceptions import ClientError
+from flask import current_app
+
+from poet.caching import email_body_cache_key
+from poet.extensions import aws, cache
+from poet.models import Annotation
+from poet.utils import TokenBucket
+
+EMAIL_TEMPLATE = 'annotation-email.html'
+
+#: SES takes at most this many destinations in one bulk call
+SES_MAX_DESTINATIONS = 50
+
+#: SES templates this process knows exist
+created_ses_templates = set()
+
+
+def load_email_template(app):
+    """Compile the email template before the first email needs it.
+
+    The template's source is fingerprinted too, so that cached bodies
+    rendered from an older version of it are never sent.
+    """
+    source, _, _ = app.jinja_env.loader.get_source(app.jinja_env,
+                                                   EMAIL_TEMPLATE)
+    app.jinja_env.get_template(EMAIL_TEMPLATE)
+    app.extensions['email_template_version'] = hashlib.sha1(
+        source.encode('utf-8')).hexdigest()[:12]
+
+
+def generate_email_body(annotation):
+    """Generate an email body from an annotation.
+
+    :param annotation Annotation: the annotation from which the email body
+        should be generated
+    :return string: An HTML formatted string for the email body
+    """
+    context = {'annotation': annotation}
+    current_app.update_template_context(context)
+    return current_app.jinja_env.get_template(EMAIL_TEMPLATE).render(context)
+
+
+def get_email_body(annotation_id):
+    """Return an annotation's email body, rendering it only if not cached.
+
+    Bodies are cached with the template version they were rendered from
+    and dropped whenever the annotation is saved, so a cached body is only
+    ever stale if the upload it shows changes. A cache hit does no template
+    or database work at all.
+
+    Like the find endpoints, bodies are only cached when CACHE_RESOURCES is
+    on: saves drop them only from the cache they are made in, so a cache
+    per process would keep sending the old body from the others.
+
+    :param annotation_id UUID: the annotation's ID
+    :return string: An HTML formatted string for the email body
+    """
+    config = current_app.config
+    if not config['CACHE_RESOURCES']:
+        return generate_email_body(Annotation.eager('upload').get(
+            annotation_id))
+    key = email_body_cache_key(annotation_id)
+    version = current_app.extensions['email_template_version']
+    cached = cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    annotation = Annotation.eager('upload').get(annotation_id)
+    body = generate_email_body(annotation)
+    cache.set(key, (version, body), timeout=config['EMAIL_BODY_CACHE_TIMEOUT'])
+    return body
+
+
+def send_email(annotation, email):
+    """Send an email with the annotation.
+
+    :param annotation Annotation: the annotation from which the body of the
+        email should be created.
+    :param email string: the email to send to
+    :return bool: whether or not the email could be sent
+    """
+    return send_emails(annotation.id, [email])[0] is None
+
+
+def send_emails(annotation_id, emails):
+    """Send an annotation to many addresses, rendering its body once.
+
+    :param annotation_id UUID: the ID of the annotation from which the body
+        of the emails should be created.
+    :param emails list: the emails to send to
+    :return list: for each email, None if it was sent or else why not
+    """
+    body = get_email_body(annotation_id)
+    if current_app.config['SEND_EMAILS']:
+        return send_ses_emails(body, emails)
+    return [None if simulate_email_server() else 'The email could not be sent.'
+            for _ in emails]
+
+
+def simulate_email_server():
+    """Simulate sending an email.
+
+    There could be many things that go wrong with sending an email. Let's
+    pretend that sending an email have a 5% failure rate.
+    """
+    import random
+    # 5% chance of failure
+    if random.random() < 0.05:
+        return False
+    else:
+        return True
+
+
+def send_ses_emails(body, dest_emails):
+    """Send an email body to many addresses via AWS SES.
+
+    Each address gets its own email, sent through SES's bulk templated API
+    up to SES_MAX_DESTINATIONS at a time. Sends are paced to this process's
+    share of the account's send quota (see `get_send_rate`).
+
+    :param body string: the formatted HTML body of the email
+    :param dest_emails list: the destination email addresses
+    :return list: for each address, None if it was sent or else why not
+    """
+    config = current_app.config
+    ses_client = aws.client('ses', region_name='us-east-1')
+    ensure_ses_template(ses_client)
+    template_data = json.dumps({'subject': config['EMAIL_SUBJECT'],
+                                'body': body})
+    rate_limiter = get_send_rate_limiter()
+    errors = []
+    for start in range(0, len(dest_emails), SES_MAX_DESTINATIONS):
+        chunk = dest_emails[start:start + SES_MAX_DESTINATIONS]
+        rate_limiter.acquire(len(chunk))
+        response = ses_client.send_bulk_templated_email(
+            Source=config['FROM_EMAIL'],
+            Template=config['EMAIL_SES_TEMPLATE'],
+            DefaultTemplateData=template_data,
+            Destinations=[{'Destination': {'ToAddresses': [email]}}
+                          for email in chunk])
+        errors.extend(
+            None if status['Status'] == 'Success'
+            else status.get('Error') or status['Status']
+            for status in response['Status'])
+    return errors
+
+
+def ensure_ses_template(ses_client):
+    """Create the SES template emails are sent with, once per process.
+
+    The template just fills in a subject and an HTML body rendered here, so
+    the body template stays in Jinja with the rest of the app's templates.
+    """
+    name = current_app.config['EMAIL_SES_TEMPLATE']
+    if name in created_ses_templates:
+        return
+    try:
+        ses_client.create_template(Template={
+            'TemplateName': name,
+            'SubjectPart': '{{subject}}',
+            'HtmlPart': '{{{body}}}',
+        })
+    except ClientError as error:
+        if error.response['Error']['Code'] != 'AlreadyExists':
+            raise
+    created_ses_templates.add(name)
+
+
+def get_send_rate():
+    """Return the emails a second this process may send.
+
+    The bucket pacing sends is per process, so each gets SES_MAX_SEND_RATE
+    if it is set, or else an even share of the account's quota:
+    SES_SEND_QUOTA divided by SES_SENDING_PROCESSES.
+    """
+    config = current_app.config
+    if config['SES_MAX_SEND_RATE']:
+        return config['SES_MAX_SEND_RATE']
+    return config['SES_SEND_QUOTA'] / max(config['SES_SENDING_PROCESSES'], 1)
+
+
+def get_send_rate_limiter():
+    """Return the app's token bucket for pacing SES sends in this process."""
+    rate_limiter = current_app.extensions.get('ses_rate_limiter')
+    if rate_limiter is None:
+        rate_limiter = current_app.extensions.setdefault(
+            'ses_rate_limiter', TokenBucket(get_send_rate()))
+    return rate_limiter
@@ -1,20 +1,35 @@
 # -*- coding: utf-8 -*-
 """The API module for uploads."""
+import mimetypes
+import os
+
 from botocore.exceptions import ClientError
-from flask import request, jsonify, send_file
+from flask import current_app, redirect, request, jsonify, send_file
+from werkzeug.datastructures import FileStorage
+from werkzeug.http import is_resource_modified
+from werkzeug.urls import url_quote
 from werkzeug.utils import secure_filename
+from werkzeug.wsgi import FileWrapper, wrap_file
 
-from poet.errors import (BadRequest, NotFound, UnsupportedMediaType,
+from poet.caching import cached_resource
+from poet.errors import (BadRequest, NotFound, RangeNotSatisfiable,
+                         RequestEntityTooLarge, UnsupportedMediaType,
                          UnprocessableEntity)
+from poet.extensions import storage
 from poet.locales import Errors
+from poet.metrics import count_upload_bytes
 from poet.models import Upload
-from poet.utils import RESTBlueprint
+from poet.renditions import get_rendition, schedule_renditions
+from poet.utils import RESTBlueprint, friendly_arg_get, get_ids_arg
 
 from .schema import UploadSchema
 
 
 ALLOWED_EXTENSIONS = set(['jpg', 'jpe', 'jpeg', 'png', 'gif', 'svg', 'bmp'])
 
+# retrieval modes that send the client elsewhere instead of proxying bytes
+REDIRECT_RETRIEVAL_MODES = set(['cdn', 'presigned'])
+
 blueprint = RESTBlueprint('uploads', __name__, version='v1')
 
 
@@ -32,32 +47,286 @@ def get_upload_by_id(upload_id):
     return upload
 
 
+@blueprint.list()
+def list_uploads():
+    """Find the uploads with the comma separated IDs in the `ids` argument."""
+    ids = get_ids_arg()
+    if ids is None:
+        raise BadRequest(Errors.IDS_REQUIRED)
+    uploads, missing = Upload.find_many(
+        ids, dump=lambda upload: UploadSchema().dump(upload).data)
+    return jsonify(data=uploads, missing=missing)
+
+
 @blueprint.find()
 def find_upload(uid):
     """Find an upload based on its ID."""
-    return jsonify(data=UploadSchema().dump(get_upload_by_id(uid)).data)
+    return cached_resource(
+        Upload, uid, lambda: UploadSchema().dump(get_upload_by_id(uid)).data)
+
+
+class StoredFile(object):
+    """What the file-serving helpers need to know about a stored file."""
+
+    def __init__(self, location, filename, etag, last_modified,
+                 mimetype=None, size=None):
+        """Describe the file at ``location`` in the storage backend.
+
+        :param location string: the file's location in storage
+        :param filename string: the name to send the file as
+        :param etag string: a strong ETag for the file's bytes, or None
+        :param last_modified datetime: when the file was created
+        :param mimetype string: (default: None) the mimetype, or None to
+            guess it from the filename
+        :param size int: (default: None) the size in bytes, if known without
+            asking storage
+        """
+        self.location = location
+        self.filename = filename
+        self.etag = etag
+        self.last_modified = last_modified
+        self.mimetype = (mimetype or mimetypes.guess_type(filename)[0] or
+                         'application/octet-stream')
+        self._size = size
+
+    @classmethod
+    def for_upload(cls, upload):
+        """Describe an upload's original file."""
+        return cls(upload.retrieval_location, upload.filename,
+                   upload.blob_sha256, upload.created_at,
+                   size=upload.blob.size if upload.blob else None)
+
+    @classmethod
+    def for_rendition(cls, upload, rendition):
+        """Describe a resized rendition of an upload's file."""
+        return cls(rendition.locate(), rendition.filename, rendition.etag,
+                   upload.created_at, mimetype=rendition.mimetype)
+
+    def size(self):
+        """Return the size of the file in bytes."""
+        if self._size is None:
+            self._size = storage.backend.size(self.location)
+        return self._size
+
+
+def if_range_matches(stored_file):
+    """Return True unless an If-Range header says the client's copy is stale.
+
+    :param stored_file StoredFile: the file being requested
+    """
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == stored_file.etag
+    if if_range.date is not None:
+        return if_range.date == \
+            stored_file.last_modified.replace(microsecond=0)
+    return True
+
+
+def make_file_response(stored_file, body=None):
+    """Create a response sending a file as an attachment, with validators."""
+    response = current_app.response_class(
+        body, mimetype=stored_file.mimetype, direct_passthrough=True)
+    response.headers.add('Content-Disposition', 'attachment',
+                         filename=stored_file.filename)
+    if stored_file.etag is not None:
+        response.set_etag(stored_file.etag)
+    response.last_modified = stored_file.last_modified
+    response.accept_ranges = 'bytes'
+    return response
+
+
+def sendfile_stored_file(stored_file, local_path):
+    """Build a response that has the web server send a local file.
+
+    Python never touches the file's bytes: nginx or Apache reads the file
+    named in the X-Accel-Redirect or X-Sendfile header and takes care of
+    ranges itself.
+
+    :param stored_file StoredFile: the file to send
+    :param local_path string: the absolute path of the file
+    :return Response: an empty response with the sendfile header
+    """
+    if not os.path.isfile(local_path):
+        raise FileNotFoundError(local_path)
+    response = make_file_response(stored_file)
+    config = current_app.config
+    if config['UPLOAD_SENDFILE'] == 'x-accel-redirect':
+        relative_path = os.path.relpath(local_path, config['UPLOADS_DIR'])
+        response.headers['X-Accel-Redirect'] = url_quote(
+            config['UPLOAD_ACCEL_REDIRECT_PREFIX'].rstrip('/') + '/' +
+            relative_path.replace(os.sep, '/'))
+    else:
+        response.headers['X-Sendfile'] = local_path
+    return response
+
+
+def stream_stored_file(stored_file):
+    """Build a response that streams a stored file in bounded chunks.
+
+    Only one chunk of the file is held in memory at a time, no matter how big
+    the file is. Conditional requests against the ETag or the creation time
+    get a 304, and a single byte range is served as a ranged read from
+    storage with a 206.
+
+    :param stored_file StoredFile: the file to send
+    :return Response: a streaming response with the file as an attachment
+    """
+    if not is_resource_modified(request.environ, etag=stored_file.etag,
+                                last_modified=stored_file.last_modified):
+        response = make_file_response(stored_file)
+        response.status_code = 304
+        return response
+
+    local_path = storage.backend.local_path(stored_file.location)
+    if local_path is not None and current_app.config['UPLOAD_SENDFILE']:
+        return sendfile_stored_file(stored_file, local_path)
+
+    start, end, content_range = 0, None, None
+    if request.range is not None and if_range_matches(stored_file):
+        size = stored_file.size()
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None:
+            err = RangeNotSatisfiable(Errors.RANGE_NOT_SATISFIABLE)
+            return jsonify(err.to_dict()), err.status_code, {
+                'Content-Range': 'bytes */{}'.format(size)}
+        start, end = byte_range[0], byte_range[1] - 1
+        content_range = request.range.to_content_range_header(size)
+
+    file_fp, content_length = storage.backend.open(
+        stored_file.location, start=start, end=end)
+    chunk_size = current_app.config['UPLOAD_STREAM_CHUNK_SIZE']
+    if local_path is not None and content_range is None:
+        # a whole local file is a real file object, which lets the WSGI
+        # server's file wrapper send it with sendfile(2)
+        body = wrap_file(request.environ, file_fp, chunk_size)
+    else:
+        body = FileWrapper(file_fp, chunk_size)
+    response = make_file_response(stored_file, body)
+    response.content_length = content_length
+    count_upload_bytes('out', content_length)
+    if content_range is not None:
+        response.status_code = 206
+        response.headers['Content-Range'] = content_range
+    return response
+
+
+def get_rendition_width():
+    """Return the rendition width asked for with the size argument.
+
+    :return int: a configured rendition width, or None for the original
+    """
+    if 'size' not in request.args:
+        return None
+    width = friendly_arg_get('size', type_cast=int)
+    if width not in current_app.config['UPLOAD_RENDITION_WIDTHS']:
+        raise BadRequest(Errors.RENDITION_SIZE_NOT_SUPPORTED)
+    return width
+
+
+def redirect_to_file(location, retrieval_mode):
+    """Redirect to a stored file's CDN link or a presigned URL for it.
+
+    :param location string: where the file is stored
+    :param retrieval_mode string: 'cdn' or 'presigned'
+    """
+    if retrieval_mode == 'cdn':
+        return redirect(Upload.make_cdn_link(location))
+    return redirect(Upload.make_presigned_url(location))
+
+
+def stream_rendition(upload, rendition):
+    """Stream a rendition, regenerating it if its cached location is stale.
+
+    The location comes from the cache without checking storage, so a file
+    that has gone missing since only shows up when it is opened.
+
+    :return Response: the rendition, or None if the source can no longer be
+        resized
+    """
+    try:
+        return stream_stored_file(StoredFile.for_rendition(upload, rendition))
+    except FileNotFoundError:
+        rendition.forget()
+        if rendition.locate() is None:
+            return None
+        return stream_stored_file(StoredFile.for_rendition(upload, rendition))
 
 
 @blueprint.flexible_route('/<string:uid>/file')
 def get_upload_file(uid):
-    """Get an upload's file attachment by its ID."""
+    """Get an upload's file attachment by its ID.
+
+    A `size` argument set to one of UPLOAD_RENDITION_WIDTHS gets a resized
+    rendition instead, generated on first request if it doesn't exist yet.
+    Uploads that can't be resized are sent as they are.
+    """
     upload = get_upload_by_id(uid)
+    width = get_rendition_width()
+    retrieval_mode = current_app.config['UPLOAD_RETRIEVAL_MODE']
+    redirects = (retrieval_mode in REDIRECT_RETRIEVAL_MODES and
+                 storage.backend.serves_urls)
+    try:
+        if width is not None:
+            rendition = get_rendition(upload, width)
+            response = None
+            if rendition is not None and redirects:
+                response = redirect_to_file(rendition.locate(),
+                                            retrieval_mode)
+            elif rendition is not None:
+                response = stream_rendition(upload, rendition)
+            if response is not None:
+                return response
+    except FileNotFoundError:
+        raise NotFound(Errors.FILE_NOT_FOUND)
+
+    if redirects:
+        return redirect_to_file(upload.retrieval_location, retrieval_mode)
     try:
+        if retrieval_mode != 'buffer':
+            return stream_stored_file(StoredFile.for_upload(upload))
         upload_fp = upload.retrieve_file()
     except (FileNotFoundError, ClientError):
         raise NotFound(Errors.FILE_NOT_FOUND)
+    count_upload_bytes('out', len(upload_fp.getbuffer()))
     return send_file(upload_fp, as_attachment=True,
                      attachment_filename=upload.filename)
 
 
+def get_streamed_file():
+    """Wrap the raw request body as a file without reading it.
+
+    The body is handed to storage as a stream, so it never gets spooled to
+    memory or a temporary file first.
+
+    :return FileStorage: the request body, named by the filename argument
+    """
+    if not request.content_length:
+        raise UnprocessableEntity(Errors.FILE_EMPTY)
+    if request.content_length > current_app.config['MAX_CONTENT_LENGTH']:
+        raise RequestEntityTooLarge(Errors.FILE_TOO_LARGE)
+    return FileStorage(stream=request.stream,
+                       filename=request.args['filename'],
+                       content_type=request.mimetype,
+                       content_length=request.content_length)
+
+
 @blueprint.create()
 def create_upload():
-    """Create a new upload."""
+    """Create a new upload.
+
+    The file is either the `file` field of a multipart form, or the raw
+    request body with its name in the `filename` query argument. Raw bodies
+    are streamed to storage as they arrive.
+    """
     # validate to make sure that a file was uploaded, that it wasn't empty,
     # and that it has an acceptable extension
-    if 'file' not in request.files:
+    if 'filename' in request.args:
+        upload_file = get_streamed_file()
+    elif 'file' in request.files:
+        upload_file = request.files['file']
+    else:
         raise BadRequest(Errors.FILE_NOT_SENT)
-    upload_file = request.files['file']
     if not upload_file.filename:
         raise BadRequest(Errors.FILE_NAME_REQUIRED)
     if not allowed_file(upload_file.filename):
@@ -67,4 +336,6 @@ def create_upload():
 
     filename = secure_filename(upload_file.filename)
     upload = Upload.create(filename=filename, upload_file=upload_file)
+    count_upload_bytes('in', upload.file_size())
+    schedule_renditions(upload)
     return jsonify(data=UploadSchema().dump(upload).data)
@@ -2,10 +2,11 @@
 """The API module for users."""
 from flask import jsonify
 
-from poet.errors import NotFound
+from poet.caching import cached_resource
+from poet.errors import BadRequest, NotFound
 from poet.locales import Errors
 from poet.models import User
-from poet.utils import RESTBlueprint
+from poet.utils import RESTBlueprint, get_ids_arg
 
 from .schema import UserSchema
 
@@ -13,10 +14,25 @@ from .schema import UserSchema
 blueprint = RESTBlueprint('users', __name__, version='v1')
 
 
+@blueprint.list()
+def list_users():
+    """Find the users with the comma separated IDs in the `ids` argument."""
+    ids = get_ids_arg()
+    if ids is None:
+        raise BadRequest(Errors.IDS_REQUIRED)
+    users, missing = User.find_many(
+        ids, dump=lambda user: UserSchema().dump(user).data)
+    return jsonify(data=users, missing=missing)
+
+
 @blueprint.find()
 def find_user(uid):
     """Find a user by the UUID."""
-    user = User.find(uid)
-    if user is None:
-        raise NotFound(Errors.USER_NOT_FOUND)
-    return jsonify(data=UserSchema().dump(user).data)
+    def dump_user():
+        """Serialize the user or bail with a 404."""
+        user = User.find(uid)
+        if user is None:
+            raise NotFound(Errors.USER_NOT_FOUND)
+        return UserSchema().dump(user).data
+
+    return cached_resource(User, uid, dump_user)
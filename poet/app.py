@@ -6,7 +6,8 @@ from marshmallow.exceptions import ValidationError
 
 from poet import commands, public, models
 from poet.errors import APIException, NotFound
-from poet.extensions import bcrypt, cache, db, login_manager, migrate
+from poet.extensions import (aws, cache, db, hasher, login_manager, metrics,
+                             migrate, sql_instrumentation, storage)
 from poet.locales import Errors
 from poet.settings import ProdConfig
 
@@ -25,17 +26,22 @@ def create_app(config_object=ProdConfig):
     register_errorhandlers(app)
     register_shellcontext(app)
     register_commands(app)
+    precompile_templates(app)
     return app
 
 
 def register_extensions(app):
     """Register Flask extensions."""
-    bcrypt.init_app(app)
+    hasher.init_app(app)
     cache.init_app(app)
     db.init_app(app)
     login_manager.init_app(app)
     CORS(app, origins=[r'.*\.diagramcenter\.org'])
     migrate.init_app(app, db)
+    aws.init_app(app)
+    storage.init_app(app)
+    sql_instrumentation.init_app(app)
+    metrics.init_app(app)
     return None
 
 
@@ -53,6 +59,13 @@ def register_blueprints(app):
     return None
 
 
+def precompile_templates(app):
+    """Compile templates rendered outside of page views ahead of time."""
+    from poet.api.v1.emails.sending import load_email_template
+    load_email_template(app)
+    return None
+
+
 def register_errorhandlers(app):
     """Register error handlers."""
     @app.errorhandler(APIException)
@@ -114,3 +127,8 @@ def register_commands(app):
     app.cli.add_command(commands.lint)
     app.cli.add_command(commands.clean)
     app.cli.add_command(commands.urls)
+    app.cli.add_command(commands.backfill_blobs)
+    app.cli.add_command(commands.shard_uploads)
+    app.cli.add_command(commands.email_worker)
+    app.cli.add_command(commands.export_annotations)
+    app.cli.add_command(commands.export_dataset)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""A process-wide registry of pooled boto3 clients."""
+import os
+from threading import Lock
+
+import boto3
+from botocore.config import Config as BotoConfig
+from flask import current_app
+
+from poet.metrics import instrument_aws_client
+
+
+class AWSClients(object):
+    """A Flask extension that hands out shared boto3 clients.
+
+    Building a boto3 client re-reads credentials, re-parses the service model
+    and starts with an empty connection pool, so doing it per request is
+    expensive. This keeps one client per (service, region) for each worker
+    process and reuses it across requests. boto3 clients are thread-safe;
+    sessions are not, so client creation is guarded by a lock.
+
+    The registry remembers the PID it was built in and starts over after a
+    fork, so gunicorn workers never share sockets with the master process.
+
+    Example usage:
+
+        from poet.extensions import aws
+
+        s3 = aws.client('s3')
+        s3.put_object(Bucket='bucket', Key='key', Body=b'data')
+    """
+
+    def __init__(self, app=None):
+        """Create the extension, optionally binding it to an app."""
+        self._lock = Lock()
+        self._pid = None
+        self._session = None
+        self._clients = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Set config defaults and register the extension on the app."""
+        app.config.setdefault('AWS_MAX_POOL_CONNECTIONS', 10)
+        app.extensions['aws'] = self
+
+    def client(self, service_name, region_name=None):
+        """Return the shared client for a service (and region).
+
+        :param service_name string: the boto3 service name, e.g. 's3'
+        :param region_name string: (default: None) the region, or None to use
+            the default resolved by boto3
+        :return: a boto3 client
+        """
+        key = (service_name, region_name)
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            client = self._clients.get(key)
+            if client is None:
+                client = self._session.client(
+                    service_name, region_name=region_name,
+                    config=BotoConfig(max_pool_connections=current_app.config[
+                        'AWS_MAX_POOL_CONNECTIONS']))
+                instrument_aws_client(client)
+                self._clients[key] = client
+        return client
+
+    def clear(self):
+        """Drop every cached client, e.g. after rotating credentials."""
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        """Start over with a fresh session for the current process."""
+        self._pid = os.getpid()
+        self._session = boto3.session.Session()
+        self._clients = {}
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Caching of serialized resources for the find endpoints."""
+from flask import current_app, jsonify
+from sqlalchemy import inspect
+
+from poet.engine import on_commit, read_primary
+from poet.extensions import cache
+from poet.metrics import RESOURCE_CACHE_REQUESTS
+
+
+def resource_cache_key(model, identity):
+    """Return the cache key for a record's serialized form.
+
+    :param model class: the record's model
+    :param identity tuple: the record's primary key values
+    """
+    return 'resource:{}:{}'.format(
+        model.__tablename__, ':'.join(str(value) for value in identity))
+
+
+def email_body_cache_key(annotation_id):
+    """Return the cache key for an annotation's rendered email body."""
+    return 'email-body:{}'.format(annotation_id)
+
+
+def invalidate(instance):
+    """Drop everything cached from a record once the session commits.
+
+    Records that were never saved have nothing cached.
+    """
+    identity = inspect(instance).identity
+    if identity is not None:
+        invalidate_identities(type(instance), [identity])
+
+
+def invalidate_identities(model, identities):
+    """Drop everything cached from records once the session commits.
+
+    Dropping entries any sooner would let a read in the meantime cache the
+    old values again, and a rollback would drop them for nothing.
+
+    :param model class: the records' model
+    :param identities list: each record's primary key, as a tuple of values
+        or a single value
+    """
+    keys = []
+    for identity in identities:
+        if not isinstance(identity, tuple):
+            identity = (identity,)
+        keys.extend(model.cache_keys(identity))
+    on_commit(lambda: delete_keys(keys))
+
+
+def delete_keys(keys):
+    """Delete cache entries, one at a time."""
+    # not delete_many: some backends stop at the first key that is missing
+    for key in keys:
+        cache.delete(key)
+
+
+def cached_resource(model, uid, dump):
+    """Respond with a record's serialized form, from the cache if possible.
+
+    Records are cached until they are saved or deleted through CRUDMixin, or
+    for CACHE_RESOURCE_TIMEOUT seconds. Nothing is cached when dump raises,
+    so a 404 is never remembered. Misses are read from the primary, so a
+    lagging read replica is never cached. The X-Cache header says whether
+    the response came from the cache.
+
+    :param model class: a UUIDMixin model
+    :param uid string: the record's ID
+    :param dump function: returns the record's serialized form
+    :return Response: the serialized record under `data`
+    """
+    config = current_app.config
+    if not config['CACHE_RESOURCES']:
+        return jsonify(data=dump())
+    key = resource_cache_key(model, (model.parse_id(uid),))
+    data = cache.get(key)
+    outcome = 'hit'
+    if data is None:
+        outcome = 'miss'
+        with read_primary():
+            data = dump()
+        cache.set(key, data, timeout=config['CACHE_RESOURCE_TIMEOUT'])
+    RESOURCE_CACHE_REQUESTS.labels(model.__tablename__, outcome).inc()
+    response = jsonify(data=data)
+    response.headers['X-Cache'] = outcome.upper()
+    return response
@@ -9,6 +9,8 @@ from flask import current_app
 from flask.cli import with_appcontext
 from werkzeug.exceptions import MethodNotAllowed, NotFound
 
+from poet.database import db
+
 HERE = os.path.abspath(os.path.dirname(__file__))
 PROJECT_ROOT = os.path.join(HERE, os.pardir)
 TEST_PATH = os.path.join(PROJECT_ROOT, 'tests')
@@ -124,3 +126,218 @@ def urls(url, order):
 
     for row in rows:
         click.echo(str_template.format(*row[:column_length]))
+
+
+@click.command('backfill-blobs')
+@click.option('--batch-size', default=100,
+              help='Uploads to process per commit (default: 100)')
+@click.option('--delete-duplicates', default=False, is_flag=True,
+              help='Delete stored files that duplicate an existing blob')
+@with_appcontext
+def backfill_blobs(batch_size, delete_duplicates):
+    """Attach uploads saved before deduplication to content-addressed blobs.
+
+    Each upload's file is hashed where it is stored. The first upload with
+    given contents adopts its file as the blob; later ones are pointed at that
+    blob, leaving their own copies unused. Uploads are walked in ID order and
+    committed in batches, so the command can be stopped and rerun.
+    """
+    from poet.extensions import storage
+    from poet.models import Blob, Upload
+    from poet.models.blob import CHUNK_SIZE, HashingReader
+
+    last_id = None
+    attached = duplicates = missing = 0
+    while True:
+        query = Upload.query.filter(Upload.blob_sha256.is_(None))
+        if last_id is not None:
+            query = query.filter(Upload.id > last_id)
+        uploads = query.order_by(Upload.id).limit(batch_size).all()
+        if not uploads:
+            break
+        redundant = []
+        for upload in uploads:
+            last_id = upload.id
+            try:
+                upload_fp, _ = upload.open_file_stream()
+            except FileNotFoundError:
+                click.echo('Missing file for {!r}'.format(upload))
+                missing += 1
+                continue
+            reader = HashingReader(upload_fp)
+            try:
+                while reader.read(CHUNK_SIZE):
+                    pass
+            finally:
+                upload_fp.close()
+            blob = Blob.adopt(reader.hexdigest(), reader.size,
+                              upload.retrieval_location)
+            if blob.retrieval_location != upload.retrieval_location:
+                redundant.append(upload.retrieval_location)
+                upload.retrieval_location = blob.retrieval_location
+                duplicates += 1
+            upload.blob = blob
+            attached += 1
+        db.session.commit()
+        if delete_duplicates:
+            for location in redundant:
+                storage.backend.delete(location)
+        click.echo('Attached {} uploads ({} duplicates, {} missing files)'
+                   .format(attached, duplicates, missing))
+
+
+@click.command('shard-uploads')
+@with_appcontext
+def shard_uploads():
+    """Move files saved flat in UPLOADS_DIR into their shard directories.
+
+    Each file is renamed atomically and is still found through its old
+    retrieval_location afterwards, so this can run while the app is serving
+    and can be interrupted and rerun to pick up where it left off.
+    """
+    from poet.storage import LocalStorage
+
+    backend = LocalStorage.from_config(current_app.config)
+    if not backend.fanout:
+        raise click.UsageError('UPLOADS_DIR_FANOUT is 0, so files are not '
+                               'sharded.')
+    names = list(backend.unsharded_files())
+    with click.progressbar(names, label='Sharding {} files'.format(
+            len(names))) as progress:
+        for name in progress:
+            try:
+                backend.shard(name)
+            except FileNotFoundError:
+                # already moved by another run
+                pass
+
+
+@click.command('email-worker')
+@click.option('--threads', default=1, help='Worker threads to run.')
+@click.option('--burst', default=False, is_flag=True,
+              help='Exit once no emails are due instead of waiting for more.')
+@with_appcontext
+def email_worker(threads, burst):
+    """Deliver queued emails until interrupted.
+
+    Any number of these can run alongside the app, which can then set
+    EMAIL_WORKERS to 0 to leave all sending to them. Count each one in
+    SES_SENDING_PROCESSES, so together they stay within the SES quota.
+    """
+    import threading
+
+    from poet.api.v1.emails.queue import work
+    from poet.utils import FlaskThread
+
+    stop, wake = threading.Event(), threading.Event()
+    workers = [FlaskThread(target=work, args=(stop, wake, burst))
+               for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        click.echo('Finishing the emails being sent...')
+        stop.set()
+        wake.set()
+        for worker in workers:
+            worker.join()
+
+
+def parse_datetime(ctx, param, value):
+    """Parse an ISO 8601 option value into a datetime."""
+    from marshmallow.utils import from_iso
+
+    if value is None:
+        return None
+    try:
+        return from_iso(value)
+    except ValueError:
+        raise click.BadParameter('expected an ISO 8601 date and time')
+
+
+@click.command('export-annotations')
+@click.option('--format', 'fmt', default='ndjson',
+              type=click.Choice(['ndjson', 'csv']), help='Output format.')
+@click.option('-o', '--output', default='-', type=click.File('wb'),
+              help='File to write to (default: stdout).')
+@click.option('--gzip/--no-gzip', default=None,
+              help='Gzip the output (default: if the file ends in .gz).')
+@click.option('--category', default=None, help='Only export this category.')
+@click.option('--since', default=None, callback=parse_datetime,
+              help='Only export annotations created after this.')
+@click.option('--since-id', default=None, type=click.UUID,
+              help='With --since, the ID of the last annotation exported.')
+@click.option('--batch-size', default=1000,
+              help='Rows to fetch per round trip (default: 1000)')
+@with_appcontext
+def export_annotations(fmt, output, gzip, category, since, since_id,
+                       batch_size):
+    """Stream every annotation, oldest first, as NDJSON or CSV.
+
+    Memory use stays flat however many annotations there are. When it's
+    done, the command prints the --since and --since-id that export only
+    the annotations added afterwards.
+    """
+    from poet.api.v1.annotations.export import Export, export_query
+
+    if gzip is None:
+        gzip = output.name.endswith('.gz')
+    export = Export(export_query(since=since, since_id=since_id,
+                                 category=category),
+                    fmt=fmt, gzip=gzip, batch_size=batch_size)
+    for chunk in export:
+        output.write(chunk)
+    output.flush()
+    message = 'Exported {} annotations'.format(export.count)
+    if export.last is not None:
+        message += '; resume with --since {} --since-id {}'.format(
+            export.last[0].isoformat(), export.last[1])
+    click.echo(message, err=True)
+
+
+@click.command('export-dataset')
+@click.argument('directory', type=click.Path(file_okay=False))
+@click.option('--format', 'fmt', default='tar',
+              type=click.Choice(['tar', 'zip']),
+              help='Archive format; tar shards can be read by WebDataset.')
+@click.option('--prefix', default='poet',
+              help='The start of each shard\'s filename (default: poet)')
+@click.option('--shard-size', default=1024,
+              help='Most megabytes of files per shard (default: 1024)')
+@click.option('--shard-samples', default=None, type=int,
+              help='Most samples per shard (default: no limit)')
+@click.option('--workers', default=8,
+              help='Threads fetching files from storage (default: 8)')
+@click.option('--batch-size', default=500,
+              help='Uploads to load per query (default: 500)')
+@with_appcontext
+def export_dataset(directory, fmt, prefix, shard_size, shard_samples,
+                   workers, batch_size):
+    """Write annotated uploads and their labels into sharded archives.
+
+    Each upload becomes a sample of two files named for its ID: the upload's
+    file and a JSON file of its annotations. Files are fetched from storage
+    on a pool of threads while earlier ones are written, and DIRECTORY gets
+    a manifest.json listing every shard with its size and SHA-256.
+    """
+    from poet.datasets import export_dataset as export
+    from poet.models import Upload
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    total = Upload.query.filter(Upload.annotations.any()).count()
+    with click.progressbar(length=total, label='Exporting',
+                           show_pos=True) as progress:
+        manifest = export(
+            directory, fmt=fmt, prefix=prefix,
+            max_size=shard_size * 1024 * 1024, max_count=shard_samples,
+            workers=workers, batch_size=batch_size,
+            progress=lambda sample, skipped: progress.update(1))
+    click.echo('Wrote {} samples in {} shards to {}'.format(
+        manifest['samples'], len(manifest['shards']), directory))
+    if manifest['missing']:
+        click.echo('Skipped {} uploads with missing files; see {}'.format(
+            len(manifest['missing']),
+            os.path.join(directory, 'manifest.json')))
@@ -1,45 +1,284 @@
 # -*- coding: utf-8 -*-
 """Module with the SQLAlchemy database and DB-related utilities."""
 import uuid
+from contextlib import contextmanager
 
+from flask import current_app
+from sqlalchemy import bindparam, inspect
 from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import joinedload, subqueryload
+from sqlalchemy.orm.util import identity_key
 
+from .caching import invalidate, invalidate_identities, resource_cache_key
 from .errors import BadRequest
 from .compat import basestring
-from .extensions import db
+from .engine import read_primary
+from .extensions import cache, db
 from .locales import Errors
+from .metrics import RESOURCE_CACHE_REQUESTS
 
 # Alias common SQLAlchemy names
 Column = db.Column
 relationship = db.relationship
 
 
+def eager_load(model, path):
+    """Build a loader option that loads a relationship path up front.
+
+    Each hop is joined if it's a single object and loaded with one extra
+    query if it's a collection, so neither fans out into a query per row.
+
+    :param model class: the mapped class the path starts from
+    :param path string: a dotted relationship path, e.g. 'upload.blob'
+    :return: a loader option for `Query.options`
+    """
+    option = None
+    for name in path.split('.'):
+        prop = inspect(model).relationships[name]
+        strategy = 'subqueryload' if prop.uselist else 'joinedload'
+        attribute = getattr(model, name)
+        if option is None:
+            option = {'joinedload': joinedload,
+                      'subqueryload': subqueryload}[strategy](attribute)
+        else:
+            option = getattr(option, strategy)(attribute)
+        model = prop.mapper.class_
+    return option
+
+
+def in_atomic():
+    """Return True inside an `atomic` block."""
+    return db.session.info.get('atomic_depth', 0) > 0
+
+
+def maybe_commit():
+    """Commit the session, unless an `atomic` block will commit it later."""
+    if not in_atomic():
+        db.session.commit()
+
+
+@contextmanager
+def atomic():
+    """Group many saves into one transaction, committed once at the end.
+
+    Inside the block, CRUDMixin methods asked to commit leave it to the
+    block instead. The block commits when it exits and rolls back if it
+    raises. Nested blocks join the outermost one.
+
+    Usage: ::
+
+        with atomic():
+            for row in rows:
+                Annotation.create(**row)
+    """
+    info = db.session.info
+    depth = info.get('atomic_depth', 0)
+    info['atomic_depth'] = depth + 1
+    try:
+        yield
+    except Exception:  # noqa: B902
+        info['atomic_depth'] = depth
+        if not depth:
+            db.session.rollback()
+        raise
+    info['atomic_depth'] = depth
+    if not depth:
+        db.session.commit()
+
+
+def chunks(items, size):
+    """Split a list into lists of at most ``size`` items."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def fill_defaults(table, rows):
+    """Give every row a value for every column any of the rows sets.
+
+    Multi-row inserts need each row to have the same keys. Missing values
+    are filled from the column's Python-side default, or else left NULL for
+    the database to fill.
+    """
+    keys = set()
+    for row in rows:
+        keys.update(row)
+    for column in table.columns:
+        default = column.default
+        if column.key not in keys and default is not None and \
+                not (default.is_sequence or default.is_clause_element):
+            keys.add(column.key)
+    filled = []
+    for row in rows:
+        row = dict(row)
+        for key in keys - set(row):
+            default = table.columns[key].default
+            if default is None or default.is_clause_element or \
+                    default.is_sequence:
+                row[key] = None
+            elif default.is_callable:
+                row[key] = default.arg(None)
+            else:
+                row[key] = default.arg
+        filled.append(row)
+    return filled
+
+
 class CRUDMixin(object):
     """Mixin that adds convenience methods for CRUD operations."""
 
+    @classmethod
+    def eager(cls, *paths):
+        """Query the model with relationships loaded up front.
+
+        Endpoints pass the relationships their schema will dump, so that
+        serializing a page of rows doesn't lazy load each row's relations
+        one at a time.
+
+        :param paths string: dotted relationship paths, e.g. 'upload'
+        :return Query: a query with the loader options applied
+        """
+        return cls.query.options(*[eager_load(cls, path) for path in paths])
+
     @classmethod
     def create(cls, **kwargs):
         """Create a new record and save it the database."""
         instance = cls(**kwargs)
         return instance.save()
 
+    @classmethod
+    def bulk_create(cls, rows, returning=None, batch_size=None, commit=True):
+        """Insert many records, with one multi-row INSERT per batch.
+
+        This skips the ORM entirely: no objects are built and no events
+        fire. Python-side column defaults, like IDs, are still filled in.
+
+        :param rows list: a dict of column values for each record
+        :param returning list: (default: None) the columns to return for
+            each record; by default its primary key
+        :param batch_size int: (default: None) the rows per INSERT, or None
+            for BULK_BATCH_SIZE
+        :param commit bool: (default: True) whether to commit afterwards
+        :return list: a row of the ``returning`` columns for each record,
+            in the order they were given
+        """
+        table = cls.__table__
+        if returning is None:
+            columns = list(table.primary_key.columns)
+        else:
+            columns = [table.columns[name] for name in returning]
+        created = []
+        batch_size = batch_size or current_app.config['BULK_BATCH_SIZE']
+        for chunk in chunks(fill_defaults(table, rows), batch_size):
+            created.extend(db.session.execute(
+                table.insert().values(chunk).returning(*columns)))
+        if commit:
+            maybe_commit()
+        return created
+
+    @classmethod
+    def bulk_update(cls, rows, batch_size=None, commit=True):
+        """Update many records, with one executemany UPDATE per batch.
+
+        Like `bulk_create` this skips the ORM, so records already loaded in
+        the session keep their old values until they are expired (which
+        committing does).
+
+        :param rows list: a dict for each record, with its primary key and
+            the column values to set; rows setting the same columns are
+            updated together
+        :param batch_size int: (default: None) the rows per UPDATE, or None
+            for BULK_BATCH_SIZE
+        :param commit bool: (default: True) whether to commit afterwards
+        :return int: the number of records updated
+        """
+        table = cls.__table__
+        primary_key = cls.primary_key_column()
+        groups = {}
+        for row in rows:
+            # the primary key is only bound as pk_, or it would be SET too
+            values = dict((key, value) for key, value in row.items()
+                          if key != primary_key.key)
+            values['pk_'] = row[primary_key.key]
+            groups.setdefault(tuple(sorted(values)), []).append(values)
+        updated = 0
+        batch_size = batch_size or current_app.config['BULK_BATCH_SIZE']
+        for keys, group in groups.items():
+            statement = table.update() \
+                .where(primary_key == bindparam('pk_')) \
+                .values(dict((key, bindparam(key)) for key in keys
+                             if key != 'pk_'))
+            for chunk in chunks(group, batch_size):
+                updated += db.session.execute(statement, chunk).rowcount
+        invalidate_identities(cls, [row[primary_key.key] for row in rows])
+        if commit:
+            maybe_commit()
+        return updated
+
+    @classmethod
+    def bulk_delete(cls, record_ids, batch_size=None, commit=True):
+        """Delete many records by primary key, a batch at a time.
+
+        This skips the ORM, so it also skips anything a model's own
+        `delete` does, like Upload releasing its blob.
+
+        :param record_ids list: the primary keys of the records to delete
+        :param batch_size int: (default: None) the IDs per DELETE, or None
+            for BULK_BATCH_SIZE
+        :param commit bool: (default: True) whether to commit afterwards
+        :return int: the number of records deleted
+        """
+        table = cls.__table__
+        primary_key = cls.primary_key_column()
+        deleted = 0
+        batch_size = batch_size or current_app.config['BULK_BATCH_SIZE']
+        for chunk in chunks(list(record_ids), batch_size):
+            deleted += db.session.execute(
+                table.delete().where(primary_key.in_(chunk))).rowcount
+        invalidate_identities(cls, record_ids)
+        if commit:
+            maybe_commit()
+        return deleted
+
+    @classmethod
+    def primary_key_column(cls):
+        """Return the model's primary key column; bulk methods need one."""
+        columns = list(cls.__table__.primary_key.columns)
+        if len(columns) != 1:
+            raise TypeError('{} needs a single column primary key'.format(
+                cls.__name__))
+        return columns[0]
+
+    @classmethod
+    def cache_keys(cls, identity):
+        """Return the keys of everything cached from a record.
+
+        They are dropped whenever the record is saved or deleted.
+
+        :param identity tuple: the record's primary key values
+        """
+        return [resource_cache_key(cls, identity)]
+
     def update(self, commit=True, **kwargs):
         """Update specific fields of a record."""
         for attr, value in kwargs.items():
             setattr(self, attr, value)
+        if not commit:
+            invalidate(self)
         return commit and self.save() or self
 
     def save(self, commit=True):
-        """Save the record."""
+        """Save the record, dropping any cached copy of it."""
         db.session.add(self)
+        invalidate(self)
         if commit:
-            db.session.commit()
+            maybe_commit()
         return self
 
     def delete(self, commit=True):
         """Remove the record from the database."""
+        invalidate(self)
         db.session.delete(self)
-        return commit and db.session.commit()
+        return commit and maybe_commit()
 
 
 class Model(CRUDMixin, db.Model):
@@ -76,15 +315,110 @@ class UUIDMixin(object):
     id = Column(UUID(as_uuid=True), nullable=False, primary_key=True,
                 default=uuid.uuid4)
 
-    @classmethod
-    def get_by_id(cls, record_id):
-        """Get record by UUID."""
+    @staticmethod
+    def parse_id(record_id):
+        """Return a record ID as a UUID or bail with a 400."""
         if not isinstance(record_id, uuid.UUID):
             try:
                 record_id = uuid.UUID(record_id)
             except:
                 raise BadRequest(Errors.BAD_GUID)
-        return cls.query.get(record_id)
+        return record_id
+
+    @classmethod
+    def get_by_id(cls, record_id):
+        """Get record by UUID."""
+        return cls.query.get(cls.parse_id(record_id))
+
+    @classmethod
+    def find_many(cls, record_ids, query=None, dump=None):
+        """Find records by UUID, in one query no matter how many there are.
+
+        Records already loaded in the session's identity map (and not expired
+        since) aren't queried again, unless a query is given: its loader
+        options may load more than the records in the session have.
+
+        Given ``dump``, records come back serialized instead. When
+        CACHE_RESOURCES is on they are then looked up in the resource cache
+        first, only the misses are queried (from the primary, never a read
+        replica), and what they serialize to is cached for the find endpoints
+        too.
+
+        :param record_ids list: the IDs to find, as UUIDs or strings
+        :param query Query: (default: None) the query to find records with,
+            e.g. one from `Model.eager`
+        :param dump function: (default: None) returns a record's serialized
+            form, as the model's find endpoint caches it
+        :return tuple: (records, missing) where records are the records found
+            in the order their IDs were given and missing are the IDs that
+            weren't found, as given
+        """
+        parsed = [cls.parse_id(record_id) for record_id in record_ids]
+        found = {}
+        use_cache = dump is not None and current_app.config['CACHE_RESOURCES']
+        if use_cache:
+            found.update(cls._find_cached(parsed))
+        remaining = set(parsed) - set(found)
+        if remaining and use_cache:
+            found.update(cls._cache_dumped(remaining, query, dump))
+        elif remaining:
+            loaded = cls._find_loaded(remaining, query)
+            if dump is not None:
+                loaded = dict((record_id, dump(record))
+                              for record_id, record in loaded.items())
+            found.update(loaded)
+        records, missing = [], []
+        for record_id, parsed_id in zip(record_ids, parsed):
+            if parsed_id in found:
+                records.append(found[parsed_id])
+            else:
+                missing.append(record_id)
+        return records, missing
+
+    @classmethod
+    def _find_cached(cls, record_ids):
+        """Return {id: serialized record} for the IDs in the resource cache."""
+        unique = list(set(record_ids))
+        cached = cache.get_many(*[resource_cache_key(cls, (record_id,))
+                                  for record_id in unique])
+        found = {}
+        for record_id, data in zip(unique, cached):
+            RESOURCE_CACHE_REQUESTS.labels(
+                cls.__tablename__, 'miss' if data is None else 'hit').inc()
+            if data is not None:
+                found[record_id] = data
+        return found
+
+    @classmethod
+    def _cache_dumped(cls, record_ids, query, dump):
+        """Return and cache {id: serialized record} for the IDs, if found."""
+        with read_primary():
+            dumped = dict((record_id, dump(record)) for record_id, record in
+                          cls._find_loaded(record_ids, query).items())
+        cache.set_many(
+            dict((resource_cache_key(cls, (record_id,)), data)
+                 for record_id, data in dumped.items()),
+            timeout=current_app.config['CACHE_RESOURCE_TIMEOUT'])
+        return dumped
+
+    @classmethod
+    def _find_loaded(cls, record_ids, query=None):
+        """Return {id: record} for the IDs, from the session or a query."""
+        found = {}
+        if query is None:
+            query = cls.query
+            for record_id in record_ids:
+                record = db.session.identity_map.get(
+                    identity_key(cls, record_id))
+                if record is not None:
+                    state = inspect(record)
+                    if not (state.expired or state.deleted):
+                        found[record_id] = record
+        remaining = set(record_ids) - set(found)
+        if remaining:
+            found.update((record.id, record) for record in
+                         query.filter(cls.id.in_(remaining)))
+        return found
 
     @classmethod
     def find(cls, record_id):
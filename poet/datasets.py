@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+"""Training dataset exports: upload files and their labels, in shards."""
+import calendar
+import datetime as dt
+import hashlib
+import json
+import os
+import tarfile
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from flask import current_app
+
+from poet.extensions import storage
+from poet.models import Upload
+from poet.storage.base import CHUNK_SIZE
+
+#: The file in the output directory describing every shard
+MANIFEST_NAME = 'manifest.json'
+
+
+class Sample(object):
+    """One upload's file and labels, as they go into an archive."""
+
+    def __init__(self, upload):
+        """Describe the sample for ``upload``, reading what it needs now.
+
+        The fetch runs on another thread, so nothing is left to lazy load.
+        """
+        self.key = str(upload.id)
+        self.location = upload.retrieval_location
+        self.extension = os.path.splitext(upload.filename)[1].lower() or \
+            '.bin'
+        self.created_at = upload.created_at
+        self.labels = json.dumps({
+            'id': self.key,
+            'filename': upload.filename,
+            'annotations': [{
+                'id': str(annotation.id),
+                'created_at': annotation.created_at.isoformat(),
+                'description': annotation.description,
+                'category': annotation.category,
+            } for annotation in sorted(
+                upload.annotations,
+                key=lambda annotation: (annotation.created_at,
+                                        annotation.id))],
+        }, sort_keys=True).encode('utf-8')
+        self.data = None
+
+    @property
+    def files(self):
+        """The (name, bytes) of each file the sample is archived as.
+
+        Like WebDataset, files share the sample's key as their basename, so
+        readers can group them back together.
+        """
+        return [(self.key + self.extension, self.data),
+                (self.key + '.json', self.labels)]
+
+    @property
+    def size(self):
+        """The bytes the sample adds to an archive, before any overhead."""
+        return sum(len(data) for _, data in self.files)
+
+    def fetch(self, backend):
+        """Read the sample's file from storage.
+
+        :param backend StorageBackend: the backend the file is stored in
+        :return Sample: this sample, or None if its file is missing
+        """
+        try:
+            fp, _ = backend.open(self.location)
+        except FileNotFoundError:
+            return None
+        try:
+            self.data = fp.read()
+        finally:
+            fp.close()
+        return self
+
+
+class TarShard(object):
+    """A tar archive of samples, in the layout WebDataset reads."""
+
+    extension = '.tar'
+
+    def __init__(self, path):
+        """Start an archive at ``path``."""
+        self.archive = tarfile.open(path, 'w')
+
+    def add(self, name, data, modified):
+        """Add a file to the archive, dated ``modified`` (naive UTC)."""
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = calendar.timegm(modified.utctimetuple())
+        self.archive.addfile(info, BytesIO(data))
+
+    def close(self):
+        """Finish the archive."""
+        self.archive.close()
+
+
+class ZipShard(object):
+    """A zip archive of samples.
+
+    Files are stored, not deflated: images are compressed already.
+    """
+
+    extension = '.zip'
+
+    def __init__(self, path):
+        """Start an archive at ``path``."""
+        self.archive = zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED)
+
+    def add(self, name, data, modified):
+        """Add a file to the archive, dated ``modified`` (naive UTC)."""
+        info = zipfile.ZipInfo(name, modified.timetuple()[:6])
+        self.archive.writestr(info, data)
+
+    def close(self):
+        """Finish the archive."""
+        self.archive.close()
+
+
+#: The archive class for each dataset format
+SHARD_FORMATS = {'tar': TarShard, 'zip': ZipShard}
+
+
+class ShardWriter(object):
+    """Writes samples into numbered archives of at most a given size.
+
+    A sample is never split across archives, so an archive only goes over
+    ``max_size`` if a single sample is bigger than that.
+    """
+
+    def __init__(self, directory, fmt='tar', prefix='poet', max_size=None,
+                 max_count=None):
+        """Describe where and how to write shards.
+
+        :param directory string: the directory to write shards into
+        :param fmt string: (default: 'tar') 'tar' or 'zip'
+        :param prefix string: (default: 'poet') the start of each shard's
+            filename
+        :param max_size int: (default: None) the most bytes of sample files
+            per shard, or None for no limit
+        :param max_count int: (default: None) the most samples per shard, or
+            None for no limit
+        """
+        self.directory = directory
+        self.shard_class = SHARD_FORMATS[fmt]
+        self.prefix = prefix
+        self.max_size = max_size
+        self.max_count = max_count
+        self.shards = []
+        self.current = None
+
+    def write(self, sample):
+        """Add a sample to the current shard, starting a new one if full."""
+        size = sample.size
+        if self.current is None or self._is_full(size):
+            self._next_shard()
+        archive, info = self.current
+        for name, data in sample.files:
+            archive.add(name, data, sample.created_at)
+        info['samples'] += 1
+        info['sample_bytes'] += size
+
+    def close(self):
+        """Finish the last shard.
+
+        :return list: a manifest entry for each shard written
+        """
+        self._finish_shard()
+        return self.shards
+
+    def _is_full(self, size):
+        """Return True if a sample of ``size`` bytes can't join this shard."""
+        info = self.current[1]
+        if self.max_count is not None and \
+                info['samples'] >= self.max_count:
+            return True
+        return self.max_size is not None and \
+            info['sample_bytes'] + size > self.max_size
+
+    def _next_shard(self):
+        """Finish the current shard and start the next one."""
+        self._finish_shard()
+        name = '{}-{:06d}{}'.format(self.prefix, len(self.shards),
+                                    self.shard_class.extension)
+        path = os.path.join(self.directory, name)
+        self.current = (self.shard_class(path),
+                        {'name': name, 'samples': 0, 'sample_bytes': 0})
+
+    def _finish_shard(self):
+        """Close the current shard and describe it in the manifest."""
+        if self.current is None:
+            return
+        archive, info = self.current
+        archive.close()
+        path = os.path.join(self.directory, info['name'])
+        info['bytes'] = os.path.getsize(path)
+        info['sha256'] = file_sha256(path)
+        self.shards.append(info)
+        self.current = None
+
+
+def file_sha256(path):
+    """Return the hex SHA-256 of a file's contents."""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def annotated_uploads(batch_size=500):
+    """Yield every upload that has annotations, with them loaded.
+
+    Uploads are walked in ID order a batch at a time, so only one batch is
+    loaded at once.
+    """
+    last_id = None
+    while True:
+        query = Upload.eager('annotations').filter(Upload.annotations.any())
+        if last_id is not None:
+            query = query.filter(Upload.id > last_id)
+        uploads = query.order_by(Upload.id).limit(batch_size).all()
+        if not uploads:
+            return
+        for upload in uploads:
+            yield upload
+        last_id = uploads[-1].id
+
+
+def fetch_sample(app, sample, backend):
+    """Fetch a sample's file within the app's context.
+
+    Pool threads start without one, and backends like S3Storage need it to
+    find the app's shared clients.
+    """
+    with app.app_context():
+        return sample.fetch(backend)
+
+
+def fetched(samples, backend, workers):
+    """Fetch samples' files on a pool of threads, yielding them in order.
+
+    Up to ``workers * 4`` fetches run ahead of the caller, so files are
+    downloading while earlier ones are being written.
+
+    :return: pairs of (sample, fetched) where fetched is None for a missing
+        file
+    """
+    app = current_app._get_current_object()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for sample in samples:
+            pending.append((sample, executor.submit(fetch_sample, app, sample,
+                                                    backend)))
+            if len(pending) >= workers * 4:
+                sample, future = pending.popleft()
+                yield sample, future.result()
+        while pending:
+            sample, future = pending.popleft()
+            yield sample, future.result()
+
+
+def export_dataset(directory, fmt='tar', prefix='poet', max_size=None,
+                   max_count=None, workers=8, batch_size=500,
+                   progress=None):
+    """Write every annotated upload and its labels into sharded archives.
+
+    Each sample is the upload's file plus a JSON file of its annotations,
+    both named for the upload's ID. A manifest describing every shard is
+    written alongside them.
+
+    :param directory string: the directory to write into; it must exist
+    :param fmt string: (default: 'tar') 'tar' or 'zip'
+    :param prefix string: (default: 'poet') the start of each shard's name
+    :param max_size int: (default: None) the most bytes per shard
+    :param max_count int: (default: None) the most samples per shard
+    :param workers int: (default: 8) threads fetching files at once
+    :param batch_size int: (default: 500) uploads to load per query
+    :param progress callable: (default: None) called with each sample and
+        whether it was skipped for having no file
+    :return dict: the manifest
+    """
+    writer = ShardWriter(directory, fmt=fmt, prefix=prefix,
+                         max_size=max_size, max_count=max_count)
+    samples = (Sample(upload) for upload in annotated_uploads(batch_size))
+    missing = []
+    for sample, result in fetched(samples, storage.backend, workers):
+        skipped = result is None
+        if skipped:
+            missing.append(sample.key)
+        else:
+            writer.write(sample)
+            sample.data = None
+        if progress is not None:
+            progress(sample, skipped)
+    shards = writer.close()
+    manifest = {
+        'created_at': dt.datetime.utcnow().isoformat(),
+        'format': fmt,
+        'samples': sum(shard['samples'] for shard in shards),
+        'shards': shards,
+        'missing': missing,
+    }
+    with open(os.path.join(directory, MANIFEST_NAME), 'w') as fp:
+        json.dump(manifest, fp, indent=2, sort_keys=True)
+    return manifest
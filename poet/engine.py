@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""Database engine and connection pool setup, and read replica routing."""
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, has_request_context, session
+from flask_sqlalchemy import SignallingSession
+from flask_sqlalchemy import SQLAlchemy as BaseSQLAlchemy
+from sqlalchemy import event, exc, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.expression import Select
+
+from poet.metrics import (DB_POOL_CHECKOUT_TIMEOUTS, DB_POOL_CHECKOUT_WAIT,
+                          DB_POOL_CONNECTIONS_IN_USE)
+
+#: The Flask session key holding when the client last wrote to the primary
+LAST_WRITE_KEY = 'db_last_write'
+
+#: The database session info key holding callbacks waiting for a commit
+COMMIT_CALLBACKS_KEY = 'commit_callbacks'
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that records how long each checkout waits.
+
+    It also tracks how many connections are checked out and how many
+    checkouts gave up waiting, labelled with which database it connects to.
+    """
+
+    database = 'primary'
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            record = super(InstrumentedQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            DB_POOL_CHECKOUT_TIMEOUTS.labels(self.database).inc()
+            raise
+        finally:
+            DB_POOL_CHECKOUT_WAIT.labels(self.database).observe(
+                time.perf_counter() - started)
+        DB_POOL_CONNECTIONS_IN_USE.labels(self.database).inc()
+        return record
+
+    def _do_return_conn(self, conn):
+        DB_POOL_CONNECTIONS_IN_USE.labels(self.database).dec()
+        super(InstrumentedQueuePool, self)._do_return_conn(conn)
+
+
+class ReplicaQueuePool(InstrumentedQueuePool):
+    """The pool for connections to a read replica."""
+
+    database = 'replica'
+
+
+def ping_connection(dbapi_connection, connection_record, connection_proxy):
+    """Make sure a pooled connection is still alive before handing it out.
+
+    Raising DisconnectionError makes the pool drop the connection and try
+    again with a fresh one, so a restarted or failed-over database doesn't
+    cost a failed request per stale connection.
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('SELECT 1')
+    except Exception:  # noqa: B902
+        raise exc.DisconnectionError()
+    finally:
+        try:
+            cursor.close()
+        except Exception:  # noqa: B902
+            pass
+
+
+def is_read_only(clause):
+    """Return True if a statement only reads, without locking anything."""
+    return isinstance(clause, Select) and clause._for_update_arg is None
+
+
+def wrote_recently():
+    """Return True if this client wrote to the primary a moment ago."""
+    if not has_request_context():
+        return False
+    last_write = session.get(LAST_WRITE_KEY)
+    stickiness = current_app.config['SQLALCHEMY_REPLICA_STICKINESS']
+    return last_write is not None and time.time() - last_write < stickiness
+
+
+def use_replica(view):
+    """Let a read-only view's queries be answered by a read replica.
+
+    Clients that wrote within the last SQLALCHEMY_REPLICA_STICKINESS seconds
+    keep reading from the primary, so they always see their own writes.
+    Without SQLALCHEMY_REPLICA_URIS this does nothing.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if current_app.config['SQLALCHEMY_REPLICA_URIS'] and \
+                not wrote_recently():
+            current_app.extensions['sqlalchemy'].db.session.info[
+                'use_replica'] = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def read_primary():
+    """Send the session's reads to the primary within the block.
+
+    Use this for reads whose results outlive the request, like ones that
+    fill a cache: a lagging replica's rows would be served to everyone.
+    """
+    info = current_app.extensions['sqlalchemy'].db.session.info
+    use_replica = info.pop('use_replica', False)
+    try:
+        yield
+    finally:
+        if use_replica:
+            info['use_replica'] = use_replica
+
+
+class RoutingSession(SignallingSession):
+    """A session that sends reads to a replica when it's safe to.
+
+    Only sessions flagged by `use_replica` read from a replica, and only
+    until they write: flushes, DML, locking reads and bare connections all
+    go to the primary and keep the session there. Committing a write
+    remembers when the client wrote, for `wrote_recently`.
+    """
+
+    def __init__(self, db, **options):
+        """Create the session."""
+        super(RoutingSession, self).__init__(db, **options)
+        self.db = db
+
+    def get_bind(self, mapper=None, clause=None):
+        """Return the replica for safe reads, otherwise the primary."""
+        if self._flushing or not is_read_only(clause):
+            self.info['wrote'] = self.info['unremembered_write'] = True
+        elif self.info.get('use_replica') and not self.info.get('wrote'):
+            replica = self.db.get_replica_engine(self.app, self.info)
+            if replica is not None:
+                return replica
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+def remember_write(db_session):
+    """Note when the client wrote, after a session that wrote commits.
+
+    Only clients of an app with replicas need to remember, so other apps
+    don't set a session cookie on every write.
+    """
+    if db_session.info.pop('unremembered_write', False) and \
+            has_request_context() and \
+            current_app.config['SQLALCHEMY_REPLICA_URIS']:
+        session[LAST_WRITE_KEY] = time.time()
+
+
+def on_commit(callback):
+    """Call ``callback`` once the current transaction commits.
+
+    If the transaction rolls back instead, the callback is dropped. Use this
+    for side effects outside the database, like clearing caches, that must
+    only happen once the changes behind them are kept.
+    """
+    db_session = current_app.extensions['sqlalchemy'].db.session
+    db_session.info.setdefault(COMMIT_CALLBACKS_KEY, []).append(callback)
+
+
+def run_commit_callbacks(db_session):
+    """Run the callbacks `on_commit` queued, now their transaction committed.
+
+    The commit has already happened, so a failing callback is logged rather
+    than raised, and the rest still run. Committing a SAVEPOINT or a
+    subtransaction leaves them queued until the outermost transaction does.
+    """
+    transaction = db_session.transaction
+    if transaction.nested or transaction.parent is not None:
+        return
+    for callback in db_session.info.pop(COMMIT_CALLBACKS_KEY, []):
+        try:
+            callback()
+        except Exception:  # noqa: B902
+            current_app.logger.exception('Commit callback %r failed', callback)
+
+
+def drop_commit_callbacks(db_session, transaction):
+    """Forget queued callbacks once the outermost transaction ends.
+
+    After a commit they have already run, so this only drops the callbacks
+    of a transaction that was rolled back or closed.
+    """
+    if transaction.parent is None:
+        db_session.info.pop(COMMIT_CALLBACKS_KEY, None)
+
+
+class SQLAlchemy(BaseSQLAlchemy):
+    """Flask-SQLAlchemy with our engine options and read replicas.
+
+    Pools are sized from the SQLALCHEMY_POOL_* settings, and connections are
+    pinged at checkout when SQLALCHEMY_POOL_PRE_PING is set. Each URI in
+    SQLALCHEMY_REPLICA_URIS becomes a bind (``replica0``, ``replica1``, ...)
+    that `RoutingSession` can send reads to.
+    """
+
+    def init_app(self, app):
+        """Set config defaults and register the replicas as binds."""
+        app.config.setdefault('SQLALCHEMY_POOL_PRE_PING', False)
+        app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+        app.config.setdefault('SQLALCHEMY_REPLICA_STICKINESS', 5)
+        replicas = app.config['SQLALCHEMY_REPLICA_URIS']
+        if replicas:
+            binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+            binds.update(('replica{}'.format(index), uri)
+                         for index, uri in enumerate(replicas))
+            app.config['SQLALCHEMY_BINDS'] = binds
+        super(SQLAlchemy, self).init_app(app)
+
+    def create_session(self, options):
+        """Use a routing session, remembering when clients write.
+
+        Sessions also run the callbacks queued with `on_commit`.
+        """
+        factory = orm.sessionmaker(class_=RoutingSession, db=self, **options)
+        event.listen(factory, 'after_commit', remember_write)
+        event.listen(factory, 'after_commit', run_commit_callbacks)
+        event.listen(factory, 'after_transaction_end', drop_commit_callbacks)
+        return factory
+
+    def get_replica_engine(self, app, info):
+        """Return the replica a session reads from, or None if there are none.
+
+        Each session sticks to one replica, picked at random.
+
+        :param app Flask: the app
+        :param info dict: the session's info dict
+        """
+        count = len(app.config['SQLALCHEMY_REPLICA_URIS'])
+        if not count:
+            return None
+        if 'replica' not in info:
+            info['replica'] = random.randrange(count)
+        return self.get_engine(app, bind='replica{}'.format(info['replica']))
+
+    def apply_driver_hacks(self, app, info, options):
+        """Use instrumented pools wherever SQLAlchemy would use QueuePool."""
+        super(SQLAlchemy, self).apply_driver_hacks(app, info, options)
+        if info.drivername == 'sqlite':
+            return
+        replicas = [str(make_url(uri))
+                    for uri in app.config['SQLALCHEMY_REPLICA_URIS']]
+        options.setdefault('poolclass', ReplicaQueuePool
+                           if str(info) in replicas else InstrumentedQueuePool)
+        if app.config['SQLALCHEMY_POOL_PRE_PING']:
+            options['pool_events'] = [(ping_connection, 'checkout')]
@@ -38,12 +38,24 @@ class NotFound(APIException):
     status_code = 404
 
 
+class RequestEntityTooLarge(APIException):
+    """APIException for a 413."""
+
+    status_code = 413
+
+
 class UnsupportedMediaType(APIException):
     """APIException for a 415."""
 
     status_code = 415
 
 
+class RangeNotSatisfiable(APIException):
+    """APIException for a 416."""
+
+    status_code = 416
+
+
 class UnprocessableEntity(APIException):
     """APIException for a 422."""
 
@@ -1,13 +1,22 @@
 # -*- coding: utf-8 -*-
 """Extensions module. Each extension is initialized in the app factory located in app.py."""
-from flask_bcrypt import Bcrypt
 from flask_caching import Cache
 from flask_login import LoginManager
 from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
 
-bcrypt = Bcrypt()
+from poet.aws import AWSClients
+from poet.engine import SQLAlchemy
+from poet.hashing import PasswordHasher
+from poet.instrumentation import SQLInstrumentation
+from poet.metrics import Metrics
+from poet.storage import Storage
+
+hasher = PasswordHasher()
 login_manager = LoginManager()
 db = SQLAlchemy()
 migrate = Migrate()
 cache = Cache()
+aws = AWSClients()
+storage = Storage()
+sql_instrumentation = SQLInstrumentation()
+metrics = Metrics()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""Password hashing off the request thread."""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import BoundedSemaphore, Lock
+
+import bcrypt
+from flask import current_app
+
+from poet.metrics import PASSWORD_HASH_QUEUE_DEPTH
+
+
+def hash_password(password, rounds):
+    """Hash a password with bcrypt at ``rounds`` log rounds."""
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def verify_password(pw_hash, password):
+    """Return True if ``password`` matches the bcrypt hash ``pw_hash``."""
+    return bcrypt.checkpw(password, pw_hash)
+
+
+def get_rounds(pw_hash):
+    """Return the log rounds a bcrypt hash was made with."""
+    return int(pw_hash.split(b'$')[2])
+
+
+def to_bytes(value):
+    """Encode text as UTF-8, leaving bytes alone."""
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return bytes(value)
+
+
+class PasswordHasher(object):
+    """A Flask extension that runs bcrypt in a pool of worker processes.
+
+    bcrypt is slow on purpose. Its binding releases the GIL, so other threads
+    keep running, but every hash still ties up a CPU core for as long as it
+    takes, and many at once would starve the worker of CPU for everything
+    else it serves. This hands the work to a per-process pool sized by
+    PASSWORD_HASH_WORKERS, which caps how many cores hashing can use, and
+    lets at most PASSWORD_HASH_MAX_PENDING hashes be in the pool at once;
+    callers beyond that wait their turn. With no workers, hashing runs
+    inline. Settings are read from the current app on each call.
+
+    The pool forks its processes when it starts, and forking a process that
+    is already running threads can leave the children holding a lock some
+    thread had, deadlocking them. Call `start` before the worker starts any
+    threads (gunicorn.conf.py does, in post_worker_init); otherwise the pool
+    starts on first use. Like AWSClients, it is rebuilt after a fork, since
+    worker processes belong to the process that started them.
+
+    Example usage:
+
+        from poet.extensions import hasher
+
+        pw_hash = hasher.hash('secret')
+        hasher.verify(pw_hash, 'secret')  # True
+    """
+
+    def __init__(self, app=None):
+        """Create the extension, optionally binding it to an app."""
+        self._lock = Lock()
+        self._pid = None
+        self._executor = None
+        self._slots = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Set config defaults and register the extension on the app."""
+        app.config.setdefault('BCRYPT_LOG_ROUNDS', 12)
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 2)
+        app.config.setdefault('PASSWORD_HASH_MAX_PENDING', 32)
+        app.extensions['password_hasher'] = self
+
+    def start(self):
+        """Start this process's workers now rather than on first use."""
+        if current_app.config['PASSWORD_HASH_WORKERS']:
+            executor, _ = self._get_executor()
+            # the workers are forked on the first submit
+            executor.submit(int).result()
+
+    def hash(self, password):
+        """Hash a password at the configured number of rounds.
+
+        :param password string: the password to hash
+        :return bytes: the bcrypt hash
+        """
+        if not password:
+            raise ValueError('Password must be non-empty.')
+        return self._run(hash_password, to_bytes(password),
+                         current_app.config['BCRYPT_LOG_ROUNDS'])
+
+    def verify(self, pw_hash, password):
+        """Check a password against a hash.
+
+        :param pw_hash bytes: the bcrypt hash
+        :param password string: the candidate password
+        :return bool: True if the password matches
+        """
+        if not pw_hash or not password:
+            return False
+        return self._run(verify_password, to_bytes(pw_hash),
+                         to_bytes(password))
+
+    def needs_rehash(self, pw_hash):
+        """Return True if a hash was made with other than the configured rounds.
+
+        :param pw_hash bytes: the bcrypt hash
+        """
+        return get_rounds(to_bytes(pw_hash)) != \
+            current_app.config['BCRYPT_LOG_ROUNDS']
+
+    def shutdown(self):
+        """Stop this process's workers, if any were started."""
+        with self._lock:
+            if self._pid == os.getpid() and self._executor is not None:
+                self._executor.shutdown()
+            self._pid = None
+            self._executor = None
+
+    def _run(self, fn, *args):
+        """Call ``fn`` in the pool and wait for its result."""
+        if not current_app.config['PASSWORD_HASH_WORKERS']:
+            return fn(*args)
+        executor, slots = self._get_executor()
+        PASSWORD_HASH_QUEUE_DEPTH.inc()
+        try:
+            with slots:
+                return executor.submit(fn, *args).result()
+        except BrokenProcessPool:
+            # a worker died; start over with a fresh pool next time
+            self.shutdown()
+            raise
+        finally:
+            PASSWORD_HASH_QUEUE_DEPTH.dec()
+
+    def _get_executor(self):
+        """Return the pool for this process, and the slots bounding it."""
+        config = current_app.config
+        with self._lock:
+            if self._pid != os.getpid() or self._executor is None:
+                self._pid = os.getpid()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=config['PASSWORD_HASH_WORKERS'])
+                self._slots = BoundedSemaphore(
+                    config['PASSWORD_HASH_MAX_PENDING'])
+            return self._executor, self._slots
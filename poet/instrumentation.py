@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""Per-request SQL query counting and timing."""
+import json
+import logging
+import time
+from threading import Lock
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from poet.metrics import REQUEST_DB_QUERIES, REQUEST_DB_TIME
+
+logger = logging.getLogger(__name__)
+
+#: How much of the slowest statement is logged
+STATEMENT_LOG_LENGTH = 200
+
+
+class RequestStats(object):
+    """The SQL and wall time spent on one request."""
+
+    def __init__(self):
+        """Start the request's clock."""
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+
+    def record_query(self, statement, elapsed):
+        """Count a query that took ``elapsed`` seconds."""
+        self.queries += 1
+        self.db_time += elapsed
+        if elapsed > self.slowest_time:
+            self.slowest_time = elapsed
+            self.slowest_statement = statement
+
+    def wall_time(self):
+        """Seconds since the request started."""
+        return time.perf_counter() - self.started
+
+
+class SQLInstrumentation(object):
+    """A Flask extension that measures the SQL each request runs.
+
+    When SQL_INSTRUMENTATION is on, every query run while handling a request
+    is counted and timed through SQLAlchemy's engine events. When the request
+    finishes, its query count, DB time, slowest statement and wall time are:
+
+    - sent back in a Server-Timing header if SQL_INSTRUMENTATION_SERVER_TIMING
+      is on (meant for development; browsers show it in their dev tools)
+    - logged as one JSON line on the `poet.instrumentation` logger if
+      SQL_INSTRUMENTATION_LOG is on
+    - recorded per endpoint in the poet_request_db_queries and
+      poet_request_db_seconds histograms served at /metrics
+
+    Queries run outside of a request (CLI commands, background threads)
+    aren't measured.
+    """
+
+    def __init__(self, app=None):
+        """Create the extension, optionally binding it to an app."""
+        self._lock = Lock()
+        self._listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Set config defaults and hook into the app's requests."""
+        app.config.setdefault('SQL_INSTRUMENTATION', False)
+        app.config.setdefault('SQL_INSTRUMENTATION_SERVER_TIMING', False)
+        app.config.setdefault('SQL_INSTRUMENTATION_LOG', False)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.extensions['sql_instrumentation'] = self
+        with self._lock:
+            if not self._listening:
+                event.listen(Engine, 'before_cursor_execute',
+                             self._before_cursor_execute)
+                event.listen(Engine, 'after_cursor_execute',
+                             self._after_cursor_execute)
+                event.listen(Engine, 'handle_error', self._handle_error)
+                self._listening = True
+
+    @staticmethod
+    def _current_stats():
+        """Return the stats of the request being handled, if it's measured."""
+        if has_request_context():
+            return g.get('sql_stats')
+        return None
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters,
+                               context, executemany):
+        if self._current_stats() is not None:
+            conn.info.setdefault('query_started', []).append(
+                time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        stats = self._current_stats()
+        started = conn.info.get('query_started')
+        if stats is not None and started:
+            stats.record_query(statement, time.perf_counter() - started.pop())
+
+    def _handle_error(self, exception_context):
+        # a failed statement never reaches after_cursor_execute; count it
+        # here, so its start time doesn't linger on the pooled connection
+        conn = exception_context.connection
+        stats = self._current_stats()
+        started = conn.info.get('query_started') if conn is not None else None
+        if stats is not None and started:
+            stats.record_query(exception_context.statement,
+                               time.perf_counter() - started.pop())
+
+    @staticmethod
+    def _start_request():
+        if current_app.config['SQL_INSTRUMENTATION']:
+            g.sql_stats = RequestStats()
+
+    def _finish_request(self, response):
+        stats = g.get('sql_stats')
+        if stats is None:
+            return response
+        wall_time = stats.wall_time()
+        endpoint = request.endpoint or 'unknown'
+        REQUEST_DB_QUERIES.labels(endpoint).observe(stats.queries)
+        REQUEST_DB_TIME.labels(endpoint).observe(stats.db_time)
+        config = current_app.config
+        if config['SQL_INSTRUMENTATION_SERVER_TIMING']:
+            response.headers.add('Server-Timing', server_timing(
+                stats, wall_time))
+        if config['SQL_INSTRUMENTATION_LOG']:
+            logger.info(json.dumps({
+                'endpoint': endpoint,
+                'method': request.method,
+                'status': response.status_code,
+                'queries': stats.queries,
+                'db_ms': round(stats.db_time * 1000, 3),
+                'slowest_ms': round(stats.slowest_time * 1000, 3),
+                'slowest_statement': (stats.slowest_statement or '')[
+                    :STATEMENT_LOG_LENGTH],
+                'wall_ms': round(wall_time * 1000, 3),
+            }, sort_keys=True))
+        return response
+
+
+def server_timing(stats, wall_time):
+    """Format a request's stats as a Server-Timing header value.
+
+    :param stats RequestStats: the request's stats
+    :param wall_time float: the request's wall time in seconds
+    :return string: e.g. 'db;desc="3 queries";dur=1.2, app;dur=4.5'
+    """
+    metrics = [
+        'db;desc="{} queries";dur={:.3f}'.format(stats.queries,
+                                                 stats.db_time * 1000),
+        'db-slowest;dur={:.3f}'.format(stats.slowest_time * 1000),
+        'app;dur={:.3f}'.format(wall_time * 1000),
+    ]
+    return ', '.join(metrics)
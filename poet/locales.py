@@ -6,6 +6,7 @@ class Errors:
     """A class to contain all the error constants."""
 
     BAD_GUID = ('bad-guid', 'We couldn\'t understand the format of the ID.')
+    BAD_CURSOR = ('bad-cursor', 'We couldn\'t understand that page cursor.')
     USER_NOT_FOUND = ('user-not-found', 'We couldn\'t find that user')
     RESOURCE_NOT_FOUND = ('resource-not-found',
                           'We couldn\'t find that resource')
@@ -16,6 +17,16 @@ class Errors:
     IMAGE_TYPE_NOT_SUPPORTED = ('image-type-not-supported',
                                 'We don\'t allow images with that extension')
     FILE_EMPTY = ('file-required', 'An empty file was sent.')
+    FILE_TOO_LARGE = ('file-too-large', 'The file sent is too large.')
+    RENDITION_SIZE_NOT_SUPPORTED = ('rendition-size-not-supported',
+                                    'We don\'t have images in that size.')
+    RANGE_NOT_SATISFIABLE = ('range-not-satisfiable',
+                             'The requested range is outside of the file.')
+    IDS_REQUIRED = ('ids-required', 'The IDs to fetch must be sent.')
+    LIST_REQUIRED = ('list-required', 'A list of items must be sent.')
+    TOO_MANY_ITEMS = ('too-many-items', 'Too many items were sent at once.')
+    ANNOTATIONS_NOT_CREATED = ('annotations-not-created',
+                               'None of the annotations could be created.')
     UNKNOWN_ERROR = ('unknown-error', 'An unknown error occurred. Contact an '
                                       'administrator if the problem persists.')
 
@@ -24,5 +35,8 @@ class Success:
     """A class to contain all the success constants."""
 
     EMAIL_SENT = ('email-sent', 'Email sent successfully!')
+    EMAIL_QUEUED = ('email-queued', 'Email queued for sending.')
     ANNOTATION_CREATED = ('annotation-created',
                           'Annotation successfully created!')
+    ANNOTATIONS_CREATED = ('annotations-created',
+                           'Annotations successfully created!')
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""Prometheus metrics for the app.
+
+Metrics are kept per process. Under gunicorn, set PROMETHEUS_MULTIPROC_DIR
+to an empty directory shared by every worker (gunicorn.conf.py does) and
+/metrics merges what every worker has written there.
+"""
+import os
+import time
+
+from flask import Response, current_app, g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+
+REQUEST_LATENCY = Histogram(
+    'poet_request_duration_seconds', 'Time spent handling requests.',
+    ['endpoint', 'method', 'status'])
+REQUESTS_IN_FLIGHT = Gauge(
+    'poet_requests_in_flight', 'Requests being handled right now.',
+    multiprocess_mode='livesum')
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    'poet_db_pool_checkout_seconds',
+    'Time spent waiting for a database connection from the pool.',
+    ['database'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5,
+             5, 10, 30))
+DB_POOL_CONNECTIONS_IN_USE = Gauge(
+    'poet_db_pool_connections_in_use',
+    'Database connections checked out of the pool.', ['database'],
+    multiprocess_mode='livesum')
+DB_POOL_CHECKOUT_TIMEOUTS = Counter(
+    'poet_db_pool_checkout_timeouts_total',
+    'Checkouts that gave up waiting for a database connection.',
+    ['database'])
+REQUEST_DB_QUERIES = Histogram(
+    'poet_request_db_queries', 'SQL statements run per request.',
+    ['endpoint'], buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250))
+REQUEST_DB_TIME = Histogram(
+    'poet_request_db_seconds', 'Time spent running SQL per request.',
+    ['endpoint'])
+AWS_CALL_LATENCY = Histogram(
+    'poet_aws_call_duration_seconds', 'Time spent on AWS API calls.',
+    ['service', 'operation'])
+AWS_CALL_ERRORS = Counter(
+    'poet_aws_call_errors_total', 'AWS API calls that failed.',
+    ['service', 'operation', 'error'])
+UPLOAD_BYTES = Counter(
+    'poet_upload_bytes_total', 'Bytes of upload files received and sent.',
+    ['direction'])
+RESOURCE_CACHE_REQUESTS = Counter(
+    'poet_resource_cache_requests_total',
+    'Find endpoint lookups in the resource cache.',
+    ['resource', 'outcome'])
+PASSWORD_HASH_QUEUE_DEPTH = Gauge(
+    'poet_password_hash_queue_depth',
+    'Password hashes waiting for or running in the hashing pool.',
+    multiprocess_mode='livesum')
+
+
+class Metrics(object):
+    """A Flask extension that measures requests and serves /metrics."""
+
+    def __init__(self, app=None):
+        """Create the extension, optionally binding it to an app."""
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Hook into the app's requests and add the /metrics route."""
+        app.config.setdefault('METRICS_ENABLED', True)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule('/metrics', 'metrics', metrics_view)
+        app.extensions['metrics'] = self
+
+    @staticmethod
+    def _start_request():
+        REQUESTS_IN_FLIGHT.inc()
+        g.metrics_started = time.perf_counter()
+
+    @staticmethod
+    def _finish_request(response):
+        started = g.get('metrics_started')
+        if started is not None and request.endpoint != 'metrics':
+            REQUEST_LATENCY.labels(
+                request.endpoint or 'unknown', request.method,
+                response.status_code).observe(time.perf_counter() - started)
+        return response
+
+    @staticmethod
+    def _teardown_request(exc):
+        if g.pop('metrics_started', None) is not None:
+            REQUESTS_IN_FLIGHT.dec()
+
+
+def metrics_view():
+    """Expose every metric in the Prometheus text format."""
+    if not current_app.config['METRICS_ENABLED']:
+        return Response(status=404)
+    registry = REGISTRY
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def instrument_aws_client(client):
+    """Time every call a boto3 client makes and count the failures.
+
+    :param client: a boto3 client
+    """
+    service = client.meta.service_model.service_name
+
+    def before_call(model, context, **kwargs):
+        context['metrics_operation'] = model.name
+        context['metrics_started'] = time.perf_counter()
+
+    def after_call(http_response, parsed, model, context, **kwargs):
+        observe_aws_call(service, model.name, context)
+        if http_response.status_code >= 300:
+            AWS_CALL_ERRORS.labels(service, model.name, parsed.get(
+                'Error', {}).get('Code', 'Unknown')).inc()
+
+    def after_call_error(exception, context, **kwargs):
+        operation = context.get('metrics_operation', 'unknown')
+        observe_aws_call(service, operation, context)
+        AWS_CALL_ERRORS.labels(service, operation,
+                               type(exception).__name__).inc()
+
+    events = client.meta.events
+    # first, so the clock starts even if a later handler answers the call
+    events.register_first('before-call.*.*', before_call)
+    events.register('after-call.*.*', after_call)
+    events.register('after-call-error.*.*', after_call_error)
+
+
+def observe_aws_call(service, operation, context):
+    """Record how long an AWS call took, if it was timed."""
+    started = context.pop('metrics_started', None)
+    if started is not None:
+        AWS_CALL_LATENCY.labels(service, operation).observe(
+            time.perf_counter() - started)
+
+
+def count_upload_bytes(direction, count):
+    """Count bytes of upload files received ('in') or sent ('out')."""
+    if count:
+        UPLOAD_BYTES.labels(direction).inc(count)
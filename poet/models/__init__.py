@@ -1,4 +1,6 @@
 """Import all models here."""
 from .annotation import Annotation  # noqa
+from .blob import Blob  # noqa
+from .email_job import EmailJob  # noqa
 from .upload import Upload  # noqa
 from .user import Role, User  # noqa
@@ -2,6 +2,7 @@
 """Annotation models."""
 import datetime as dt
 
+from poet.caching import email_body_cache_key
 from poet.database import (Column, Model, db, reference_col, relationship,
                            UUIDMixin)
 
@@ -10,6 +11,16 @@ class Annotation(UUIDMixin, Model):
     """An annotation submitted by a user."""
 
     __tablename__ = 'annotations'
+    __table_args__ = (
+        # each filter on the list endpoint pages by (created_at, id)
+        db.Index('ix_annotations_created_at_id', 'created_at', 'id'),
+        db.Index('ix_annotations_upload_id_created_at',
+                 'upload_id', 'created_at'),
+        db.Index('ix_annotations_category_created_at',
+                 'category', 'created_at'),
+        db.Index('ix_annotations_user_id_created_at',
+                 'user_id', 'created_at'),
+    )
     created_at = Column(db.DateTime, nullable=False, default=dt.datetime.utcnow)
     user_id = reference_col('users', nullable=True)
     user = relationship('User', backref='annotations')
@@ -17,3 +28,9 @@ class Annotation(UUIDMixin, Model):
     upload = relationship('Upload', backref='annotations')
     description = Column(db.Text, nullable=False)
     category = Column(db.String(80), nullable=True)
+
+    @classmethod
+    def cache_keys(cls, identity):
+        """Return the keys of everything cached from an annotation."""
+        return super(Annotation, cls).cache_keys(identity) + [
+            email_body_cache_key(identity[0])]
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""Blob models."""
+import datetime as dt
+import hashlib
+import os
+import uuid
+from functools import partial
+
+from sqlalchemy.dialects.postgresql import insert
+
+from poet.database import Column, Model, db
+from poet.engine import on_commit
+from poet.extensions import storage
+from poet.renditions import delete_renditions
+from poet.storage.base import CHUNK_SIZE
+
+
+class HashingReader(object):
+    """A read-only file wrapper that hashes everything read through it."""
+
+    def __init__(self, fp):
+        """Wrap the file pointer ``fp``."""
+        self.fp = fp
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        """Read from the wrapped file, updating the hash and size."""
+        data = self.fp.read(size)
+        self.sha256.update(data)
+        self.size += len(data)
+        return data
+
+    def hexdigest(self):
+        """The SHA-256 of everything read so far."""
+        return self.sha256.hexdigest()
+
+
+def is_seekable(fp):
+    """Return True if the file pointer can be rewound."""
+    try:
+        fp.seek(0, os.SEEK_CUR)
+    except (AttributeError, OSError):
+        return False
+    return True
+
+
+def delete_files(location, sha256):
+    """Delete a blob's stored file and any renditions made from it."""
+    storage.backend.delete(location)
+    delete_renditions(sha256)
+
+
+class Blob(Model):
+    """The stored contents of one or more uploads, keyed by their SHA-256.
+
+    Uploads with identical contents share a blob, so a file is stored once no
+    matter how many times it is uploaded. `refcount` tracks how many uploads
+    point at the blob; the stored file is removed when it drops to zero.
+    """
+
+    __tablename__ = 'blobs'
+    sha256 = Column(db.String(64), primary_key=True)
+    size = Column(db.BigInteger, nullable=False)
+    refcount = Column(db.Integer, nullable=False, default=0)
+    created_at = Column(db.DateTime, nullable=False, default=dt.datetime.utcnow)
+
+    # this column is internal and used to find & retrieve the file
+    retrieval_location = Column(db.String(512), nullable=False)
+
+    @classmethod
+    def store(cls, upload_file, filename):
+        """Store a file, reusing an existing blob with the same contents.
+
+        Seekable files (like the ones Werkzeug spools form uploads into) are
+        hashed before anything is written, so a duplicate never reaches
+        storage. Streams are hashed while they are written to a staging
+        location, which is discarded if the contents turn out to be known.
+
+        The blob's refcount is incremented; committing is left to the caller.
+
+        :param upload_file file-like: the file pointer to read and save
+        :param filename string: the upload's filename, whose extension is
+            kept on the stored file
+        :return Blob: the blob holding the file's contents
+        """
+        extension = os.path.splitext(filename)[1]
+        if is_seekable(upload_file):
+            start = upload_file.tell()
+            reader = HashingReader(upload_file)
+            while reader.read(CHUNK_SIZE):
+                pass
+            upload_file.seek(start)
+            sha256 = reader.hexdigest()
+            blob = cls.acquire(sha256)
+            if blob is not None:
+                return blob
+            location = storage.backend.save(sha256 + extension, upload_file)
+        else:
+            reader = HashingReader(upload_file)
+            staged_name = 'staging/{}{}'.format(uuid.uuid4(), extension)
+            staged = storage.backend.save(staged_name, reader)
+            sha256 = reader.hexdigest()
+            blob = cls.acquire(sha256)
+            if blob is not None:
+                storage.backend.delete(staged)
+                return blob
+            location = storage.backend.move(staged, sha256 + extension)
+
+        blob = cls.adopt(sha256, reader.size, location)
+        if blob.retrieval_location != location:
+            storage.backend.delete(location)
+        return blob
+
+    @classmethod
+    def adopt(cls, sha256, size, location):
+        """Take a reference to the blob for a file that is already stored.
+
+        If a blob with those contents exists (say a concurrent request stored
+        them first) this just takes a reference to it, and its retrieval
+        location wins over ``location``.
+
+        :param sha256 string: the hex SHA-256 of the contents
+        :param size int: the size of the contents in bytes
+        :param location string: where the stored file can be retrieved
+        :return Blob: the blob holding those contents
+        """
+        table = cls.__table__
+        db.session.execute(
+            insert(table)
+            .values(sha256=sha256, size=size, refcount=1,
+                    retrieval_location=location,
+                    created_at=dt.datetime.utcnow())
+            .on_conflict_do_update(
+                index_elements=[table.c.sha256],
+                set_={'refcount': table.c.refcount + 1}))
+        return cls.get_fresh(sha256)
+
+    @classmethod
+    def acquire(cls, sha256):
+        """Take a reference to the blob with the given hash, if there is one.
+
+        :param sha256 string: the hex SHA-256 of the contents
+        :return Blob: the blob, or None if those contents aren't stored yet
+        """
+        table = cls.__table__
+        result = db.session.execute(
+            table.update()
+            .where(table.c.sha256 == sha256)
+            .values(refcount=table.c.refcount + 1))
+        if not result.rowcount:
+            return None
+        return cls.get_fresh(sha256)
+
+    @classmethod
+    def get_fresh(cls, sha256):
+        """Load a blob, bypassing any stale copy in the session.
+
+        Pending objects are not flushed first, so this is safe to call while
+        an upload that will point at the blob is still half built.
+        """
+        with db.session.no_autoflush:
+            return cls.query.populate_existing().get(sha256)
+
+    def release(self):
+        """Drop a reference, deleting the blob once nothing points at it.
+
+        Anything pointing at the blob must already be deleted and flushed.
+        Committing is left to the caller; the stored file and its renditions
+        are only deleted once that commit succeeds, so a rollback never
+        leaves a blob whose file is gone.
+        """
+        table = Blob.__table__
+        db.session.execute(
+            table.update()
+            .where(table.c.sha256 == self.sha256)
+            .values(refcount=table.c.refcount - 1))
+        result = db.session.execute(
+            table.delete()
+            .where(table.c.sha256 == self.sha256)
+            .where(table.c.refcount <= 0))
+        if result.rowcount:
+            db.session.expunge(self)
+            on_commit(partial(delete_files, self.retrieval_location,
+                              self.sha256))
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return '<Blob({sha256!r})>'.format(sha256=self.sha256)
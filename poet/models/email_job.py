@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Email job models."""
+import datetime as dt
+import random
+
+from poet.database import (Column, Model, db, reference_col, relationship,
+                           UUIDMixin)
+
+
+class EmailJob(UUIDMixin, Model):
+    """An annotation email waiting to be sent, or the record of sending it.
+
+    Jobs move from `queued` to `sending` when a worker claims them and end up
+    `sent` or, after too many attempts, `failed`. A job is due when its
+    `next_attempt_at` has passed; for a job being sent that is when the
+    worker's lease on it runs out, so jobs held by a worker that died are
+    picked up again.
+    """
+
+    QUEUED = 'queued'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+    __tablename__ = 'email_jobs'
+    __table_args__ = (
+        db.Index('ix_email_jobs_status_next_attempt_at',
+                 'status', 'next_attempt_at'),
+    )
+    created_at = Column(db.DateTime, nullable=False, default=dt.datetime.utcnow)
+    annotation_id = reference_col('annotations', nullable=False)
+    annotation = relationship('Annotation')
+    to_email = Column(db.String(254), nullable=False)
+    status = Column(db.String(16), nullable=False, default=QUEUED)
+    attempts = Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = Column(db.DateTime, nullable=False,
+                             default=dt.datetime.utcnow)
+    sent_at = Column(db.DateTime, nullable=True)
+    last_error = Column(db.Text, nullable=True)
+
+    @classmethod
+    def claim_next(cls, lease, limit=1):
+        """Claim the next due jobs for the calling worker and commit.
+
+        The jobs claimed together all email the same annotation, so its body
+        can be rendered once and sent to every address in one go. Rows other
+        workers are claiming are skipped rather than waited on, so any number
+        of workers can share the table.
+
+        :param lease int: seconds the worker has to finish before the jobs
+            are handed to another one
+        :param limit int: (default: 1) the most jobs to claim
+        :return list: the claimed jobs, oldest first; empty if none are due
+        """
+        now = dt.datetime.utcnow()
+        due = (cls.query
+               .filter(cls.status.in_((cls.QUEUED, cls.SENDING)),
+                       cls.next_attempt_at <= now)
+               .order_by(cls.next_attempt_at)
+               .with_for_update(skip_locked=True))
+        first = due.first()
+        jobs = []
+        if first is not None:
+            jobs = [first] + due.filter(
+                cls.annotation_id == first.annotation_id,
+                cls.id != first.id).limit(limit - 1).all()
+        for job in jobs:
+            job.update(commit=False, status=cls.SENDING,
+                       attempts=job.attempts + 1,
+                       next_attempt_at=now + dt.timedelta(seconds=lease))
+        db.session.commit()
+        return jobs
+
+    def mark_sent(self, commit=True):
+        """Record that the email went out."""
+        return self.update(commit=commit, status=self.SENT,
+                           sent_at=dt.datetime.utcnow(), last_error=None)
+
+    def mark_failed(self, error, max_attempts, backoff, commit=True):
+        """Record a failed attempt, retrying later if attempts remain.
+
+        Retries back off exponentially, with jitter so that jobs which failed
+        together don't all retry together.
+
+        :param error string: what went wrong
+        :param max_attempts int: how many attempts a job gets in total
+        :param backoff int: seconds to wait before the first retry; each
+            retry after it waits twice as long
+        :param commit bool: (default: True) whether to commit
+        """
+        if self.attempts >= max_attempts:
+            return self.update(commit=commit, status=self.FAILED,
+                               last_error=error)
+        delay = backoff * 2 ** (self.attempts - 1) * random.uniform(0.5, 1)
+        return self.update(
+            commit=commit, status=self.QUEUED, last_error=error,
+            next_attempt_at=dt.datetime.utcnow() + dt.timedelta(seconds=delay))
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return '<EmailJob({id!r}, {status!r})>'.format(
+            id=self.id, status=self.status)
@@ -1,16 +1,17 @@
 # -*- coding: utf-8 -*-
 """Upload models."""
 import datetime as dt
-import os
-import uuid
+import time
 from io import BytesIO
 
-import boto3
 from flask import current_app
 from flask_login import current_user
 
-from poet.database import (Column, Model, db, reference_col, relationship,
-                           UUIDMixin)
+from poet.database import (Column, Model, db, maybe_commit, reference_col,
+                           relationship, UUIDMixin)
+from poet.extensions import cache, storage
+
+from .blob import Blob
 
 
 class Upload(UUIDMixin, Model):
@@ -21,6 +22,9 @@ class Upload(UUIDMixin, Model):
     created_at = Column(db.DateTime, nullable=False, default=dt.datetime.utcnow)
     user_id = reference_col('users', nullable=True)
     user = relationship('User', backref='uploads')
+    blob_sha256 = reference_col('blobs', nullable=True, pk_name='sha256',
+                                index=True)
+    blob = relationship('Blob', backref='uploads')
 
     # this column is internal and used to find & retrieve the file
     retrieval_location = Column(db.String(512), nullable=False)
@@ -48,77 +52,101 @@ class Upload(UUIDMixin, Model):
         :param upload_file file-like: the file pointer to read and save
         :return: None
 
-        This method should set the retrieval_location column.
+        This method should set the retrieval_location column. Files are
+        content-addressed, so uploading contents that are already stored
+        shares the existing blob instead of saving another copy.
 
         Note that a new file cannot be saved if the upload has already saved a
         file.
         """
         if self.retrieval_location is not None:
             raise RuntimeError('cannot overwrite an upload\'s file')
-        if current_app.config['SAVE_UPLOADS_LOCALLY']:
-            self.retrieval_location = self.save_file_locally(upload_file)
-        else:
-            self.retrieval_location = self.save_file_to_s3(upload_file)
+        blob = Blob.store(upload_file, self.filename)
+        self.retrieval_location = blob.retrieval_location
+        self.blob = blob
+
+    def delete(self, commit=True):
+        """Remove the upload, releasing its hold on the stored file."""
+        blob = self.blob
+        super(Upload, self).delete(commit=False)
+        if blob is not None:
+            db.session.flush()
+            blob.release()
+        return commit and maybe_commit()
 
-    def save_file_locally(self, upload_file):
-        """Save a file to the local file system.
+    def retrieve_file(self):
+        """Return the file read into memory, as a file pointer.
 
-        :param upload_file file-like: the file pointer to read and save
-        :return string: the string of where the file the file locally
+        :return file-like: object
         """
-        saved_filename = str(uuid.uuid4()) + "_{}".format(self.filename)
-        fpath = os.path.join(current_app.config['UPLOADS_DIR'], saved_filename)
-        upload_file.save(fpath)
-        return fpath
-
-    def save_file_to_s3(self, upload_file):
-        """Save a file to some S3 bucket.
+        fp, _ = self.open_file_stream()
+        try:
+            return BytesIO(fp.read())
+        finally:
+            fp.close()
 
-        :param upload_file file-like: the file pointer to read and save
-        :return string: the string of where the file the file in the S3 bucket
-        """
-        s3 = boto3.resource('s3')
-        saved_filename = str(uuid.uuid4()) + "_{}".format(self.filename)
-        s3.Object(current_app.config['S3_UPLOADS_BUCKET'], saved_filename)\
-            .put(Body=upload_file)
-        return saved_filename
+    def open_file_stream(self, start=0, end=None):
+        """Open the file, or a byte range of it, for streaming.
 
-    def retrieve_file(self):
-        """Return the file as a file pointer that is open to be read.
+        See StorageBackend.open; missing files raise FileNotFoundError.
 
-        :return file-like: object
+        :return tuple: a (file-like, content length) pair. The file-like only
+            needs to support ``read(size)`` and ``close()``.
         """
-        if current_app.config['SAVE_UPLOADS_LOCALLY']:
-            return self.get_local_file()
-        else:
-            return self.get_s3_file()
+        return storage.backend.open(self.retrieval_location, start=start,
+                                    end=end)
 
-    def get_local_file(self):
-        """Return a file pointer to the local file.
+    def file_size(self):
+        """Return the size of the file in bytes."""
+        if self.blob is not None:
+            return self.blob.size
+        return storage.backend.size(self.retrieval_location)
 
-        :return file-like:
+    def presigned_url(self):
+        """Return a short-lived URL to fetch the file from storage directly.
+
+        :return string: the presigned URL, or None if the storage backend
+            can't serve files itself
         """
-        return open(self.retrieval_location, 'rb')
+        return self.make_presigned_url(self.retrieval_location)
+
+    @staticmethod
+    def make_presigned_url(retrieval_location):
+        """Presign a URL for any stored file, like an upload's renditions.
 
-    def get_s3_file(self):
-        """Return a file pointer to the S3 object.
+        Signatures are cached per time bucket of UPLOAD_PRESIGNED_URL_TTL
+        seconds so repeated requests reuse one URL instead of re-signing. Each
+        URL is signed for two buckets, so a cached one is always valid for at
+        least a full bucket after it is handed out.
 
-        :return file-like:
+        :param retrieval_location string: where the file is stored
+        :return string: the presigned URL, or None if the storage backend
+            can't serve files itself
         """
-        s3 = boto3.client('s3')
-        fp = BytesIO()
-        s3.download_fileobj(current_app.config['S3_UPLOADS_BUCKET'],
-                            self.retrieval_location, fp)
-        fp.seek(0)
-        return fp
+        ttl = current_app.config['UPLOAD_PRESIGNED_URL_TTL']
+        time_bucket = int(time.time() // ttl)
+        cache_key = 'presigned-url:{}:{}'.format(retrieval_location,
+                                                 time_bucket)
+        url = cache.get(cache_key)
+        if url is None:
+            url = storage.backend.presigned_url(retrieval_location,
+                                                expires_in=2 * ttl)
+            if url is not None:
+                cache.set(cache_key, url, timeout=ttl)
+        return url
 
     @property
     def cdn_link(self):
         """A link to the CDN location for the file attached to the upload."""
+        return self.make_cdn_link(self.retrieval_location)
+
+    @staticmethod
+    def make_cdn_link(retrieval_location):
+        """Build the CDN link for a file from where it is stored."""
         return 'https://{host}/{dir}/{fname}'.format(
             host=current_app.config['BASE_CDN_HOST'],
             dir=current_app.config['S3_UPLOADS_BUCKET'],
-            fname=self.retrieval_location)
+            fname=retrieval_location)
 
     def __repr__(self):
         """Represent instance as a unique string."""
@@ -6,7 +6,7 @@ from flask_login import UserMixin
 
 from poet.database import (Column, Model, SurrogatePK, db, reference_col,
                            relationship, UUIDMixin)
-from poet.extensions import bcrypt
+from poet.extensions import hasher
 
 
 class Role(SurrogatePK, Model):
@@ -49,11 +49,20 @@ class User(UserMixin, UUIDMixin, Model):
 
     def set_password(self, password):
         """Set password."""
-        self.password = bcrypt.generate_password_hash(password)
+        self.password = hasher.hash(password)
 
     def check_password(self, value):
-        """Check password."""
-        return bcrypt.check_password_hash(self.password, value)
+        """Check password.
+
+        A matching password whose hash was made with other than the
+        configured BCRYPT_LOG_ROUNDS is rehashed, and the new hash is saved
+        with the session's next commit.
+        """
+        if not hasher.verify(self.password, value):
+            return False
+        if hasher.needs_rehash(self.password):
+            self.set_password(value)
+        return True
 
     @property
     def full_name(self):
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""Resized renditions of uploaded images."""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from threading import Lock
+
+from flask import current_app
+from PIL import Image
+
+from poet.extensions import cache, storage
+
+#: Extensions that aren't raster images, so they're always served as is
+VECTOR_EXTENSIONS = set(['.svg'])
+
+#: Pillow's name for each rendition format
+PIL_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+
+#: Cached in place of a location when an upload can't be resized
+UNSUPPORTED = 'unsupported'
+
+
+class Rendition(object):
+    """One resized version of an upload's image."""
+
+    def __init__(self, upload, width, fmt):
+        """Describe the rendition of ``upload`` at ``width`` pixels wide.
+
+        Renditions are keyed by the upload's content hash when it has one, so
+        uploads that share a blob share renditions too.
+        """
+        self.source_location = upload.retrieval_location
+        self.source_name = upload.blob_sha256 or str(upload.id)
+        self.width = width
+        self.format = fmt
+        stem = os.path.splitext(upload.filename)[0]
+        self.filename = '{}_{}w.{}'.format(stem, width, fmt)
+        self._location = None
+
+    @property
+    def key(self):
+        """The storage key the rendition is saved under."""
+        return 'renditions/{}/{}.{}'.format(self.source_name, self.width,
+                                            self.format)
+
+    @property
+    def etag(self):
+        """An ETag that changes whenever the rendition's bytes would."""
+        return '{}-{}.{}'.format(self.source_name, self.width, self.format)
+
+    @property
+    def mimetype(self):
+        """The rendition's mimetype."""
+        return 'image/{}'.format(self.format)
+
+    @property
+    def cache_key(self):
+        """The cache key remembering where the rendition is."""
+        return 'rendition:' + self.key
+
+    def locate(self):
+        """Return the rendition's location, generating it if it is missing.
+
+        Where each rendition is gets cached for UPLOAD_RENDITION_CACHE_TIMEOUT
+        seconds, so after the first request this doesn't touch storage at
+        all. If the file turns out to be gone when it's opened (deleted by
+        another process, say), call `forget` and locate it again. Sources
+        that can't be resized are remembered for
+        UPLOAD_RENDITION_UNSUPPORTED_TIMEOUT seconds, so a failure that was
+        only transient gets retried.
+
+        :return string: the location, or None if the source can't be resized
+        """
+        if self._location is not None:
+            return self._location
+        config = current_app.config
+        location = cache.get(self.cache_key)
+        if location is None:
+            location = storage.backend.locate(self.key)
+            if not storage.backend.exists(location):
+                location = self.generate()
+            timeout = config['UPLOAD_RENDITION_CACHE_TIMEOUT']
+            if location is None:
+                location = UNSUPPORTED
+                timeout = config['UPLOAD_RENDITION_UNSUPPORTED_TIMEOUT']
+            cache.set(self.cache_key, location, timeout=timeout)
+        if location == UNSUPPORTED:
+            return None
+        self._location = location
+        return location
+
+    def forget(self):
+        """Drop the cached location, e.g. because its file is gone."""
+        self._location = None
+        cache.delete(self.cache_key)
+
+    def generate(self):
+        """Resize the source image and save the result.
+
+        :return string: the location, or None if the source can't be resized
+        """
+        source_fp, _ = storage.backend.open(self.source_location)
+        try:
+            # Pillow needs to seek, which streaming bodies can't
+            data = BytesIO(source_fp.read())
+        finally:
+            source_fp.close()
+        try:
+            image = Image.open(data)
+            image.thumbnail((self.width, self.width * 100), Image.LANCZOS)
+            if self.format == 'jpeg' and image.mode != 'RGB':
+                image = image.convert('RGB')
+            elif image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA')
+            resized = BytesIO()
+            image.save(resized, PIL_FORMATS[self.format],
+                       quality=current_app.config['UPLOAD_RENDITION_QUALITY'])
+        except (IOError, ValueError, Image.DecompressionBombError):
+            current_app.logger.warning('Could not resize %s',
+                                       self.source_location)
+            return None
+        resized.seek(0)
+        return storage.backend.save(self.key, resized)
+
+
+def delete_renditions(source_name):
+    """Delete every configured rendition made from a source file.
+
+    :param source_name string: the blob hash (or upload ID) the renditions
+        were keyed by
+    """
+    config = current_app.config
+    for width in config['UPLOAD_RENDITION_WIDTHS']:
+        key = 'renditions/{}/{}.{}'.format(
+            source_name, width, config['UPLOAD_RENDITION_FORMAT'])
+        cache.delete('rendition:' + key)
+        storage.backend.delete(storage.backend.locate(key))
+
+
+def can_resize(upload):
+    """Return True if the upload is a raster image that renditions exist for."""
+    extension = os.path.splitext(upload.filename)[1].lower()
+    return extension not in VECTOR_EXTENSIONS
+
+
+def get_rendition(upload, width):
+    """Return the rendition of an upload at a configured width.
+
+    :return Rendition: the rendition, or None if the upload can't be resized
+    """
+    if not can_resize(upload):
+        return None
+    rendition = Rendition(upload, width,
+                          current_app.config['UPLOAD_RENDITION_FORMAT'])
+    if rendition.locate() is None:
+        return None
+    return rendition
+
+
+class RenditionPool(object):
+    """A per-process pool of threads generating renditions in the background.
+
+    Like AWSClients, the pool is rebuilt after a fork, since threads don't
+    survive one.
+    """
+
+    def __init__(self):
+        """Create the pool; threads are started on first use."""
+        self._lock = Lock()
+        self._pid = None
+        self._executor = None
+
+    def submit(self, upload):
+        """Generate every configured rendition of an upload in the background.
+
+        The upload's attributes are read now, so the worker never touches the
+        database session.
+        """
+        app = current_app._get_current_object()
+        renditions = [Rendition(upload, width,
+                                app.config['UPLOAD_RENDITION_FORMAT'])
+                      for width in app.config['UPLOAD_RENDITION_WIDTHS']]
+        return self._get_executor(app).submit(
+            generate_renditions, app, renditions)
+
+    def _get_executor(self, app):
+        """Return the executor for this process."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._executor = ThreadPoolExecutor(
+                    max_workers=app.config['UPLOAD_RENDITION_WORKERS'])
+            return self._executor
+
+
+def generate_renditions(app, renditions):
+    """Make sure each rendition exists, within the app's context."""
+    with app.app_context():
+        for rendition in renditions:
+            try:
+                rendition.locate()
+            except Exception:  # noqa: B902
+                app.logger.exception('Could not generate %s', rendition.key)
+
+
+pool = RenditionPool()
+
+
+def schedule_renditions(upload):
+    """Queue an upload's renditions if the app generates them eagerly."""
+    if can_resize(upload) and \
+            current_app.config['UPLOAD_RENDITIONS_ON_CREATE']:
+        pool.submit(upload)
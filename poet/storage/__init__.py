@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""Pluggable storage for upload files."""
+from flask import current_app
+
+from .base import StorageBackend  # noqa
+from .fake_s3 import FakeS3Client, FakeS3Storage  # noqa
+from .local import LocalStorage
+from .memory import MemoryStorage
+from .s3 import S3Storage
+
+#: Every backend, by the name STORAGE_BACKEND selects it with
+BACKENDS = {backend.name: backend for backend in (
+    LocalStorage, S3Storage, MemoryStorage, FakeS3Storage)}
+
+
+def backend_name(config):
+    """Return the name of the backend the config selects.
+
+    STORAGE_BACKEND wins when it is set; otherwise SAVE_UPLOADS_LOCALLY picks
+    between local and S3 storage like it always has.
+    """
+    name = config.get('STORAGE_BACKEND')
+    if name is None:
+        name = 'local' if config['SAVE_UPLOADS_LOCALLY'] else 's3'
+    return name
+
+
+class Storage(object):
+    """A Flask extension that hands out the configured storage backend.
+
+    Backends are created on first use and kept on the app, so in-memory
+    backends hold on to their files for the app's lifetime.
+
+    Example usage:
+
+        from poet.extensions import storage
+
+        location = storage.backend.save('key.png', fp)
+        fp, length = storage.backend.open(location)
+    """
+
+    def __init__(self, app=None):
+        """Create the extension, optionally binding it to an app."""
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Set config defaults and register the extension on the app."""
+        app.config.setdefault('STORAGE_BACKEND', None)
+        app.extensions['storage'] = {}
+
+    @property
+    def backend(self):
+        """The current app's backend."""
+        name = backend_name(current_app.config)
+        backends = current_app.extensions['storage']
+        if name not in backends:
+            backends[name] = BACKENDS[name].from_config(current_app.config)
+        return backends[name]
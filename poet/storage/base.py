@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""The interface every storage backend implements."""
+import shutil
+
+#: How many bytes to read at a time while copying a file
+CHUNK_SIZE = 64 * 1024
+
+
+class LimitedReader(object):
+    """A read-only file wrapper that stops after a number of bytes."""
+
+    def __init__(self, fp, length):
+        """Wrap the file pointer ``fp``, yielding at most ``length`` bytes."""
+        self.fp = fp
+        self.remaining = length
+
+    def read(self, size=-1):
+        """Read from the wrapped file without passing the limit."""
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fp.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        """Close the wrapped file."""
+        self.fp.close()
+
+
+class StorageBackend(object):
+    """A place to keep upload files.
+
+    Files are saved under a key and come back as a location: an opaque
+    string that the same backend can later open, check or delete. Locations
+    are what gets stored in the database.
+
+    Every method raises FileNotFoundError for a location that doesn't exist,
+    whatever the backend, so callers only have one error to handle.
+    """
+
+    #: The name used to select this backend with STORAGE_BACKEND
+    name = None
+
+    #: Whether clients can fetch files from the backend directly, through
+    #: presigned URLs or a CDN in front of it
+    serves_urls = False
+
+    @classmethod
+    def from_config(cls, config):
+        """Create the backend from the app's configuration."""
+        return cls()
+
+    def locate(self, key):
+        """Return the location a file saved under ``key`` ends up at.
+
+        This lets callers check for a file they would have saved under a
+        well-known key without keeping its location anywhere.
+        """
+        return key
+
+    def save(self, key, fp):
+        """Save a file, reading it front to back.
+
+        :param key string: the name to save the file under
+        :param fp file-like: the file to read, which may be a non-seekable
+            stream
+        :return string: the location of the saved file
+        """
+        raise NotImplementedError
+
+    def open(self, location, start=0, end=None):
+        """Open a file, or a byte range of it, for streaming.
+
+        :param location string: the location of the file
+        :param start int: (default: 0) the first byte to read
+        :param end int: (default: None) the last byte to read, inclusive, or
+            None to read to the end of the file
+        :return tuple: a (file-like, length) pair. The file-like supports
+            ``read(size)`` and ``close()`` and yields ``length`` bytes.
+        """
+        raise NotImplementedError
+
+    def size(self, location):
+        """Return the size of a file in bytes."""
+        raise NotImplementedError
+
+    def exists(self, location):
+        """Return True if there is a file at the location."""
+        try:
+            self.size(location)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def delete(self, location):
+        """Delete a file. Deleting a missing file is not an error."""
+        raise NotImplementedError
+
+    def move(self, location, key):
+        """Move a file to a new key.
+
+        Backends should override this when they can move a file without
+        copying its contents through the app.
+
+        :return string: the new location of the file
+        """
+        fp, _ = self.open(location)
+        try:
+            new_location = self.save(key, fp)
+        finally:
+            fp.close()
+        self.delete(location)
+        return new_location
+
+    def local_path(self, location):
+        """Return the file's path on the local file system.
+
+        :return string: the absolute path, or None if the backend doesn't
+            keep files on the local file system
+        """
+        return None
+
+    def presigned_url(self, location, expires_in):
+        """Return a URL clients can fetch the file from directly.
+
+        :param location string: the location of the file
+        :param expires_in int: how many seconds the URL should work for
+        :return string: the URL, or None if the backend can't serve files
+            itself
+        """
+        return None
+
+
+def copy_file(src, dst):
+    """Copy one file-like to another in bounded chunks."""
+    shutil.copyfileobj(src, dst, CHUNK_SIZE)
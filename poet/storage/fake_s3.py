@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""An in-process stand-in for S3."""
+import re
+from io import BytesIO
+from threading import Lock
+
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+
+from .s3 import S3Storage
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d+)-(\d*)$')
+
+
+class FakeS3Client(object):
+    """Implements the S3 client calls S3Storage makes, against a dict.
+
+    Missing objects raise the same ClientErrors boto3 does, so S3Storage's
+    error handling gets exercised without a network or AWS credentials.
+    """
+
+    def __init__(self):
+        """Start with no buckets."""
+        self.objects = {}
+        self._lock = Lock()
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, Config=None):  # noqa: N803
+        """Store everything read from the file."""
+        self.put_object(Bucket=Bucket, Key=Key, Body=Fileobj.read())
+
+    def put_object(self, Bucket, Key, Body):  # noqa: N803
+        """Store some bytes."""
+        with self._lock:
+            self.objects[(Bucket, Key)] = bytes(Body)
+        return {}
+
+    def get_object(self, Bucket, Key, Range=None):  # noqa: N803
+        """Return a streaming body for the object or a range of it."""
+        data = self._get(Bucket, Key, 'GetObject')
+        if Range is not None:
+            start, end = RANGE_PATTERN.match(Range).groups()
+            end = int(end) if end else len(data) - 1
+            data = data[int(start):end + 1]
+        return {'Body': StreamingBody(BytesIO(data), len(data)),
+                'ContentLength': len(data)}
+
+    def head_object(self, Bucket, Key):  # noqa: N803
+        """Return the object's metadata."""
+        return {'ContentLength': len(self._get(Bucket, Key, 'HeadObject'))}
+
+    def delete_object(self, Bucket, Key):  # noqa: N803
+        """Delete the object, if it exists."""
+        with self._lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def copy_object(self, Bucket, Key, CopySource):  # noqa: N803
+        """Copy an object within the fake."""
+        data = self._get(CopySource['Bucket'], CopySource['Key'], 'CopyObject')
+        return self.put_object(Bucket=Bucket, Key=Key, Body=data)
+
+    def generate_presigned_url(self, ClientMethod, Params,  # noqa: N803
+                               ExpiresIn=3600):
+        """Return a URL that looks presigned."""
+        return 'https://fake-s3.local/{}/{}?Expires={}&Signature=fake'.format(
+            Params['Bucket'], Params['Key'], ExpiresIn)
+
+    def _get(self, bucket, key, operation):
+        """Return an object's bytes or raise S3's NoSuchKey error."""
+        try:
+            return self.objects[(bucket, key)]
+        except KeyError:
+            raise ClientError({'Error': {'Code': 'NoSuchKey',
+                                         'Message': 'Not Found'}}, operation)
+
+
+class FakeS3Storage(S3Storage):
+    """S3Storage backed by a FakeS3Client, for tests."""
+
+    name = 'fake-s3'
+
+    @classmethod
+    def from_config(cls, config, client=None):
+        """Create the backend with its own fake client."""
+        return super(FakeS3Storage, cls).from_config(
+            config, client=client or FakeS3Client())
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""Storage on the local file system."""
+import hashlib
+import os
+import string
+
+from .base import LimitedReader, StorageBackend, copy_file
+
+
+HEX_DIGITS = set(string.hexdigits)
+
+#: Files in the root directory that aren't uploads
+IGNORED_FILES = set(['README.md'])
+
+
+def shard_prefix(name, fanout):
+    """Return the fan-out directories for a file name, e.g. ['ab', 'cd'].
+
+    Names that already start with enough hex digits (content hashes, UUIDs)
+    are sharded by those; anything else by the MD5 of the name.
+    """
+    digits = name[:2 * fanout]
+    if len(digits) < 2 * fanout or not set(digits) <= HEX_DIGITS:
+        digits = hashlib.md5(name.encode('utf-8')).hexdigest()
+    return [digits[i:i + 2].lower() for i in range(0, 2 * fanout, 2)]
+
+
+class LocalStorage(StorageBackend):
+    """Keeps files in a directory on the local file system.
+
+    New files are fanned out into ``fanout`` levels of two-hex-digit
+    directories (``ab/cd/abcdef...png``) so no single directory grows huge.
+    Files saved flat, before sharding, are still found, including after
+    `flask shard-uploads` has moved them into their shard directory.
+
+    Locations are absolute paths, which is also what uploads saved before
+    storage backends existed have in their retrieval_location.
+    """
+
+    name = 'local'
+
+    def __init__(self, root, fanout=2):
+        """Keep files under the directory ``root``.
+
+        :param root string: the directory to keep files in
+        :param fanout int: (default: 2) levels of shard directories for new
+            files, or 0 to save them flat
+        """
+        self.root = root
+        self.fanout = fanout
+
+    @classmethod
+    def from_config(cls, config):
+        """Keep files in UPLOADS_DIR."""
+        return cls(config['UPLOADS_DIR'], config['UPLOADS_DIR_FANOUT'])
+
+    def sharded_path(self, key):
+        """Return the absolute path a new file with this key is saved to."""
+        dirname, name = os.path.split(key)
+        return os.path.join(self.root, dirname,
+                            *shard_prefix(name, self.fanout) + [name])
+
+    def path(self, location):
+        """Return the absolute path for a location.
+
+        A flat location in the root directory whose file has been moved to
+        its shard directory resolves to the sharded path.
+        """
+        fpath = os.path.join(self.root, location)
+        if (self.fanout and
+                os.path.dirname(os.path.normpath(fpath)) ==
+                os.path.normpath(self.root) and
+                not os.path.exists(fpath)):
+            sharded = self.sharded_path(os.path.basename(fpath))
+            if os.path.exists(sharded):
+                return sharded
+        return fpath
+
+    def locate(self, key):
+        """Return the path a file saved under ``key`` ends up at."""
+        return self.sharded_path(key)
+
+    def local_path(self, location):
+        """Return the absolute path of a file."""
+        return self.path(location)
+
+    def save(self, key, fp):
+        """Save a file in its shard directory."""
+        fpath = self.sharded_path(key)
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+        with open(fpath, 'wb') as dest:
+            copy_file(fp, dest)
+        return fpath
+
+    def open(self, location, start=0, end=None):
+        """Open a file, seeking to the start of the range."""
+        fp = open(self.path(location), 'rb')
+        size = os.fstat(fp.fileno()).st_size
+        if start == 0 and end is None:
+            return fp, size
+        end = size - 1 if end is None else min(end, size - 1)
+        fp.seek(start)
+        length = max(end - start + 1, 0)
+        return LimitedReader(fp, length), length
+
+    def size(self, location):
+        """Return the size of a file in bytes."""
+        return os.path.getsize(self.path(location))
+
+    def delete(self, location):
+        """Delete a file."""
+        try:
+            os.remove(self.path(location))
+        except FileNotFoundError:
+            pass
+
+    def move(self, location, key):
+        """Rename a file into the shard directory for the new key."""
+        fpath = self.sharded_path(key)
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+        os.replace(self.path(location), fpath)
+        return fpath
+
+    def unsharded_files(self):
+        """Yield the names of files still saved flat in the root directory."""
+        for entry in os.scandir(self.root):
+            if (entry.is_file() and not entry.name.startswith('.') and
+                    entry.name not in IGNORED_FILES):
+                yield entry.name
+
+    def shard(self, name):
+        """Move a flat file into its shard directory.
+
+        :return string: the file's new path
+        """
+        return self.move(os.path.join(self.root, name), name)
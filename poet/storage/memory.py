@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Storage in memory."""
+from io import BytesIO
+from threading import Lock
+
+from .base import StorageBackend
+
+
+class MemoryStorage(StorageBackend):
+    """Keeps files in a dict in the current process.
+
+    Files disappear with the process, so this is only useful for tests and
+    for benchmarking the rest of the stack without I/O.
+    """
+
+    name = 'memory'
+
+    def __init__(self):
+        """Start with no files."""
+        self.files = {}
+        self._lock = Lock()
+
+    def save(self, key, fp):
+        """Read the whole file into memory."""
+        data = fp.read()
+        with self._lock:
+            self.files[key] = data
+        return key
+
+    def open(self, location, start=0, end=None):
+        """Open a file, or a byte range of it."""
+        data = self._get(location)
+        if end is None:
+            end = len(data) - 1
+        data = data[start:end + 1]
+        return BytesIO(data), len(data)
+
+    def size(self, location):
+        """Return the size of a file in bytes."""
+        return len(self._get(location))
+
+    def delete(self, location):
+        """Delete a file."""
+        with self._lock:
+            self.files.pop(location, None)
+
+    def move(self, location, key):
+        """Move a file to a new key."""
+        with self._lock:
+            try:
+                self.files[key] = self.files.pop(location)
+            except KeyError:
+                raise FileNotFoundError(location)
+        return key
+
+    def _get(self, location):
+        """Return a file's contents or raise FileNotFoundError."""
+        try:
+            return self.files[location]
+        except KeyError:
+            raise FileNotFoundError(location)
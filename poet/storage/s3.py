@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Storage in an S3 bucket."""
+from contextlib import contextmanager
+
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+from flask import current_app
+
+from .base import StorageBackend
+
+#: S3 error codes that mean the object isn't there
+MISSING_CODES = set(['404', 'NoSuchKey', 'NotFound'])
+
+
+class S3Storage(StorageBackend):
+    """Keeps files as objects in an S3 bucket. Locations are object keys."""
+
+    name = 's3'
+    serves_urls = True
+
+    def __init__(self, bucket, transfer_config=None, client=None):
+        """Keep files in ``bucket``.
+
+        :param bucket string: the name of the bucket
+        :param transfer_config TransferConfig: (default: None) tuning for
+            multipart uploads
+        :param client: (default: None) the S3 client to use instead of the
+            app's shared one
+        """
+        self.bucket = bucket
+        self.transfer_config = transfer_config or TransferConfig()
+        self._client = client
+
+    @classmethod
+    def from_config(cls, config, client=None):
+        """Create the backend from the app's configuration."""
+        return cls(config['S3_UPLOADS_BUCKET'], TransferConfig(
+            multipart_threshold=config['S3_MULTIPART_THRESHOLD'],
+            multipart_chunksize=config['S3_MULTIPART_CHUNKSIZE'],
+            max_concurrency=config['S3_MAX_CONCURRENCY']), client=client)
+
+    @property
+    def client(self):
+        """The S3 client."""
+        return self._client or current_app.extensions['aws'].client('s3')
+
+    def save(self, key, fp):
+        """Upload a file.
+
+        Files bigger than the multipart threshold are sent as a multipart
+        upload with several parts in flight. The file is read sequentially,
+        so when it is a stream, such as the request body, sending to S3
+        overlaps with receiving from the client.
+        """
+        self.client.upload_fileobj(fp, self.bucket, key,
+                                   Config=self.transfer_config)
+        return key
+
+    def open(self, location, start=0, end=None):
+        """Open a streaming body, using a ranged GET for partial reads.
+
+        The object is requested eagerly, so a missing key raises here rather
+        than halfway through a response.
+        """
+        kwargs = {'Bucket': self.bucket, 'Key': location}
+        if start or end is not None:
+            kwargs['Range'] = 'bytes={}-{}'.format(
+                start, '' if end is None else end)
+        with missing_as_not_found(location):
+            s3_object = self.client.get_object(**kwargs)
+        return s3_object['Body'], s3_object['ContentLength']
+
+    def size(self, location):
+        """Return the size of an object in bytes."""
+        with missing_as_not_found(location):
+            return self.client.head_object(
+                Bucket=self.bucket, Key=location)['ContentLength']
+
+    def delete(self, location):
+        """Delete an object."""
+        self.client.delete_object(Bucket=self.bucket, Key=location)
+
+    def move(self, location, key):
+        """Move an object with a server-side copy."""
+        with missing_as_not_found(location):
+            self.client.copy_object(
+                Bucket=self.bucket, Key=key,
+                CopySource={'Bucket': self.bucket, 'Key': location})
+        self.delete(location)
+        return key
+
+    def presigned_url(self, location, expires_in):
+        """Return a presigned GET URL for the object."""
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': location},
+            ExpiresIn=expires_in)
+
+
+@contextmanager
+def missing_as_not_found(location):
+    """Turn a missing-object ClientError into the standard FileNotFoundError.
+
+    :param location string: the object key, for the error message
+    """
+    try:
+        yield
+    except ClientError as exc:
+        if exc.response.get('Error', {}).get('Code') in MISSING_CODES:
+            raise FileNotFoundError(location) from exc
+        raise
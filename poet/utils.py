@@ -1,9 +1,17 @@
 # -*- coding: utf-8 -*-
 """Helper utilities and decorators."""
-from threading import Thread
+import datetime as dt
+import time
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from threading import Lock, Thread
+from uuid import UUID
 
 from flask import Blueprint, current_app, request
 
+from .engine import use_replica
+from .errors import RequestEntityTooLarge
+from .locales import Errors
+
 
 def friendly_arg_get(key, default=None, type_cast=None):
     """Same as request.args.get but returns default on ValueError."""
@@ -13,6 +21,47 @@ def friendly_arg_get(key, default=None, type_cast=None):
         return default
 
 
+def get_ids_arg():
+    """Return the comma separated IDs in the `ids` argument, if it was sent.
+
+    :return list: the IDs, or None if there is no `ids` argument
+    :raises RequestEntityTooLarge: if there are more than BATCH_FETCH_MAX
+    """
+    if 'ids' not in request.args:
+        return None
+    ids = [uid for uid in request.args['ids'].split(',') if uid]
+    if len(ids) > current_app.config['BATCH_FETCH_MAX']:
+        raise RequestEntityTooLarge(Errors.TOO_MANY_ITEMS)
+    return ids
+
+
+CURSOR_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_cursor(created_at, uid):
+    """Encode a (created_at, id) keyset position as an opaque cursor.
+
+    :param created_at datetime: the creation time of the last row on a page
+    :param uid UUID: the ID of the last row on a page
+    :return string: a URL-safe cursor for the page after it
+    """
+    raw = '{}|{}'.format(created_at.strftime(CURSOR_DATETIME_FORMAT), uid)
+    return urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor made by `encode_cursor`.
+
+    :param cursor string: the cursor
+    :return tuple: the (created_at, id) position it encodes
+    :raises ValueError: if the cursor is malformed
+    """
+    padded = cursor + '=' * (-len(cursor) % 4)
+    created_at, uid = urlsafe_b64decode(padded.encode()).decode().split('|')
+    return (dt.datetime.strptime(created_at, CURSOR_DATETIME_FORMAT),
+            UUID(uid))
+
+
 class FlaskThread(Thread):
     """A utility class for threading in a flask app."""
 
@@ -27,6 +76,57 @@ class FlaskThread(Thread):
             super().run()
 
 
+class TokenBucket(object):
+    """Paces work to a steady rate while allowing short bursts.
+
+    Tokens are added at `rate` a second, up to `capacity`. Taking more tokens
+    than there are puts the bucket in debt and sleeps until the rate has
+    paid it off, so callers that share a bucket never exceed the rate
+    together. It is safe to share between threads.
+
+    Example usage:
+
+        bucket = TokenBucket(rate=14)  # SES's default quota
+
+        for chunk in chunks:
+            bucket.acquire(len(chunk))
+            send(chunk)
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic,
+                 sleep=time.sleep):
+        """Create a full bucket.
+
+        :param rate float: tokens added per second
+        :param capacity float: (default: None) the most tokens the bucket
+            holds, i.e. the biggest burst; defaults to one second's worth
+        """
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = Lock()
+        self._tokens = self.capacity
+        self._updated = clock()
+
+    def acquire(self, tokens=1):
+        """Take tokens, sleeping until the rate allows for them.
+
+        :param tokens float: (default: 1) how many tokens to take
+        :return float: the seconds slept
+        """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens +
+                               (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            wait = max(0, -self._tokens / self.rate)
+        if wait:
+            self._sleep(wait)
+        return wait
+
+
 class RESTBlueprint(Blueprint):
     """A base class for a RESTful API's view blueprint.
 
@@ -75,15 +175,23 @@ class RESTBlueprint(Blueprint):
         kwargs['methods'] = ['POST']
         return self.flexible_route('/', *args, **kwargs)
 
+    def read_only_route(self, *args, **kwargs):
+        """A flexible_route whose queries may go to a read replica."""
+        route = self.flexible_route(*args, **kwargs)
+
+        def decorator(view):
+            return route(use_replica(view))
+        return decorator
+
     def list(self, *args, **kwargs):
         """CRUD.list corresponds to a GET."""
         kwargs['methods'] = ['GET']
-        return self.flexible_route('/', *args, **kwargs)
+        return self.read_only_route('/', *args, **kwargs)
 
     def find(self, *args, **kwargs):
         """CRUD.find corresponds to a GET."""
         kwargs['methods'] = ['GET']
-        return self.flexible_route('/<string:uid>', *args, **kwargs)
+        return self.read_only_route('/<string:uid>', *args, **kwargs)
 
     def update(self, *args, **kwargs):
         """CRUD.update corresponds to a PATCH."""
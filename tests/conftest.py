@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
 """Defines fixtures available to all tests."""
+from contextlib import contextmanager
 
 import pytest
+from sqlalchemy import event
 from webtest import TestApp
 
 from poet.app import create_app
 from poet.database import db as _db
+from poet.extensions import aws
 from poet.settings import TestConfig
 
 from .factories import AnnotationFactory, UploadFactory, UserFactory
@@ -65,3 +68,41 @@ def annotation(db, upload):
     annotation = AnnotationFactory(upload=upload)
     db.session.commit()
     return annotation
+
+
+@pytest.fixture
+def aws_credentials(monkeypatch):
+    """Fake AWS credentials so clients can be built offline."""
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    aws.clear()
+    yield
+    aws.clear()
+
+
+@pytest.fixture
+def max_queries(db):
+    """Assert that a block of code runs no more than a given number of queries.
+
+    Usage: ::
+
+        with max_queries(2):
+            testapp.get('/api/v1/annotations')
+    """
+    @contextmanager
+    def assert_max_queries(expected):
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        assert len(statements) <= expected, \
+            'Expected at most {} queries, got {}:\n{}'.format(
+                expected, len(statements), '\n'.join(statements))
+
+    return assert_max_queries
@@ -2,7 +2,7 @@
 """Factories to help in tests."""
 from io import BytesIO
 
-from factory import PostGenerationMethodCall, Sequence
+from factory import PostGenerationMethodCall, Sequence, post_generation
 from factory.alchemy import SQLAlchemyModelFactory
 from werkzeug.datastructures import FileStorage
 
@@ -37,9 +37,12 @@ class UploadFactory(BaseFactory):
     """Upload factory."""
 
     filename = Sequence(lambda n: 'upload{0}.png'.format(n))
-    retrieval_location = PostGenerationMethodCall(
-        'save_file', FileStorage(stream=BytesIO(b'hello world'),
-                                 filename='testfile.png'))
+
+    @post_generation
+    def retrieval_location(self, create, extracted, **kwargs):
+        """Save a fresh file for every upload the factory builds."""
+        self.save_file(FileStorage(stream=BytesIO(b'hello world'),
+                                   filename='testfile.png'))
 
     class Meta:
         """Factory configuration."""
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""Tests for the pooled AWS client registry."""
+import os
+
+import pytest
+
+from poet.extensions import aws
+
+
+@pytest.mark.usefixtures('app', 'aws_credentials')
+class TestAWSClients:
+    """AWSClients tests."""
+
+    def test_client_is_reused(self):
+        """Test that the same client is handed out for the same service."""
+        assert aws.client('s3') is aws.client('s3')
+
+    def test_clients_keyed_by_region(self):
+        """Test that different regions get different clients."""
+        assert (aws.client('ses', region_name='us-east-1') is not
+                aws.client('ses', region_name='us-west-2'))
+
+    def test_pool_size_from_config(self, app):
+        """Test that the connection pool size comes from the config."""
+        app.config['AWS_MAX_POOL_CONNECTIONS'] = 3
+        s3 = aws.client('s3')
+        assert s3.meta.config.max_pool_connections == 3
+
+    def test_new_process_gets_new_client(self, monkeypatch):
+        """Test that clients are rebuilt after a fork."""
+        s3 = aws.client('s3')
+        monkeypatch.setattr(os, 'getpid', lambda: -1)
+        assert aws.client('s3') is not s3
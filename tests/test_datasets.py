@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""Tests for training dataset exports."""
+import json
+import os
+import tarfile
+import zipfile
+from io import BytesIO
+
+import pytest
+from click.testing import CliRunner
+from flask.cli import ScriptInfo
+
+from poet.commands import export_dataset
+from poet.datasets import MANIFEST_NAME, export_dataset as export
+from poet.extensions import aws, storage
+from poet.models import Upload
+from poet.storage import FakeS3Client, S3Storage
+
+from .factories import AnnotationFactory, UploadFactory
+
+
+@pytest.fixture
+def uploads(db):
+    """Three uploads with two annotations each, and one with none."""
+    uploads = [UploadFactory() for _ in range(3)]
+    for upload in uploads:
+        AnnotationFactory.create_batch(2, upload=upload)
+    UploadFactory()
+    db.session.commit()
+    return sorted(uploads, key=lambda upload: upload.id)
+
+
+def run(app, *args):
+    """Run the export-dataset command and check that it succeeded."""
+    result = CliRunner().invoke(export_dataset, args,
+                                obj=ScriptInfo(create_app=lambda info: app))
+    assert result.exit_code == 0, result.output
+    return result
+
+
+@pytest.mark.usefixtures('db')
+class TestExportDataset:
+    """Test the export-dataset command."""
+
+    def test_tar_shards(self, app, uploads, tmpdir):
+        """Test that samples are sharded WebDataset style with a manifest."""
+        run(app, str(tmpdir), '--shard-samples', '2', '--workers', '2')
+        with open(str(tmpdir.join(MANIFEST_NAME))) as fp:
+            manifest = json.load(fp)
+        assert manifest['samples'] == 3
+        assert [shard['samples'] for shard in manifest['shards']] == [2, 1]
+
+        names, labels = [], {}
+        for shard in manifest['shards']:
+            path = str(tmpdir.join(shard['name']))
+            assert os.path.getsize(path) == shard['bytes']
+            with tarfile.open(path) as archive:
+                for member in archive.getmembers():
+                    names.append(member.name)
+                    if member.name.endswith('.json'):
+                        labels[member.name] = json.loads(
+                            archive.extractfile(member).read().decode())
+        assert names == [name for upload in uploads for name in (
+            '{}.png'.format(upload.id), '{}.json'.format(upload.id))]
+        first = labels['{}.json'.format(uploads[0].id)]
+        assert first['filename'] == uploads[0].filename
+        assert len(first['annotations']) == 2
+
+    def test_zip_by_size(self, app, uploads, tmpdir):
+        """Test that zip shards hold as many samples as fit in their size."""
+        run(app, str(tmpdir), '--format', 'zip', '--shard-size', '0')
+        shards = sorted(name for name in os.listdir(str(tmpdir))
+                        if name.endswith('.zip'))
+        # with no room, every sample starts a shard of its own
+        assert shards == ['poet-000000.zip', 'poet-000001.zip',
+                          'poet-000002.zip']
+        with zipfile.ZipFile(str(tmpdir.join(shards[0]))) as archive:
+            assert archive.read('{}.png'.format(uploads[0].id)) == \
+                b'hello world'
+
+    def test_missing_file(self, db, app, uploads, tmpdir):
+        """Test that uploads whose files are gone are listed and skipped."""
+        # the uploads share a blob, so point one elsewhere instead of
+        # deleting its file
+        uploads[1].retrieval_location = storage.backend.locate('gone.png')
+        db.session.commit()
+        result = run(app, str(tmpdir))
+        assert 'Skipped 1 uploads' in result.output
+        with open(str(tmpdir.join(MANIFEST_NAME))) as fp:
+            manifest = json.load(fp)
+        assert manifest['samples'] == 2
+        assert manifest['missing'] == [str(uploads[1].id)]
+
+    def test_progress_includes_skipped(self, db, uploads, tmpdir):
+        """Test that progress hears about skipped samples as well."""
+        uploads[1].retrieval_location = storage.backend.locate('gone.png')
+        db.session.commit()
+        reported = []
+        export(str(tmpdir), workers=2,
+               progress=lambda sample, skipped: reported.append(
+                   (sample.key, skipped)))
+        assert sorted(reported) == [(str(upload.id), upload is uploads[1])
+                                    for upload in uploads]
+
+    def test_s3_shared_client(self, app, tmpdir, monkeypatch):
+        """Test that fetch threads can reach the app's shared S3 client."""
+        client = FakeS3Client()
+        monkeypatch.setattr(aws, 'client', lambda *args, **kwargs: client)
+        app.config['STORAGE_BACKEND'] = 's3'
+        app.extensions['storage']['s3'] = S3Storage(
+            app.config['S3_UPLOADS_BUCKET'])
+        upload = Upload.create('photo.png', BytesIO(b'stored in s3'))
+        AnnotationFactory(upload=upload)
+        run(app, str(tmpdir), '--workers', '2')
+        with tarfile.open(str(tmpdir.join('poet-000000.tar'))) as archive:
+            assert archive.extractfile('{}.png'.format(upload.id)).read() == \
+                b'stored in s3'
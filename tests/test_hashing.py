@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Tests for password hashing."""
+import pytest
+
+from poet.hashing import PasswordHasher, get_rounds
+
+
+@pytest.fixture
+def pooled_hasher(app):
+    """A hasher running bcrypt in a single worker process."""
+    hasher = PasswordHasher()
+    hasher.init_app(app)
+    app.config['PASSWORD_HASH_WORKERS'] = 1
+    yield hasher
+    hasher.shutdown()
+
+
+class TestPasswordHasher:
+    """Test the PasswordHasher extension."""
+
+    def test_pool(self, app, pooled_hasher):
+        """Test that hashes made in the pool verify and use the set rounds."""
+        pw_hash = pooled_hasher.hash('correct horse')
+        assert get_rounds(pw_hash) == app.config['BCRYPT_LOG_ROUNDS']
+        assert pooled_hasher.verify(pw_hash, 'correct horse') is True
+        assert pooled_hasher.verify(pw_hash, 'battery staple') is False
+
+    def test_needs_rehash(self, app, pooled_hasher):
+        """Test that hashes made at other rounds are flagged."""
+        pw_hash = pooled_hasher.hash('correct horse')
+        assert not pooled_hasher.needs_rehash(pw_hash)
+        app.config['BCRYPT_LOG_ROUNDS'] += 1
+        assert pooled_hasher.needs_rehash(pw_hash)
+
+    def test_empty_password(self, pooled_hasher):
+        """Test that empty passwords are refused."""
+        with pytest.raises(ValueError):
+            pooled_hasher.hash('')
+        assert pooled_hasher.verify(None, 'correct horse') is False
+
+    def test_start(self, pooled_hasher):
+        """Test that starting the pool forks its workers up front."""
+        pooled_hasher.start()
+        assert pooled_hasher._executor._processes
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Tests for per-request SQL instrumentation."""
+import json
+import logging
+
+import pytest
+from flask import g
+from sqlalchemy.exc import DBAPIError
+
+from .test_metrics import sample
+
+
+class ListHandler(logging.Handler):
+    """A logging handler that keeps every record it's sent."""
+
+    def __init__(self):
+        """Start with no records."""
+        super(ListHandler, self).__init__()
+        self.records = []
+
+    def emit(self, record):
+        """Keep the record."""
+        self.records.append(record)
+
+
+@pytest.fixture
+def log_records():
+    """Capture the instrumentation logger's records."""
+    handler = ListHandler()
+    logger = logging.getLogger('poet.instrumentation')
+    level = logger.level
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    yield handler.records
+    logger.removeHandler(handler)
+    logger.setLevel(level)
+
+
+@pytest.fixture
+def instrumented(app):
+    """Turn SQL instrumentation on."""
+    app.config['SQL_INSTRUMENTATION'] = True
+    return app
+
+
+@pytest.mark.usefixtures('db', 'instrumented')
+class TestSQLInstrumentation:
+    """SQL instrumentation tests."""
+
+    @pytest.fixture
+    def user_url(self, db, user):
+        """The URL of a user the view will have to load with SQL."""
+        url = '/api/v1/users/{}'.format(user.id)
+        db.session.expire_all()
+        return url
+
+    def test_server_timing(self, app, testapp, user_url):
+        """Test that the queries are reported in a Server-Timing header."""
+        app.config['SQL_INSTRUMENTATION_SERVER_TIMING'] = True
+        res = testapp.get(user_url)
+        metrics = res.headers['Server-Timing'].split(', ')
+        assert metrics[0].startswith('db;desc="1 queries";dur=')
+        assert metrics[-1].startswith('app;dur=')
+
+    def test_log_line(self, app, testapp, user_url, log_records):
+        """Test that each request logs its stats as JSON."""
+        app.config['SQL_INSTRUMENTATION_LOG'] = True
+        testapp.get(user_url)
+        line = json.loads(log_records[-1].getMessage())
+        assert line['endpoint'] == 'api.v1.users.find_user'
+        assert line['queries'] == 1
+        assert line['status'] == 200
+        assert line['slowest_statement'].startswith('SELECT')
+
+    def test_histograms_per_endpoint(self, testapp, user_url):
+        """Test that queries and DB time are recorded per endpoint."""
+        labels = {'endpoint': 'api.v1.users.find_user'}
+        before = [sample('poet_request_db_queries_count', **labels),
+                  sample('poet_request_db_queries_sum', **labels)]
+        for _ in range(2):
+            testapp.get(user_url)
+        # the second request is served from the cache
+        assert sample('poet_request_db_queries_count', **labels) == \
+            before[0] + 2
+        assert sample('poet_request_db_queries_sum', **labels) == \
+            before[1] + 1
+        assert sample('poet_request_db_seconds_sum', **labels) > 0
+
+    def test_off(self, app, testapp, user_url):
+        """Test that nothing is measured when instrumentation is off."""
+        app.config['SQL_INSTRUMENTATION'] = False
+        labels = {'endpoint': 'api.v1.users.find_user'}
+        before = sample('poet_request_db_queries_count', **labels)
+        res = testapp.get(user_url)
+        assert 'Server-Timing' not in res.headers
+        assert sample('poet_request_db_queries_count', **labels) == before
+
+    def test_failed_statement(self, app, db):
+        """Test that a failed statement is counted and leaves nothing behind."""
+        with app.test_request_context():
+            app.preprocess_request()
+            connection = db.session.connection()
+            with pytest.raises(DBAPIError):
+                connection.execute('SELECT * FROM no_such_table')
+            assert connection.info['query_started'] == []
+            assert g.sql_stats.queries == 1
+            db.session.rollback()
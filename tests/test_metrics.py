@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Tests for the Prometheus metrics."""
+import pytest
+from botocore.exceptions import ClientError
+from botocore.stub import Stubber
+from prometheus_client import REGISTRY
+
+from poet.extensions import aws
+
+
+def sample(name, **labels):
+    """Return the current value of a metric sample, or 0 if it has none."""
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@pytest.mark.usefixtures('db')
+class TestMetrics:
+    """Metrics tests."""
+
+    def test_request_latency(self, testapp):
+        """Test that requests are timed per endpoint and show up on /metrics."""
+        labels = {'endpoint': 'public.healthcheck', 'method': 'GET',
+                  'status': '200'}
+        before = sample('poet_request_duration_seconds_count', **labels)
+        testapp.get('/healthcheck')
+        assert sample('poet_request_duration_seconds_count',
+                      **labels) == before + 1
+        res = testapp.get('/metrics')
+        assert 'poet_request_duration_seconds_bucket{' in res.text
+        assert sample('poet_requests_in_flight') == 0
+
+    def test_disabled(self, app, testapp):
+        """Test that /metrics can be turned off."""
+        app.config['METRICS_ENABLED'] = False
+        testapp.get('/metrics', status=404)
+
+    def test_pool_checkout_wait(self, db):
+        """Test that connection checkouts from the pool are timed."""
+        before = sample('poet_db_pool_checkout_seconds_count',
+                        database='primary')
+        in_use = sample('poet_db_pool_connections_in_use', database='primary')
+        connection = db.engine.connect()
+        assert sample('poet_db_pool_checkout_seconds_count',
+                      database='primary') == before + 1
+        assert sample('poet_db_pool_connections_in_use',
+                      database='primary') == in_use + 1
+        connection.close()
+        assert sample('poet_db_pool_connections_in_use',
+                      database='primary') == in_use
+
+    def test_upload_bytes(self, testapp):
+        """Test that upload bytes in and out are counted."""
+        received = sample('poet_upload_bytes_total', direction='in')
+        sent = sample('poet_upload_bytes_total', direction='out')
+        res = testapp.post('/api/v1/uploads', upload_files=[
+            ('file', 'test.png', b'twelve bytes')])
+        testapp.get('/api/v1/uploads/{}/file'.format(res.json['data']['id']))
+        assert sample('poet_upload_bytes_total', direction='in') == \
+            received + 12
+        assert sample('poet_upload_bytes_total', direction='out') == \
+            sent + 12
+
+    @pytest.mark.usefixtures('aws_credentials')
+    def test_aws_calls(self):
+        """Test that AWS calls are timed and their errors counted."""
+        s3 = aws.client('s3', region_name='us-east-1')
+        labels = {'service': 's3', 'operation': 'HeadObject'}
+        calls = sample('poet_aws_call_duration_seconds_count', **labels)
+        errors = sample('poet_aws_call_errors_total', error='404', **labels)
+        with Stubber(s3) as stubber:
+            stubber.add_response('head_object', {})
+            stubber.add_client_error('head_object', '404')
+            s3.head_object(Bucket='bucket', Key='found')
+            with pytest.raises(ClientError):
+                s3.head_object(Bucket='bucket', Key='missing')
+        assert sample('poet_aws_call_duration_seconds_count',
+                      **labels) == calls + 2
+        assert sample('poet_aws_call_errors_total', error='404',
+                      **labels) == errors + 1
@@ -1,12 +1,39 @@
 # -*- coding: utf-8 -*-
 """Model unit tests."""
 import datetime as dt
+import os
+from io import BytesIO
+from uuid import uuid4
 
 import pytest
+from click.testing import CliRunner
+from flask import current_app
+from flask.cli import ScriptInfo
 
+from poet.commands import backfill_blobs
+from poet.caching import resource_cache_key
+from poet.database import atomic
+from poet.errors import BadRequest
+from poet.extensions import cache
+from poet.hashing import get_rounds
+from poet.models.annotation import Annotation
+from poet.models.blob import Blob
+from poet.models.upload import Upload
 from poet.models.user import Role, User
 
-from .factories import UserFactory
+from .factories import AnnotationFactory, UploadFactory, UserFactory
+
+
+class NonSeekableFile(object):
+    """A file-like that can only be read front to back, like a socket."""
+
+    def __init__(self, data):
+        """Wrap some bytes."""
+        self._fp = BytesIO(data)
+
+    def read(self, size=-1):
+        """Read from the bytes."""
+        return self._fp.read(size)
 
 
 @pytest.mark.usefixtures('db')
@@ -50,6 +77,16 @@ class TestUser:
         assert user.check_password('foobarbaz123') is True
         assert user.check_password('barfoobaz') is False
 
+    def test_rehash_on_login(self, app, db):
+        """Check a password hashed at old rounds is rehashed on login."""
+        user = User.create(email='foo@bar.com', password='foobarbaz123')
+        app.config['BCRYPT_LOG_ROUNDS'] = 5
+        assert user.check_password('foobarbaz123') is True
+        db.session.commit()
+        db.session.expire(user)
+        assert get_rounds(user.password) == 5
+        assert user.check_password('foobarbaz123') is True
+
     def test_full_name(self):
         """User full name."""
         user = UserFactory(first_name='Foo', last_name='Bar')
@@ -63,3 +100,255 @@ class TestUser:
         user.roles.append(role)
         user.save()
         assert role in user.roles
+
+
+@pytest.mark.usefixtures('db')
+class TestBlob:
+    """Blob tests."""
+
+    def test_duplicate_uploads_share_blob(self):
+        """Test that uploading the same contents twice stores them once."""
+        first = Upload.create('first.png', BytesIO(b'same contents'))
+        second = Upload.create('second.png', BytesIO(b'same contents'))
+        assert first.blob is second.blob
+        assert first.retrieval_location == second.retrieval_location
+        assert first.blob.refcount == 2
+        assert Blob.query.count() == 1
+
+    def test_streamed_duplicate_shares_blob(self):
+        """Test that a non-seekable duplicate is deduplicated after saving."""
+        first = Upload.create('first.png', BytesIO(b'streamed contents'))
+        second = Upload.create('second.png',
+                               NonSeekableFile(b'streamed contents'))
+        assert first.blob is second.blob
+        assert first.blob.refcount == 2
+        staging_dir = os.path.join(current_app.config['UPLOADS_DIR'],
+                                   'staging')
+        assert not [files for _, _, files in os.walk(staging_dir) if files]
+
+    def test_streamed_upload_stored_under_hash(self):
+        """Test that a new non-seekable upload ends up under its hash."""
+        upload = Upload.create('new.png', NonSeekableFile(b'new contents'))
+        assert os.path.basename(upload.retrieval_location) == \
+            upload.blob.sha256 + '.png'
+        with upload.retrieve_file() as fp:
+            assert fp.read() == b'new contents'
+
+    def test_delete_releases_blob(self):
+        """Test that the file is deleted along with its last upload."""
+        first = Upload.create('first.png', BytesIO(b'shared contents'))
+        second = Upload.create('second.png', BytesIO(b'shared contents'))
+        location = first.retrieval_location
+        first.delete()
+        assert Blob.query.get(second.blob_sha256).refcount == 1
+        assert os.path.exists(location)
+        second.delete()
+        assert Blob.query.count() == 0
+        assert not os.path.exists(location)
+
+    def test_rolled_back_delete_keeps_file(self, db):
+        """Test that the file outlives a delete that is rolled back."""
+        upload = Upload.create('only.png', BytesIO(b'only contents'))
+        location = upload.retrieval_location
+        with pytest.raises(RuntimeError):
+            with atomic():
+                upload.delete()
+                raise RuntimeError()
+        assert Blob.query.count() == 1
+        assert os.path.exists(location)
+
+    def test_backfill(self, app, db):
+        """Test that legacy uploads get attached to deduplicated blobs."""
+        legacy = []
+        for name in ('legacy1.png', 'legacy2.png'):
+            fpath = os.path.join(app.config['UPLOADS_DIR'], name)
+            with open(fpath, 'wb') as fp:
+                fp.write(b'legacy contents')
+            legacy.append(Upload(filename=name, retrieval_location=fpath))
+        db.session.add_all(legacy)
+        db.session.commit()
+        fresh = UploadFactory()
+        db.session.commit()
+        legacy_ids = [upload.id for upload in legacy]
+        fresh_id = fresh.id
+
+        result = CliRunner().invoke(
+            backfill_blobs, ['--delete-duplicates'],
+            obj=ScriptInfo(create_app=lambda info: app))
+        assert result.exit_code == 0, result.output
+        first, second = [Upload.find(upload_id) for upload_id in legacy_ids]
+        fresh = Upload.find(fresh_id)
+        assert first.blob_sha256 == second.blob_sha256
+        assert first.retrieval_location == second.retrieval_location
+        assert first.blob.refcount == 2
+        assert fresh.blob.refcount == 1
+        legacy_paths = [os.path.join(app.config['UPLOADS_DIR'], name)
+                        for name in ('legacy1.png', 'legacy2.png')]
+        assert [os.path.exists(path) for path in legacy_paths].count(True) == 1
+        assert os.path.exists(first.retrieval_location)
+
+
+@pytest.mark.usefixtures('db')
+class TestEagerLoading:
+    """Model.eager tests."""
+
+    def test_nested_collection(self, db, annotation, max_queries):
+        """Test that a path through a collection loads without fanning out."""
+        db.session.expire_all()
+        with max_queries(2):
+            uploads = Upload.eager('annotations.upload').all()
+            assert uploads[0].annotations[0].upload is uploads[0]
+
+
+@pytest.mark.usefixtures('db')
+class TestFindMany:
+    """UUIDMixin.find_many tests."""
+
+    def test_order_and_missing(self, db):
+        """Test that records come back in request order with misses listed."""
+        uploads = [UploadFactory() for _ in range(3)]
+        db.session.commit()
+        missing_id = str(uuid4())
+        ids = [str(uploads[2].id), missing_id, str(uploads[0].id)]
+        found, missing = Upload.find_many(ids)
+        assert found == [uploads[2], uploads[0]]
+        assert missing == [missing_id]
+
+    def test_identity_map_first(self, db, max_queries):
+        """Test that records already loaded aren't queried again."""
+        first, second = UploadFactory(), UploadFactory()
+        db.session.commit()
+        Upload.query.get(first.id)
+        with max_queries(1) as statements:
+            found, _ = Upload.find_many([first.id, second.id])
+        assert found == [first, second]
+        assert str(first.id) not in str(statements)
+
+    def test_cache_first(self, db, max_queries):
+        """Test that serialized records are served from the cache first."""
+        first, second = UploadFactory(), UploadFactory()
+        db.session.commit()
+
+        def dump(upload):
+            return {'id': str(upload.id)}
+        ids = [first.id, second.id]
+        Upload.find_many(ids[:1], dump=dump)
+        db.session.expire_all()
+        with max_queries(1) as statements:
+            found, _ = Upload.find_many(ids, dump=dump)
+        assert found == [{'id': str(ids[0])}, {'id': str(ids[1])}]
+        assert str(ids[0]) not in str(statements)
+        assert cache.get(resource_cache_key(Upload, (ids[1],))) == \
+            {'id': str(ids[1])}
+
+    def test_bad_id(self):
+        """Test that a malformed ID is a 400."""
+        with pytest.raises(BadRequest):
+            Upload.find_many(['asdf'])
+
+
+@pytest.mark.usefixtures('db')
+class TestBulkOperations:
+    """CRUDMixin bulk method tests."""
+
+    def test_bulk_create(self, db, upload, max_queries):
+        """Test that records are inserted a batch at a time, with defaults."""
+        rows = [{'upload_id': upload.id, 'description': str(i)}
+                for i in range(5)]
+        with max_queries(4):
+            created = Annotation.bulk_create(rows, batch_size=2)
+        assert len(created) == 5
+        annotations = Annotation.query.order_by(Annotation.description).all()
+        assert [annotation.id for annotation in annotations] == \
+            [row.id for row in created]
+        assert all(annotation.created_at for annotation in annotations)
+
+    def test_bulk_create_returning(self, upload):
+        """Test that the asked for columns come back for each record."""
+        created = Annotation.bulk_create(
+            [{'upload_id': upload.id, 'description': 'one'},
+             {'upload_id': upload.id, 'description': 'two',
+              'category': 'Bar Chart'}], returning=['description', 'category'])
+        assert [tuple(row) for row in created] == [
+            ('one', None), ('two', 'Bar Chart')]
+
+    def test_bulk_update(self, db, upload, max_queries):
+        """Test that records are updated by primary key, whatever they set."""
+        first, second, third = (AnnotationFactory(upload=upload)
+                                for _ in range(3))
+        db.session.commit()
+        rows = [{'id': first.id, 'description': 'new'},
+                {'id': second.id, 'description': 'newer'},
+                {'id': third.id, 'category': 'Bar Chart'}]
+        with max_queries(2) as statements:
+            updated = Annotation.bulk_update(rows)
+        assert not any(' SET id=' in statement for statement in statements)
+        assert updated == 3
+        assert (first.description, second.description, third.category) == \
+            ('new', 'newer', 'Bar Chart')
+
+    def test_bulk_delete(self, db, upload):
+        """Test that records are deleted by primary key."""
+        annotations = [AnnotationFactory(upload=upload) for _ in range(3)]
+        db.session.commit()
+        deleted = Annotation.bulk_delete(
+            [annotation.id for annotation in annotations[:2]], batch_size=1)
+        assert deleted == 2
+        assert Annotation.query.all() == annotations[2:]
+
+    def test_bulk_invalidate_on_commit(self, db, upload):
+        """Test that bulk changes drop cached copies when they commit."""
+        first, second = (AnnotationFactory(upload=upload) for _ in range(2))
+        db.session.commit()
+        keys = [resource_cache_key(Annotation, (annotation.id,))
+                for annotation in (first, second)]
+        for key in keys:
+            cache.set(key, 'stale')
+        Annotation.bulk_update([{'id': first.id, 'description': 'new'}],
+                               commit=False)
+        Annotation.bulk_delete([second.id], commit=False)
+        assert [cache.get(key) for key in keys] == ['stale', 'stale']
+        db.session.commit()
+        assert [cache.get(key) for key in keys] == [None, None]
+
+    def test_atomic(self, db, upload):
+        """Test that saves in an atomic block commit together, or not at all."""
+        with pytest.raises(RuntimeError):
+            with atomic():
+                Annotation.create(upload=upload, description='kept?')
+                with atomic():
+                    Annotation.create(upload=upload, description='kept?')
+                raise RuntimeError()
+        assert Annotation.query.count() == 0
+
+        with atomic():
+            for i in range(3):
+                Annotation.create(upload=upload, description=str(i))
+        db.session.rollback()
+        assert Annotation.query.count() == 3
+
+    def test_invalidate_on_commit(self, db, upload):
+        """Test that cached copies are dropped only once a save commits."""
+        key = resource_cache_key(Upload, (upload.id,))
+        cache.set(key, 'stale')
+        with pytest.raises(RuntimeError):
+            with atomic():
+                upload.update(filename='rolled-back.png')
+                assert cache.get(key) == 'stale'
+                raise RuntimeError()
+        assert cache.get(key) == 'stale'
+
+        with atomic():
+            upload.update(filename='kept.png')
+            assert cache.get(key) == 'stale'
+        assert cache.get(key) is None
+
+    def test_invalidate_after_savepoint(self, db, upload):
+        """Test that committing a SAVEPOINT leaves cached copies alone."""
+        key = resource_cache_key(Upload, (upload.id,))
+        cache.set(key, 'stale')
+        db.session.begin_nested()
+        upload.update(filename='savepoint.png')
+        assert cache.get(key) == 'stale'
+        db.session.commit()
+        assert cache.get(key) is None
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Tests for upload renditions."""
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from poet.extensions import cache, storage
+from poet.models.upload import Upload
+from poet.renditions import Rendition, get_rendition, pool
+
+
+def make_png(width=800, height=400):
+    """Return the bytes of a solid PNG image."""
+    fp = BytesIO()
+    Image.new('RGB', (width, height), (200, 30, 30)).save(fp, 'PNG')
+    return fp.getvalue()
+
+
+@pytest.mark.usefixtures('db')
+class TestRendition:
+    """Rendition tests."""
+
+    def test_resizes_to_width(self):
+        """Test that a rendition keeps the aspect ratio at the new width."""
+        upload = Upload.create('photo.png', BytesIO(make_png()))
+        rendition = get_rendition(upload, 320)
+        fp, _ = storage.backend.open(rendition.locate())
+        with fp:
+            image = Image.open(BytesIO(fp.read()))
+        assert image.format == 'WEBP'
+        assert image.size == (320, 160)
+
+    def test_never_upscales(self):
+        """Test that a small image isn't blown up past its own size."""
+        upload = Upload.create('small.png', BytesIO(make_png(100, 50)))
+        fp, _ = storage.backend.open(get_rendition(upload, 640).locate())
+        with fp:
+            assert Image.open(BytesIO(fp.read())).size == (100, 50)
+
+    def test_duplicates_share_renditions(self):
+        """Test that uploads with the same contents share renditions."""
+        data = make_png()
+        first = Upload.create('first.png', BytesIO(data))
+        second = Upload.create('second.png', BytesIO(data))
+        assert get_rendition(first, 160).locate() == \
+            get_rendition(second, 160).locate()
+
+    def test_not_an_image(self):
+        """Test that a file Pillow can't read has no renditions."""
+        upload = Upload.create('fake.png', BytesIO(b'not an image'))
+        assert get_rendition(upload, 160) is None
+
+    def test_svg(self):
+        """Test that vector images aren't resized."""
+        upload = Upload.create('drawing.svg', BytesIO(b'<svg></svg>'))
+        assert get_rendition(upload, 160) is None
+
+    def test_pool_generates_every_width(self, app):
+        """Test that the background pool builds every configured width."""
+        upload = Upload.create('photo.png', BytesIO(make_png()))
+        pool.submit(upload).result()
+        for width in app.config['UPLOAD_RENDITION_WIDTHS']:
+            rendition = Rendition(upload, width, 'webp')
+            assert storage.backend.exists(
+                storage.backend.locate(rendition.key))
+
+    def test_deleted_with_blob(self):
+        """Test that renditions are removed along with their blob."""
+        upload = Upload.create('photo.png', BytesIO(make_png()))
+        location = get_rendition(upload, 160).locate()
+        upload.delete()
+        assert not storage.backend.exists(location)
+
+    def test_cached_location_trusted(self, monkeypatch):
+        """Test that a cached location is used without touching storage."""
+        upload = Upload.create('photo.png', BytesIO(make_png()))
+        location = get_rendition(upload, 160).locate()
+
+        def exists(location):
+            raise AssertionError('storage was checked')
+        monkeypatch.setattr(storage.backend, 'exists', exists)
+        assert get_rendition(upload, 160).locate() == location
+
+    def test_forget_regenerates(self):
+        """Test that a forgotten rendition whose file is gone is rebuilt."""
+        upload = Upload.create('photo.png', BytesIO(make_png()))
+        rendition = get_rendition(upload, 160)
+        location = rendition.locate()
+        storage.backend.delete(location)
+        rendition.forget()
+        assert rendition.locate() == location
+        assert storage.backend.exists(location)
+
+    def test_decompression_bomb(self, monkeypatch):
+        """Test that an image too big to decode safely isn't resized."""
+        monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 1000)
+        upload = Upload.create('bomb.png', BytesIO(make_png(801, 401)))
+        assert get_rendition(upload, 160) is None
+
+    def test_cache_timeouts(self, app, monkeypatch):
+        """Test that neither locations nor failures are cached forever."""
+        timeouts = {}
+
+        def record_set(key, value, timeout=None):
+            timeouts[value] = timeout
+        monkeypatch.setattr(cache, 'set', record_set)
+        get_rendition(Upload.create('photo.png', BytesIO(make_png())), 160)
+        get_rendition(Upload.create('fake.png', BytesIO(b'not an image')), 160)
+        assert sorted(timeouts.values()) == [
+            app.config['UPLOAD_RENDITION_UNSUPPORTED_TIMEOUT'],
+            app.config['UPLOAD_RENDITION_CACHE_TIMEOUT']]
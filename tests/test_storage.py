@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Tests for the storage backends."""
+import os
+from io import BytesIO
+
+import pytest
+from click.testing import CliRunner
+from flask.cli import ScriptInfo
+
+from poet.commands import shard_uploads
+from poet.storage import FakeS3Storage, LocalStorage, MemoryStorage
+
+from .test_models import NonSeekableFile
+
+
+@pytest.fixture(params=['local', 'memory', 'fake-s3'])
+def backend(request, app, tmpdir):
+    """Each storage backend, set up to run without outside services."""
+    if request.param == 'local':
+        return LocalStorage(str(tmpdir))
+    elif request.param == 'memory':
+        return MemoryStorage()
+    return FakeS3Storage.from_config(app.config)
+
+
+class TestStorageBackend:
+    """Tests every backend must pass."""
+
+    def test_save_and_open(self, backend):
+        """Test that a saved file reads back whole."""
+        location = backend.save('file.png', BytesIO(b'hello world'))
+        fp, length = backend.open(location)
+        assert length == 11
+        assert fp.read() == b'hello world'
+        fp.close()
+
+    def test_save_stream(self, backend):
+        """Test that a non-seekable stream can be saved."""
+        location = backend.save('dir/file.png',
+                                NonSeekableFile(b'hello world'))
+        assert backend.size(location) == 11
+
+    def test_ranged_open(self, backend):
+        """Test that a byte range reads back just those bytes."""
+        location = backend.save('file.png', BytesIO(b'hello world'))
+        fp, length = backend.open(location, start=6, end=9)
+        assert length == 4
+        assert fp.read() == b'worl'
+        fp.close()
+        fp, length = backend.open(location, start=6)
+        assert fp.read() == b'world'
+        fp.close()
+
+    def test_exists_and_delete(self, backend):
+        """Test that deleted files are gone, and deleting twice is fine."""
+        location = backend.save('file.png', BytesIO(b'hello world'))
+        assert backend.exists(location)
+        backend.delete(location)
+        assert not backend.exists(location)
+        backend.delete(location)
+
+    def test_move(self, backend):
+        """Test that a moved file is only at its new location."""
+        location = backend.save('staging/file.png', BytesIO(b'hello world'))
+        new_location = backend.move(location, 'file.png')
+        assert not backend.exists(location)
+        fp, _ = backend.open(new_location)
+        assert fp.read() == b'hello world'
+        fp.close()
+
+    def test_missing_file(self, backend):
+        """Test that missing files raise FileNotFoundError."""
+        with pytest.raises(FileNotFoundError):
+            backend.open('missing.png')
+        with pytest.raises(FileNotFoundError):
+            backend.size('missing.png')
+
+
+class TestLocalStorage:
+    """Tests for the sharded local directory layout."""
+
+    def test_save_is_sharded(self, tmpdir):
+        """Test that new files are saved two hex directories deep."""
+        backend = LocalStorage(str(tmpdir))
+        location = backend.save('abcdef.png', BytesIO(b'hello world'))
+        assert location == os.path.join(str(tmpdir), 'ab', 'cd', 'abcdef.png')
+
+    def test_non_hex_names_are_sharded(self, tmpdir):
+        """Test that names without a hex prefix are sharded by their hash."""
+        backend = LocalStorage(str(tmpdir))
+        location = backend.save('photo.png', BytesIO(b'hello world'))
+        assert len(os.path.relpath(location, str(tmpdir)).split(os.sep)) == 3
+
+    def test_flat_layout(self, tmpdir):
+        """Test that a fanout of 0 saves files flat."""
+        backend = LocalStorage(str(tmpdir), fanout=0)
+        location = backend.save('abcdef.png', BytesIO(b'hello world'))
+        assert location == os.path.join(str(tmpdir), 'abcdef.png')
+
+    def test_legacy_flat_location(self, tmpdir):
+        """Test that flat files are found before and after sharding."""
+        legacy = tmpdir.join('abcdef_legacy.png')
+        legacy.write(b'hello world')
+        backend = LocalStorage(str(tmpdir))
+        assert backend.size(str(legacy)) == 11
+        backend.shard('abcdef_legacy.png')
+        assert not legacy.exists()
+        assert backend.local_path(str(legacy)) == os.path.join(
+            str(tmpdir), 'ab', 'cd', 'abcdef_legacy.png')
+        fp, _ = backend.open(str(legacy))
+        assert fp.read() == b'hello world'
+        fp.close()
+
+    def test_shard_command(self, app, tmpdir):
+        """Test that the command moves every flat upload file."""
+        app.config['UPLOADS_DIR'] = str(tmpdir)
+        tmpdir.join('README.md').write(b'not an upload')
+        for name in ('0123_a.png', '4567_b.png'):
+            tmpdir.join(name).write(b'hello world')
+        result = CliRunner().invoke(
+            shard_uploads, obj=ScriptInfo(create_app=lambda info: app))
+        assert result.exit_code == 0, result.output
+        assert tmpdir.join('01', '23', '0123_a.png').exists()
+        assert tmpdir.join('45', '67', '4567_b.png').exists()
+        assert tmpdir.join('README.md').exists()
+        assert list(LocalStorage(str(tmpdir)).unsharded_files()) == []
+
+
+@pytest.mark.usefixtures('db')
+class TestFakeS3Uploads:
+    """Test the uploads API against the S3 stand-in."""
+
+    def test_upload_roundtrip(self, app, testapp):
+        """Test that a file uploaded to S3 streams back intact."""
+        app.config['STORAGE_BACKEND'] = 'fake-s3'
+        res = testapp.post('/api/v1/uploads', upload_files=[
+            ('file', 'test.png', b'this is a test file')])
+        file_res = testapp.get(
+            '/api/v1/uploads/{}/file'.format(res.json['data']['id']))
+        assert file_res.body == b'this is a test file'
+
+    def test_presigned_redirect(self, app, testapp, upload):
+        """Test that S3 storage can redirect to a presigned URL."""
+        app.config['STORAGE_BACKEND'] = 'fake-s3'
+        app.config['UPLOAD_RETRIEVAL_MODE'] = 'presigned'
+        res = testapp.get('/api/v1/uploads/{}/file'.format(upload.id),
+                          status=302)
+        assert res.location.startswith('https://fake-s3.local/')
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""Tests for the helper utilities."""
+from poet.utils import TokenBucket
+
+
+class FakeClock(object):
+    """A clock that only moves when something sleeps."""
+
+    def __init__(self):
+        """Start at zero."""
+        self.now = 0.0
+
+    def __call__(self):
+        """Return the current time."""
+        return self.now
+
+    def sleep(self, seconds):
+        """Move the clock forward."""
+        self.now += seconds
+
+
+class TestTokenBucket:
+    """TokenBucket tests."""
+
+    def test_burst_then_paced(self):
+        """Test that a full bucket allows a burst, then paces to the rate."""
+        clock = FakeClock()
+        bucket = TokenBucket(rate=10, clock=clock, sleep=clock.sleep)
+        for _ in range(10):
+            assert bucket.acquire() == 0
+        assert bucket.acquire(5) == 0.5
+        assert clock.now == 0.5
+
+    def test_sustained_rate(self):
+        """Test that taking many tokens never beats the rate."""
+        clock = FakeClock()
+        bucket = TokenBucket(rate=14, clock=clock, sleep=clock.sleep)
+        for _ in range(10):
+            bucket.acquire(50)
+        # the first 14 came free, every other token waited its turn
+        assert abs(clock.now - (500 - 14) / 14) < 1e-9
@@ -1,8 +1,20 @@
 # -*- coding: utf-8 -*-
 """Tests for the annotations API routes."""
+import csv
+import datetime as dt
+import gzip
+import io
+import json
 from uuid import uuid4
 
 import pytest
+from click.testing import CliRunner
+from flask.cli import ScriptInfo
+
+from poet.commands import export_annotations
+from poet.models import Annotation
+
+from ..factories import AnnotationFactory, UploadFactory
 
 
 @pytest.mark.usefixtures('db')
@@ -29,6 +41,12 @@ class TestFindAnnotation:
         assert res.json['data']['id'] == str(annotation.id)
         assert res.json['data']['category'] is not None
 
+    def test_delete_invalidates(self, testapp, annotation):
+        """Test that a deleted annotation isn't served from the cache."""
+        testapp.get(self.base_url.format(id=annotation.id))
+        annotation.delete()
+        testapp.get(self.base_url.format(id=annotation.id), status=404)
+
 
 @pytest.mark.usefixtures('db')
 class TestCreateAnnotation:
@@ -62,3 +80,196 @@ class TestCreateAnnotation:
         assert res.json['message']
         assert res.json['data']['description'] == desc
         assert res.json['data']['category'] == category
+
+
+@pytest.mark.usefixtures('db')
+class TestListAnnotations:
+    """Test the list_annotations view."""
+
+    base_url = '/api/v1/annotations'
+
+    @pytest.fixture
+    def annotations(self, db, upload):
+        """Create five annotations a minute apart, oldest first."""
+        start = dt.datetime(2017, 1, 1)
+        annotations = [
+            AnnotationFactory(upload=upload,
+                              created_at=start + dt.timedelta(minutes=i),
+                              category='Line Chart' if i % 2 else 'Map')
+            for i in range(5)]
+        db.session.commit()
+        return annotations
+
+    def test_pages_newest_first(self, testapp, annotations):
+        """Test that following cursors walks every annotation once."""
+        seen = []
+        params = {'limit': 2}
+        while True:
+            res = testapp.get(self.base_url, params=params)
+            seen.extend(item['id'] for item in res.json['data'])
+            if res.json['next_cursor'] is None:
+                break
+            params['cursor'] = res.json['next_cursor']
+        assert seen == [str(a.id) for a in reversed(annotations)]
+
+    def test_ties_on_created_at(self, db, testapp, upload):
+        """Test that annotations created at the same time aren't skipped."""
+        created_at = dt.datetime(2017, 1, 1)
+        annotations = [AnnotationFactory(upload=upload, created_at=created_at)
+                       for _ in range(3)]
+        db.session.commit()
+        res = testapp.get(self.base_url, params={'limit': 2})
+        res2 = testapp.get(self.base_url, params={
+            'limit': 2, 'cursor': res.json['next_cursor']})
+        ids = [item['id'] for item in res.json['data'] + res2.json['data']]
+        assert sorted(ids) == sorted(str(a.id) for a in annotations)
+
+    def test_filters(self, testapp, upload, annotations):
+        """Test filtering by upload, category and creation time."""
+        res = testapp.get(self.base_url, params={
+            'upload_id': str(upload.id), 'category': 'Map',
+            'created_after': '2017-01-01T00:01:00',
+            'created_before': '2017-01-01T00:04:00'})
+        assert [item['id'] for item in res.json['data']] == \
+            [str(annotations[2].id)]
+        res = testapp.get(self.base_url, params={'user_id': str(uuid4())})
+        assert res.json['data'] == []
+
+    def test_uploads_loaded_eagerly(self, db, testapp, max_queries):
+        """Test that a page of annotations doesn't load uploads one by one."""
+        for _ in range(3):
+            AnnotationFactory(upload=UploadFactory())
+        db.session.commit()
+        db.session.expire_all()
+        with max_queries(1):
+            res = testapp.get(self.base_url)
+        assert all(item['upload']['id'] for item in res.json['data'])
+
+    def test_batch_fetch(self, testapp, annotations, max_queries):
+        """Test fetching annotations by ID in one query."""
+        missing_id = str(uuid4())
+        ids = [str(annotations[3].id), missing_id, str(annotations[1].id)]
+        with max_queries(1):
+            res = testapp.get(self.base_url, params={'ids': ','.join(ids)})
+        assert [item['id'] for item in res.json['data']] == \
+            [ids[0], ids[2]]
+        assert res.json['missing'] == [missing_id]
+
+    def test_bad_cursor(self, testapp):
+        """Test that a mangled cursor is a 400."""
+        res = testapp.get(self.base_url, params={'cursor': 'nope'},
+                          status=400)
+        assert res.json['error_code'] == 'bad-cursor'
+
+    def test_limit_out_of_range(self, testapp):
+        """Test that a page can't be made arbitrarily big."""
+        testapp.get(self.base_url, params={'limit': 1000}, status=422)
+
+
+@pytest.mark.usefixtures('db')
+class TestCreateAnnotations:
+    """Test the create_annotations view."""
+
+    base_url = '/api/v1/annotations/bulk'
+
+    def test_bulk_create(self, testapp, upload, max_queries):
+        """Test that a batch is inserted with a constant number of queries."""
+        items = [{'description': 'annotation {}'.format(i),
+                  'upload_id': str(upload.id)} for i in range(20)]
+        items[0]['category'] = 'Map'
+        with max_queries(3):
+            res = testapp.post_json(self.base_url, items)
+        assert [item['status'] for item in res.json['data']] == [201] * 20
+        annotation = Annotation.find(res.json['data'][0]['id'])
+        assert annotation.category == 'Map'
+        assert annotation.upload_id == upload.id
+        assert Annotation.query.count() == 20
+
+    def test_per_item_results(self, testapp, upload):
+        """Test that bad items are reported without sinking the batch."""
+        res = testapp.post_json(self.base_url, [
+            {'description': 'fine', 'upload_id': str(upload.id)},
+            {'upload_id': str(upload.id)},
+            {'description': 'no such upload', 'upload_id': str(uuid4())}])
+        statuses = [item['status'] for item in res.json['data']]
+        assert statuses == [201, 422, 404]
+        assert 'description' in res.json['data'][1]['error_message']
+        assert Annotation.query.count() == 1
+
+    def test_none_created(self, testapp, upload):
+        """Test that a batch where every item is skipped gets a 422."""
+        res = testapp.post_json(self.base_url, [
+            {'upload_id': str(upload.id)},
+            {'description': 'no such upload', 'upload_id': str(uuid4())}],
+            status=422)
+        assert res.json['message'][0] == 'annotations-not-created'
+        assert [item['status'] for item in res.json['data']] == [422, 404]
+        assert res.json['data'][0]['error_code'] == 'data-validation-error'
+        assert Annotation.query.count() == 0
+
+    def test_not_a_list(self, testapp):
+        """Test that the body has to be a list."""
+        testapp.post_json(self.base_url, {'description': 'one'}, status=422)
+
+    def test_too_many(self, app, testapp):
+        """Test that a batch can't be arbitrarily big."""
+        app.config['ANNOTATIONS_BULK_MAX'] = 2
+        testapp.post_json(self.base_url, [{}] * 3, status=413)
+
+
+@pytest.mark.usefixtures('db')
+class TestExportAnnotations:
+    """Test the export_annotations view and command."""
+
+    base_url = '/api/v1/annotations/export'
+
+    @pytest.fixture
+    def annotations(self, db, upload):
+        """Create four annotations, the last three at the same moment."""
+        start = dt.datetime(2017, 1, 1)
+        first = AnnotationFactory(upload=upload, created_at=start)
+        tied = [AnnotationFactory(upload=upload,
+                                  created_at=start + dt.timedelta(minutes=1))
+                for _ in range(3)]
+        db.session.commit()
+        return [first] + sorted(tied, key=lambda annotation: annotation.id)
+
+    def test_ndjson(self, testapp, upload, annotations):
+        """Test that annotations stream oldest first, with their uploads."""
+        res = testapp.get(self.base_url)
+        assert res.content_type == 'application/x-ndjson'
+        records = [json.loads(line) for line in res.text.splitlines()]
+        assert [record['id'] for record in records] == \
+            [str(annotation.id) for annotation in annotations]
+        assert records[0]['filename'] == upload.filename
+        assert records[0]['cdn_link'] == upload.cdn_link
+
+    def test_csv_gzipped(self, app, annotations):
+        """Test that clients accepting gzip get a gzipped CSV."""
+        # WebTest would quietly decompress the body, so use Flask's client
+        res = app.test_client().get(self.base_url + '?format=csv',
+                                    headers={'Accept-Encoding': 'gzip'})
+        assert res.headers['Content-Encoding'] == 'gzip'
+        rows = list(csv.DictReader(
+            io.StringIO(gzip.decompress(res.data).decode('utf-8'))))
+        assert [row['id'] for row in rows] == \
+            [str(annotation.id) for annotation in annotations]
+
+    def test_resume(self, testapp, annotations):
+        """Test that the last annotation received is a watermark to resume at."""
+        last = annotations[1]
+        res = testapp.get(self.base_url, params={
+            'since': last.created_at.isoformat(), 'since_id': str(last.id)})
+        assert [json.loads(line)['id'] for line in res.text.splitlines()] == \
+            [str(annotation.id) for annotation in annotations[2:]]
+
+    def test_command(self, app, annotations, tmpdir):
+        """Test that the command writes a gzipped export and how to resume."""
+        path = str(tmpdir.join('annotations.ndjson.gz'))
+        result = CliRunner().invoke(
+            export_annotations, ['--output', path],
+            obj=ScriptInfo(create_app=lambda info: app))
+        assert result.exit_code == 0, result.output
+        with gzip.open(path, 'rt') as export:
+            assert len(export.readlines()) == 4
+        assert '--since-id {}'.format(annotations[-1].id) in result.output
@@ -0,0 +1,238 @@
+# -*- encoding: utf-8 -*-
+"""Tests for the emails API view functions."""
+import datetime as dt
+from uuid import uuid4
+
+import pytest
+from botocore.stub import ANY, Stubber
+from click.testing import CliRunner
+from flask.cli import ScriptInfo
+
+from poet.api.v1.emails import queue, sending
+from poet.commands import email_worker
+from poet.extensions import aws
+from poet.models import EmailJob
+
+from ..factories import AnnotationFactory
+
+
+@pytest.fixture
+def send_email(monkeypatch):
+    """Replace sending with a fake that records emails and can fail."""
+    class FakeSend(object):
+        """Records emails instead of sending them."""
+
+        def __init__(self):
+            """Start with nothing sent."""
+            self.calls = []
+            self.error = None
+
+        def __call__(self, annotation_id, emails):
+            """Send emails, or raise `error` if it is set."""
+            if self.error is not None:
+                raise self.error
+            self.calls.append((annotation_id, emails))
+            return [None] * len(emails)
+
+        @property
+        def sent(self):
+            """Every (annotation ID, email) sent."""
+            return [(annotation_id, email)
+                    for annotation_id, emails in self.calls
+                    for email in emails]
+
+    fake = FakeSend()
+    monkeypatch.setattr(queue, 'send_emails', fake)
+    return fake
+
+
+@pytest.mark.usefixtures('db')
+class TestCreateEmail:
+    """Test the create_email view."""
+
+    base_url = '/api/v1/emails'
+
+    def test_queued(self, testapp, annotation, send_email):
+        """Test that an email is queued, not sent, within the request."""
+        res = testapp.post_json(self.base_url, {
+            'to_email': 'someone@example.com',
+            'annotation_id': str(annotation.id)}, status=202)
+        assert res.json['data']['status'] == 'queued'
+        assert send_email.sent == []
+
+    def test_missing_annotation(self, testapp):
+        """Test that emailing a nonexistent annotation is a 404."""
+        testapp.post_json(self.base_url, {
+            'to_email': 'someone@example.com',
+            'annotation_id': str(uuid4())}, status=404)
+
+
+@pytest.mark.usefixtures('db')
+class TestEmailDelivery:
+    """Test delivering queued emails."""
+
+    base_url = '/api/v1/emails/{}'
+
+    @pytest.fixture
+    def job_id(self, annotation):
+        """The ID of a queued email job."""
+        return queue.queue.enqueue(annotation, 'someone@example.com').id
+
+    def test_delivered(self, testapp, annotation, job_id, send_email):
+        """Test that a worker sends the email and the job reports it."""
+        assert [job.id for job in queue.deliver_next()] == [job_id]
+        assert send_email.sent == [(annotation.id, 'someone@example.com')]
+        res = testapp.get(self.base_url.format(job_id))
+        assert res.json['data']['status'] == 'sent'
+        assert res.json['data']['attempts'] == 1
+        assert queue.deliver_next() == []
+
+    def test_retry_with_backoff(self, app, job_id, send_email):
+        """Test that a failed send is retried later, then given up on."""
+        app.config['EMAIL_MAX_ATTEMPTS'] = 2
+        send_email.error = RuntimeError('SES is down')
+        job, = queue.deliver_next()
+        assert job.status == 'queued'
+        assert 'SES is down' in job.last_error
+        assert job.next_attempt_at > dt.datetime.utcnow()
+        # not due yet
+        assert queue.deliver_next() == []
+        job.update(next_attempt_at=dt.datetime.utcnow())
+        assert queue.deliver_next()[0].status == 'failed'
+
+    def test_expired_lease(self, job_id, send_email):
+        """Test that a job held by a worker that died is taken over."""
+        job, = EmailJob.claim_next(lease=60)
+        job.update(next_attempt_at=dt.datetime.utcnow())
+        assert queue.deliver_next()[0].status == 'sent'
+
+    def test_email_worker_command(self, app, job_id, send_email):
+        """Test that the email-worker command drains the queue."""
+        result = CliRunner().invoke(
+            email_worker, ['--burst'],
+            obj=ScriptInfo(create_app=lambda info: app))
+        assert result.exit_code == 0, result.output
+        assert EmailJob.find(job_id).status == 'sent'
+
+    def test_nonexistent_job(self, testapp):
+        """Test that an unknown job is a 404."""
+        testapp.get(self.base_url.format(uuid4()), status=404)
+
+
+@pytest.mark.usefixtures('db')
+class TestCreateBatchEmail:
+    """Test the create_batch_email view."""
+
+    base_url = '/api/v1/emails/batch'
+
+    def test_grouped_per_annotation(self, db, testapp, upload, send_email):
+        """Test that each annotation is sent to every address at once."""
+        annotations = [AnnotationFactory(upload=upload) for _ in range(2)]
+        db.session.commit()
+        emails = ['student{}@example.com'.format(i) for i in range(3)]
+        res = testapp.post_json(self.base_url, {
+            'to_emails': emails,
+            'annotation_ids': [str(a.id) for a in annotations]}, status=202)
+        assert len(res.json['data']) == 6
+        while queue.deliver_next():
+            pass
+        assert sorted(send_email.calls) == sorted(
+            (annotation.id, emails) for annotation in annotations)
+        assert EmailJob.query.filter_by(status='sent').count() == 6
+
+    def test_missing_annotation(self, testapp):
+        """Test that a nonexistent annotation is a 404."""
+        testapp.post_json(self.base_url, {
+            'to_emails': ['someone@example.com'],
+            'annotation_ids': [str(uuid4())]}, status=404)
+
+    def test_too_many(self, app, testapp, annotation):
+        """Test that a batch can't be arbitrarily big."""
+        app.config['EMAIL_BATCH_MAX'] = 1
+        testapp.post_json(self.base_url, {
+            'to_emails': ['a@example.com', 'b@example.com'],
+            'annotation_ids': [str(annotation.id)]}, status=413)
+
+
+@pytest.mark.usefixtures('db', 'aws_credentials')
+class TestSendSESEmails:
+    """Test sending emails through SES."""
+
+    def test_bulk_templated(self, app, monkeypatch):
+        """Test that addresses are sent in bulk calls of at most 50."""
+        monkeypatch.setattr(sending, 'created_ses_templates', set())
+        app.config['SES_MAX_SEND_RATE'] = 1000
+        ses = aws.client('ses', region_name='us-east-1')
+        emails = ['student{}@example.com'.format(i) for i in range(60)]
+        with Stubber(ses) as stubber:
+            stubber.add_response('create_template', {})
+            stubber.add_response('send_bulk_templated_email', {'Status': [
+                {'Status': 'Success'}] * 50})
+            stubber.add_response('send_bulk_templated_email', {'Status': [
+                {'Status': 'Success'}] * 9 + [
+                {'Status': 'MessageRejected', 'Error': 'Rejected'}]},
+                expected_params={
+                    'Source': app.config['FROM_EMAIL'],
+                    'Template': app.config['EMAIL_SES_TEMPLATE'],
+                    'DefaultTemplateData': ANY,
+                    'Destinations': [{'Destination': {'ToAddresses': [
+                        email]}} for email in emails[50:]]})
+            errors = sending.send_ses_emails('<p>hi</p>', emails)
+        assert errors == [None] * 59 + ['Rejected']
+
+    def test_send_rate_shares_quota(self, app):
+        """Test that each process gets its share of the account's quota."""
+        app.config.update(SES_MAX_SEND_RATE=None, SES_SEND_QUOTA=14,
+                          SES_SENDING_PROCESSES=4)
+        assert sending.get_send_rate() == 3.5
+        app.config['SES_MAX_SEND_RATE'] = 10
+        assert sending.get_send_rate() == 10
+
+
+@pytest.mark.usefixtures('db')
+class TestEmailBody:
+    """Test rendering and caching email bodies."""
+
+    @pytest.fixture
+    def renders(self, monkeypatch):
+        """Record every annotation an email body is rendered for."""
+        rendered = []
+        generate = sending.generate_email_body
+
+        def record(annotation):
+            rendered.append(annotation.id)
+            return generate(annotation)
+        monkeypatch.setattr(sending, 'generate_email_body', record)
+        return rendered
+
+    def test_cached(self, db, annotation, renders, max_queries):
+        """Test that a repeat send does no template or database work."""
+        annotation_id = annotation.id
+        body = sending.get_email_body(annotation_id)
+        assert annotation.description in body
+        db.session.expire_all()
+        with max_queries(0):
+            assert sending.get_email_body(annotation_id) == body
+        assert renders == [annotation_id]
+
+    def test_invalidated_on_update(self, annotation, renders):
+        """Test that changing the annotation renders a new body."""
+        sending.get_email_body(annotation.id)
+        annotation.update(description='A brand new description')
+        assert 'A brand new description' in sending.get_email_body(
+            annotation.id)
+        assert len(renders) == 2
+
+    def test_template_version(self, app, annotation, renders):
+        """Test that bodies from another template version are not sent."""
+        sending.get_email_body(annotation.id)
+        app.extensions['email_template_version'] = 'changed'
+        sending.get_email_body(annotation.id)
+        assert len(renders) == 2
+
+    def test_cache_disabled(self, app, annotation, renders):
+        """Test that bodies aren't cached when the cache isn't shared."""
+        app.config['CACHE_RESOURCES'] = False
+        sending.get_email_body(annotation.id)
+        sending.get_email_body(annotation.id)
+        assert len(renders) == 2
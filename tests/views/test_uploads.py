@@ -1,10 +1,20 @@
 # -*- encoding: utf-8 -*-
 """Tests for the uploads API view functions."""
+import os
 from io import BytesIO
 from uuid import uuid4
 
 from flask_login import login_user
+from PIL import Image
 import pytest
+from werkzeug.wsgi import FileWrapper
+
+from poet.extensions import storage
+from poet.models import Upload
+from poet.renditions import Rendition
+
+from ..factories import UploadFactory
+from ..test_renditions import make_png
 
 
 @pytest.mark.usefixtures('db')
@@ -51,6 +61,31 @@ class TestCreateUpload:
                 ('file', '', b'this is a test file')], status=400)
         assert res.status_code == 400
 
+    def test_stream_body(self, testapp):
+        """Test uploading a raw request body works fine."""
+        res = testapp.post(self.base_url + '?filename=test.png',
+                           params=b'this is a test file',
+                           content_type='image/png')
+        assert res.status_code == 200
+        assert res.json['data']['filename'] == 'test.png'
+        file_res = testapp.get(
+            '{}/{}/file'.format(self.base_url, res.json['data']['id']))
+        assert file_res.body == b'this is a test file'
+
+    def test_stream_empty_body(self, testapp):
+        """Test uploading an empty raw request body fails."""
+        res = testapp.post(self.base_url + '?filename=test.png', params=b'',
+                           content_type='image/png', status=422)
+        assert res.status_code == 422
+
+    def test_stream_body_too_large(self, app, testapp):
+        """Test uploading a raw request body over the size limit fails."""
+        app.config['MAX_CONTENT_LENGTH'] = 4
+        res = testapp.post(self.base_url + '?filename=test.png',
+                           params=b'this is a test file',
+                           content_type='image/png', status=413)
+        assert res.json['error_code'] == 'file-too-large'
+
     def test_bad_mediatype(self, testapp):
         """Test uploading with a non image type fails."""
         res = testapp.post(
@@ -60,6 +95,32 @@ class TestCreateUpload:
         assert res.status_code == 415
 
 
+@pytest.mark.usefixtures('db')
+class TestListUploads:
+    """Test the list_uploads view."""
+
+    base_url = '/api/v1/uploads'
+
+    def test_batch_fetch(self, db, testapp):
+        """Test fetching uploads by ID keeps the requested order."""
+        uploads = [UploadFactory() for _ in range(3)]
+        db.session.commit()
+        ids = [str(uploads[1].id), str(uploads[0].id)]
+        res = testapp.get(self.base_url, params={'ids': ','.join(ids)})
+        assert [item['id'] for item in res.json['data']] == ids
+        assert res.json['missing'] == []
+
+    def test_too_many_ids(self, app, testapp):
+        """Test that a batch can't be arbitrarily big."""
+        app.config['BATCH_FETCH_MAX'] = 1
+        testapp.get(self.base_url, status=413, params={
+            'ids': '{},{}'.format(uuid4(), uuid4())})
+
+    def test_bad_id(self, testapp):
+        """Test that a malformed ID is a 400."""
+        testapp.get(self.base_url, params={'ids': 'asdf'}, status=400)
+
+
 @pytest.mark.usefixtures('db')
 class TestGetUpload:
     """Test the find_upload view."""
@@ -77,3 +138,198 @@ class TestGetUpload:
         assert res.status_code == 200
         data = res.json['data']
         assert data['id'] == str(upload.id)
+
+
+@pytest.mark.usefixtures('db')
+class TestGetUploadFile:
+    """Test the get_upload_file view."""
+
+    base_url = '/api/v1/uploads/{}/file'
+
+    def test_get_nonexistent_upload_file(self, testapp):
+        """Test that getting the file of a nonexistent upload returns a 404."""
+        res = testapp.get(self.base_url.format(uuid4()), status=404)
+        assert res.status_code == 404
+
+    def test_stream_file(self, app, testapp, upload):
+        """Test that the file is streamed back as an attachment."""
+        app.config['UPLOAD_RETRIEVAL_MODE'] = 'stream'
+        app.config['UPLOAD_STREAM_CHUNK_SIZE'] = 4
+        res = testapp.get(self.base_url.format(upload.id))
+        assert res.status_code == 200
+        assert res.body == b'hello world'
+        assert res.content_length == len(b'hello world')
+        assert res.content_type == 'image/png'
+        assert upload.filename in res.headers['Content-Disposition']
+
+    def test_buffer_file(self, app, testapp, upload):
+        """Test that buffered retrieval still sends the whole file."""
+        app.config['UPLOAD_RETRIEVAL_MODE'] = 'buffer'
+        res = testapp.get(self.base_url.format(upload.id))
+        assert res.status_code == 200
+        assert res.body == b'hello world'
+
+    def test_missing_file(self, testapp, upload):
+        """Test that an upload whose file is gone returns a 404."""
+        os.remove(upload.retrieval_location)
+        res = testapp.get(self.base_url.format(upload.id), status=404)
+        assert res.json['error_code'] == 'file-not-found'
+
+    def test_cdn_redirect(self, app, testapp, upload):
+        """Test that CDN mode redirects to the upload's CDN link."""
+        app.config['UPLOAD_RETRIEVAL_MODE'] = 'cdn'
+        app.config['SAVE_UPLOADS_LOCALLY'] = False
+        res = testapp.get(self.base_url.format(upload.id), status=302)
+        assert res.location == upload.cdn_link
+
+    def test_rendition_cdn_redirect(self, app, testapp):
+        """Test that CDN mode redirects renditions to their CDN link too."""
+        app.config['UPLOAD_RETRIEVAL_MODE'] = 'cdn'
+        app.config['STORAGE_BACKEND'] = 'fake-s3'
+        upload = Upload.create('photo.png', BytesIO(make_png()))
+        res = testapp.get(self.base_url.format(upload.id),
+                          params={'size': 320}, status=302)
+        location = Rendition(upload, 320, 'webp').locate()
+        assert location.startswith('renditions/')
+        assert res.location == Upload.make_cdn_link(location)
+
+    def test_presigned_redirect_is_cached(self, app, testapp, upload,
+                                          monkeypatch):
+        """Test that presigned mode redirects and reuses the signature."""
+        monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+        monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+        app.config['UPLOAD_RETRIEVAL_MODE'] = 'presigned'
+        app.config['SAVE_UPLOADS_LOCALLY'] = False
+        first = testapp.get(self.base_url.format(upload.id), status=302)
+        second = testapp.get(self.base_url.format(upload.id), status=302)
+        assert upload.retrieval_location in first.location
+        assert 'Signature' in first.location
+        assert first.location == second.location
+
+    def test_redirect_falls_back_locally(self, app, testapp, upload):
+        """Test that redirect modes stream when uploads are saved locally."""
+        app.config['UPLOAD_RETRIEVAL_MODE'] = 'cdn'
+        res = testapp.get(self.base_url.format(upload.id))
+        assert res.body == b'hello world'
+
+    def test_validators(self, testapp, upload):
+        """Test that the file carries an ETag and Last-Modified."""
+        res = testapp.get(self.base_url.format(upload.id))
+        assert res.headers['ETag'] == '"{}"'.format(upload.blob_sha256)
+        assert res.headers['Last-Modified']
+        assert res.headers['Accept-Ranges'] == 'bytes'
+
+    def test_if_none_match(self, testapp, upload):
+        """Test that a matching ETag gets a 304."""
+        res = testapp.get(self.base_url.format(upload.id), status=304,
+                          headers={'If-None-Match':
+                                   '"{}"'.format(upload.blob_sha256)})
+        assert not res.body
+
+    def test_if_modified_since(self, testapp, upload):
+        """Test that an unchanged upload gets a 304."""
+        last_modified = testapp.get(
+            self.base_url.format(upload.id)).headers['Last-Modified']
+        testapp.get(self.base_url.format(upload.id), status=304,
+                    headers={'If-Modified-Since': last_modified})
+
+    def test_range(self, testapp, upload):
+        """Test that a byte range gets a 206 with just those bytes."""
+        res = testapp.get(self.base_url.format(upload.id), status=206,
+                          headers={'Range': 'bytes=6-'})
+        assert res.body == b'world'
+        assert res.headers['Content-Range'] == 'bytes 6-10/11'
+
+    def test_range_from_s3(self, app, testapp):
+        """Test that a byte range is read from S3 with a ranged GET."""
+        app.config['STORAGE_BACKEND'] = 'fake-s3'
+        res = testapp.post('/api/v1/uploads', upload_files=[
+            ('file', 'test.png', b'this is a test file')])
+        res = testapp.get(self.base_url.format(res.json['data']['id']),
+                          status=206, headers={'Range': 'bytes=0-3'})
+        assert res.body == b'this'
+
+    def test_unsatisfiable_range(self, testapp, upload):
+        """Test that a range past the end of the file gets a 416."""
+        res = testapp.get(self.base_url.format(upload.id), status=416,
+                          headers={'Range': 'bytes=50-60'})
+        assert res.headers['Content-Range'] == 'bytes */11'
+
+    def test_stale_if_range(self, testapp, upload):
+        """Test that a stale If-Range gets the whole file."""
+        res = testapp.get(self.base_url.format(upload.id),
+                          headers={'Range': 'bytes=0-4', 'If-Range': '"old"'})
+        assert res.status_code == 200
+        assert res.body == b'hello world'
+
+    def test_x_accel_redirect(self, app, testapp, upload):
+        """Test that nginx is handed the file with X-Accel-Redirect."""
+        app.config['UPLOAD_SENDFILE'] = 'x-accel-redirect'
+        res = testapp.get(self.base_url.format(upload.id))
+        relative_path = os.path.relpath(upload.retrieval_location,
+                                        app.config['UPLOADS_DIR'])
+        assert res.headers['X-Accel-Redirect'] == \
+            '/internal-uploads/' + relative_path
+        assert res.headers['ETag']
+        assert not res.body
+
+    def test_x_sendfile(self, app, testapp, upload):
+        """Test that the web server is handed the file with X-Sendfile."""
+        app.config['UPLOAD_SENDFILE'] = 'x-sendfile'
+        res = testapp.get(self.base_url.format(upload.id))
+        assert res.headers['X-Sendfile'] == upload.retrieval_location
+        assert not res.body
+
+    def test_sendfile_missing_file(self, app, testapp, upload):
+        """Test that a missing file is still a 404 with sendfile headers."""
+        app.config['UPLOAD_SENDFILE'] = 'x-sendfile'
+        os.remove(upload.retrieval_location)
+        testapp.get(self.base_url.format(upload.id), status=404)
+
+    def test_wsgi_file_wrapper(self, testapp, upload):
+        """Test that whole local files go through wsgi.file_wrapper."""
+        wrapped = []
+
+        class ServerFileWrapper(FileWrapper):
+            def __init__(self, fp, buffer_size):
+                wrapped.append(fp)
+                super(ServerFileWrapper, self).__init__(fp, buffer_size)
+
+        res = testapp.get(self.base_url.format(upload.id),
+                          extra_environ={'wsgi.file_wrapper':
+                                         ServerFileWrapper})
+        assert res.body == b'hello world'
+        assert wrapped[0].name == upload.retrieval_location
+
+    def test_rendition(self, testapp):
+        """Test that a size argument gets a resized rendition."""
+        res = testapp.post('/api/v1/uploads', upload_files=[
+            ('file', 'photo.png', make_png())])
+        res = testapp.get(self.base_url.format(res.json['data']['id']),
+                          params={'size': 320})
+        assert res.content_type == 'image/webp'
+        assert res.headers['ETag'].endswith('-320.webp"')
+        assert 'photo_320w.webp' in res.headers['Content-Disposition']
+        assert Image.open(BytesIO(res.body)).size == (320, 160)
+
+    def test_rendition_file_gone(self, testapp):
+        """Test that a rendition deleted behind the cache's back is rebuilt."""
+        upload = Upload.create('photo.png', BytesIO(make_png()))
+        url = self.base_url.format(upload.id)
+        testapp.get(url, params={'size': 320})
+        location = Rendition(upload, 320, 'webp').locate()
+        storage.backend.delete(location)
+        res = testapp.get(url, params={'size': 320})
+        assert Image.open(BytesIO(res.body)).size == (320, 160)
+        assert storage.backend.exists(location)
+
+    def test_unsupported_rendition_size(self, testapp, upload):
+        """Test that sizes other than the configured widths are refused."""
+        testapp.get(self.base_url.format(upload.id), params={'size': 333},
+                    status=400)
+
+    def test_rendition_falls_back_to_original(self, testapp, upload):
+        """Test that a file that can't be resized is sent as it is."""
+        res = testapp.get(self.base_url.format(upload.id),
+                          params={'size': 160})
+        assert res.body == b'hello world'
@@ -4,6 +4,15 @@ from uuid import uuid4
 
 import pytest
 
+from ..test_metrics import sample
+
+
+def cache_requests():
+    """Return how many user lookups have hit and missed the cache."""
+    return tuple(sample('poet_resource_cache_requests_total',
+                        resource='users', outcome=outcome)
+                 for outcome in ('hit', 'miss'))
+
 
 @pytest.mark.usefixtures('db')
 class TestFindUser:
@@ -27,3 +36,56 @@ class TestFindUser:
         res = testapp.get(self.base_url.format(id=user.id))
         assert res.status_code == 200
         assert res.json['data']['id'] == str(user.id)
+
+    def test_cached(self, testapp, user):
+        """Test that the second find is served from the cache."""
+        hits, misses = cache_requests()
+        res = testapp.get(self.base_url.format(id=user.id))
+        assert res.headers['X-Cache'] == 'MISS'
+        res = testapp.get(self.base_url.format(id=user.id))
+        assert res.headers['X-Cache'] == 'HIT'
+        assert res.json['data']['id'] == str(user.id)
+        assert cache_requests() == (hits + 1, misses + 1)
+
+    def test_update_invalidates(self, testapp, user):
+        """Test that updating a user drops the cached copy."""
+        testapp.get(self.base_url.format(id=user.id))
+        user.update(first_name='Renamed')
+        res = testapp.get(self.base_url.format(id=user.id))
+        assert res.headers['X-Cache'] == 'MISS'
+        assert res.json['data']['first_name'] == 'Renamed'
+
+    def test_cache_disabled(self, app, testapp, user):
+        """Test that finds skip the cache when it isn't shared."""
+        app.config['CACHE_RESOURCES'] = False
+        res = testapp.get(self.base_url.format(id=user.id))
+        assert 'X-Cache' not in res.headers
+
+
+@pytest.mark.usefixtures('db')
+class TestListUsers:
+    """Test the list_users view."""
+
+    base_url = '/api/v1/users'
+
+    def test_batch_fetch(self, testapp, user):
+        """Test fetching users by ID reports the missing ones."""
+        missing_id = str(uuid4())
+        res = testapp.get(self.base_url,
+                          params={'ids': '{},{}'.format(missing_id, user.id)})
+        assert [item['id'] for item in res.json['data']] == [str(user.id)]
+        assert res.json['missing'] == [missing_id]
+
+    def test_batch_fetch_cached(self, testapp, user):
+        """Test that batch fetches share the find endpoint's cache."""
+        testapp.get(self.base_url, params={'ids': str(user.id)})
+        hits, misses = cache_requests()
+        res = testapp.get('/api/v1/users/{}'.format(user.id))
+        assert res.headers['X-Cache'] == 'HIT'
+        res = testapp.get(self.base_url, params={'ids': str(user.id)})
+        assert [item['id'] for item in res.json['data']] == [str(user.id)]
+        assert cache_requests() == (hits + 2, misses)
+
+    def test_ids_required(self, testapp):
+        """Test that users can't be listed without IDs."""
+        testapp.get(self.base_url, status=400)